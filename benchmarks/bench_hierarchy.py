@@ -0,0 +1,132 @@
+"""
+Сравнение загрузки иерархии объект -> объектная смета -> локальная смета для вкладки
+"Управление": прежний обход N+1 (запрос на каждый объект и каждую объектную смету)
+и один запрос HIERARCHY_QUERY. Само дерево загружается по уровням при раскрытии
+узлов (SmetaProcessor.get_objects, get_object_estimates, get_local_estimates), а
+однозапросная загрузка осталась только здесь - как эталон для сравнения.
+
+Запуск из корня проекта (например, на базе из dump_database/3 latest_data_database):
+    python -m benchmarks.bench_hierarchy [--repeat 50] [--dbname ...] [--host ...]
+
+Выводится лучшее время из --repeat прогонов и число обращений к серверу; при
+удаленном PostgreSQL каждое обращение добавляет еще и сетевую задержку.
+"""
+import argparse
+import time
+
+import psycopg2
+
+from config import DB_CONFIG
+
+# Вся иерархия объект -> объектная смета -> локальная смета одним запросом;
+# ID в сортировке разделяют одноименные узлы
+HIERARCHY_QUERY = """
+    SELECT o.id, o.object_name,
+           oe.id, oe.name_object_estimate, oe.object_estimates_price,
+           le.id, le.name_local_estimate, le.local_estimates_price
+    FROM objects o
+    LEFT JOIN object_estimates oe ON oe.object_id = o.id
+    LEFT JOIN local_estimates le ON le.object_estimates_id = oe.id
+    ORDER BY o.id, oe.name_object_estimate, oe.id, le.name_local_estimate, le.id
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50, help='количество прогонов')
+    for key in ('dbname', 'user', 'password', 'host', 'port'):
+        parser.add_argument(f'--{key}', default=DB_CONFIG[key])
+    return parser.parse_args()
+
+
+def hierarchy_n_plus_one(conn) -> tuple:
+    """Прежняя загрузка иерархии, возвращает (иерархия, число запросов)"""
+    queries = 1
+    hierarchy = {'objects': []}
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id, object_name FROM objects ORDER BY id")
+        for obj_id, obj_name in cursor.fetchall():
+            obj_data = {'id': obj_id, 'name': obj_name, 'object_estimates': []}
+            cursor.execute(
+                "SELECT id, name_object_estimate, object_estimates_price "
+                "FROM object_estimates WHERE object_id = %s ORDER BY name_object_estimate",
+                (obj_id,)
+            )
+            queries += 1
+            for oe_id, oe_name, oe_price in cursor.fetchall():
+                oe_data = {'id': oe_id, 'name': oe_name, 'price': oe_price, 'local_estimates': []}
+                cursor.execute(
+                    "SELECT id, name_local_estimate, local_estimates_price "
+                    "FROM local_estimates WHERE object_estimates_id = %s "
+                    "ORDER BY name_local_estimate",
+                    (oe_id,)
+                )
+                queries += 1
+                oe_data['local_estimates'] = [
+                    {'id': le_id, 'name': le_name, 'price': le_price}
+                    for le_id, le_name, le_price in cursor.fetchall()
+                ]
+                obj_data['object_estimates'].append(oe_data)
+            hierarchy['objects'].append(obj_data)
+    conn.rollback()
+    return hierarchy, queries
+
+
+def hierarchy_single_query(conn) -> tuple:
+    """
+    Иерархия одним запросом, собирается за один проход по строкам,
+    возвращает (иерархия, число запросов)
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(HIERARCHY_QUERY)
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    hierarchy = {'objects': []}
+    obj_data = oe_data = None
+    for obj_id, obj_name, oe_id, oe_name, oe_price, le_id, le_name, le_price in rows:
+        # Строки отсортированы по объекту и объектной смете: новый узел - при смене ID
+        if obj_data is None or obj_data['id'] != obj_id:
+            obj_data = {'id': obj_id, 'name': obj_name, 'object_estimates': []}
+            hierarchy['objects'].append(obj_data)
+            oe_data = None
+        if oe_id is None:
+            continue
+        if oe_data is None or oe_data['id'] != oe_id:
+            oe_data = {'id': oe_id, 'name': oe_name, 'price': oe_price, 'local_estimates': []}
+            obj_data['object_estimates'].append(oe_data)
+        if le_id is not None:
+            oe_data['local_estimates'].append({'id': le_id, 'name': le_name, 'price': le_price})
+    return hierarchy, 1
+
+
+def best_time(load, conn, repeat: int) -> tuple:
+    """Возвращает (лучшее время, число запросов, иерархия)"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hierarchy, queries = load(conn)
+        timings.append(time.perf_counter() - started)
+    return min(timings), queries, hierarchy
+
+
+def main():
+    args = parse_args()
+    db_params = {key: getattr(args, key) for key in ('dbname', 'user', 'password', 'host', 'port')}
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        print(f"{'Загрузка':<20} {'Запросов':>9} {'Время, мс':>10}")
+        results = []
+        for name, load in (('N+1', hierarchy_n_plus_one), ('один запрос', hierarchy_single_query)):
+            best, queries, hierarchy = best_time(load, conn, args.repeat)
+            results.append(hierarchy)
+            print(f"{name:<20} {queries:>9} {best * 1000:>10.2f}")
+        if results[0] != results[1]:
+            print("  ! иерархии различаются")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
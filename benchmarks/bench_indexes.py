@@ -0,0 +1,134 @@
+"""
+Время запросов отчетов, дерева смет, выборки по коду и каскадного удаления с
+индексами из миграций "Индексы по внешним ключам", "Индексы по кодам позиций",
+"Ключи объекта в работах и материалах" и "Индексы по кодам работ и материалов"
+и без них.
+
+Запуск из корня проекта (на базе из dump_database/3 latest_data_database):
+    python -m benchmarks.bench_indexes [--repeat 20] [--dbname ...] [--host ...]
+
+Схема сначала приводится к актуальной версии (models.schema.ensure_schema). Замер
+"без индексов" выполняется в транзакции, которая удаляет индексы и откатывается:
+данные и схема не меняются, но на время замера таблицы заблокированы - не запускайте
+на рабочей БД во время загрузки смет.
+"""
+import argparse
+import re
+import time
+
+import psycopg2
+
+from config import DB_CONFIG
+from benchmarks.bench_hierarchy import HIERARCHY_QUERY
+from models.schema import MIGRATIONS, ensure_schema
+from reports.item_aggregates import ITEM_AGGREGATE_QUERY, ITEM_SOURCES, ORDER_BY_OCCURRENCES
+
+# Миграции, индексы которых сравниваются
+INDEX_MIGRATIONS = (2, 5, 6, 9)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='количество прогонов')
+    for key in ('dbname', 'user', 'password', 'host', 'port'):
+        parser.add_argument(f'--{key}', default=DB_CONFIG[key])
+    return parser.parse_args()
+
+
+def migration_indexes() -> list:
+    """Имена индексов из INDEX_MIGRATIONS"""
+    names = []
+    for version, _, statements in MIGRATIONS:
+        if version in INDEX_MIGRATIONS:
+            for statement in statements:
+                match = re.search(r"CREATE INDEX IF NOT EXISTS (\w+)", statement)
+                if match:
+                    names.append(match.group(1))
+    return names
+
+
+def item_query(kind: str, filtered: bool) -> str:
+    table, alias = ITEM_SOURCES[kind]
+    order_clause = ''.join(f"{column} DESC NULLS LAST, " for column in ORDER_BY_OCCURRENCES) + "code_id"
+    object_filter = f"WHERE {alias}.object_id = ANY(%(object_ids)s)" if filtered else ""
+    return ITEM_AGGREGATE_QUERY.format(table=table, alias=alias,
+                                       object_filter=object_filter, order_by=order_clause)
+
+
+def build_cases(cursor) -> list:
+    """Замеряемые запросы: (название, SQL, параметры)"""
+    # Объект с наибольшим числом работ - типичный отчет по одному объекту
+    cursor.execute("""
+        SELECT oe.object_id FROM work w
+        JOIN sections s ON w.local_section_id = s.id
+        JOIN local_estimates le ON s.estimate_id = le.id
+        JOIN object_estimates oe ON le.object_estimates_id = oe.id
+        GROUP BY oe.object_id ORDER BY COUNT(*) DESC LIMIT 1
+    """)
+    object_id = cursor.fetchone()[0]
+    cursor.execute("SELECT id FROM object_estimates WHERE object_id = %s LIMIT 1", (object_id,))
+    object_estimate_id = cursor.fetchone()[0]
+    one_object = {'object_ids': [object_id]}
+    # Самый частый код работ и самый частый код материалов
+    codes = {}
+    for table in ('work', 'materials'):
+        cursor.execute(f"SELECT code FROM {table} GROUP BY code ORDER BY COUNT(*) DESC LIMIT 1")
+        codes[table] = cursor.fetchone()[0]
+
+    return [
+        ("Отчет: работы, все объекты", item_query('work', False), None),
+        ("Отчет: материалы, все объекты", item_query('materials', False), None),
+        ("Отчет: работы, один объект", item_query('work', True), one_object),
+        ("Отчет: материалы, один объект", item_query('materials', True), one_object),
+        ("Дерево смет целиком", HIERARCHY_QUERY, None),
+        ("Дерево: сметы объекта",
+         "SELECT id FROM object_estimates WHERE object_id = %(id)s", {'id': object_id}),
+        ("Дерево: локальные сметы",
+         "SELECT id FROM local_estimates WHERE object_estimates_id = %(id)s", {'id': object_estimate_id}),
+        ("Работы по коду", "SELECT id, price FROM work WHERE code = %(code)s", {'code': codes['work']}),
+        ("Материалы по коду", "SELECT id, price FROM materials WHERE code = %(code)s",
+         {'code': codes['materials']}),
+        ("Каскадное удаление объекта", "DELETE FROM objects WHERE id = %(id)s", {'id': object_id}),
+    ]
+
+
+def best_time(cursor, sql: str, params, repeat: int) -> float:
+    """Лучшее время запроса; изменения каждого прогона откатываются до точки сохранения"""
+    timings = []
+    for _ in range(repeat):
+        cursor.execute("SAVEPOINT bench")
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        if cursor.description is not None:
+            cursor.fetchall()
+        timings.append(time.perf_counter() - started)
+        cursor.execute("ROLLBACK TO SAVEPOINT bench")
+    return min(timings)
+
+
+def main():
+    args = parse_args()
+    db_params = {key: getattr(args, key) for key in ('dbname', 'user', 'password', 'host', 'port')}
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        ensure_schema(conn)
+        with conn.cursor() as cursor:
+            cases = build_cases(cursor)
+            with_indexes = [best_time(cursor, sql, params, args.repeat) for _, sql, params in cases]
+            conn.rollback()
+
+            for name in migration_indexes():
+                cursor.execute(f"DROP INDEX IF EXISTS {name}")
+            without_indexes = [best_time(cursor, sql, params, args.repeat) for _, sql, params in cases]
+            conn.rollback()
+
+        print(f"{'Запрос':<32} {'Без индексов, мс':>17} {'С индексами, мс':>16}")
+        for (name, _, _), before, after in zip(cases, without_indexes, with_indexes):
+            print(f"{name:<32} {before * 1000:>17.2f} {after * 1000:>16.2f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Сравнение скорости записи локальных смет: EstimateDBHandler (INSERT ... RETURNING
+на каждую строку), EstimateBulkWriter (резерв ID + COPY) и EstimateStagingWriter
+(COPY в промежуточные таблицы + перенос INSERT ... SELECT).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_local_estimate_writers [--repeat 5] [--host ...]
+
+Для каждого прогона создается временный объект с объектной и локальной сметой,
+после замера он удаляется (каскадно вместе с разделами, работами и материалами).
+"""
+import argparse
+import glob
+import os
+import time
+
+import psycopg2
+
+from config import DB_CONFIG
+from parsing.local.processing_of_local_estimates_xml import EstimateDBHandler, parse_xml_estimate
+from parsing.local.bulk_estimate_writer import EstimateBulkWriter
+from parsing.local.staging_estimate_writer import EstimateStagingWriter
+
+DEFAULT_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'test_estimates', 'local_estimates', '*.xml')
+
+WRITERS = {
+    'EstimateDBHandler': EstimateDBHandler,
+    'EstimateBulkWriter': EstimateBulkWriter,
+    'EstimateStagingWriter': EstimateStagingWriter,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='XML файлы локальных смет (по умолчанию test_estimates/local_estimates)')
+    parser.add_argument('--repeat', type=int, default=5, help='количество прогонов на файл')
+    for key in ('dbname', 'user', 'password', 'host', 'port'):
+        parser.add_argument(f'--{key}', default=DB_CONFIG[key])
+    return parser.parse_args()
+
+
+def create_scratch_estimate(conn) -> tuple:
+    """Создает временный объект и локальную смету, возвращает (object_id, estimate_id)"""
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO objects (object_name) VALUES ('benchmark') RETURNING id")
+        object_id = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO object_estimates (object_id, name_object_estimate, object_estimates_price) "
+            "VALUES (%s, 'benchmark', 0) RETURNING id",
+            (object_id,)
+        )
+        object_estimate_id = cursor.fetchone()[0]
+        cursor.execute(
+            "INSERT INTO local_estimates (object_estimates_id, name_local_estimate) "
+            "VALUES (%s, 'benchmark') RETURNING id",
+            (object_estimate_id,)
+        )
+        estimate_id = cursor.fetchone()[0]
+    conn.commit()
+    return object_id, estimate_id
+
+
+def count_rows(conn, estimate_id: int) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM sections WHERE estimate_id = %(id)s)
+                 + (SELECT COUNT(*) FROM work w JOIN sections s ON w.local_section_id = s.id
+                    WHERE s.estimate_id = %(id)s)
+                 + (SELECT COUNT(*) FROM materials m JOIN work w ON m.work_id = w.id
+                    JOIN sections s ON w.local_section_id = s.id WHERE s.estimate_id = %(id)s)
+        """, {'id': estimate_id})
+        return cursor.fetchone()[0]
+
+
+def main():
+    args = parse_args()
+    db_params = {key: getattr(args, key) for key in ('dbname', 'user', 'password', 'host', 'port')}
+    files = args.files or sorted(glob.glob(DEFAULT_FILES))
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        print(f"{'Файл':<45} {'Запись':<21} {'Строк':>7} {'Время, с':>9} {'Строк/с':>10}")
+        for file_path in files:
+            for writer_name, writer_cls in WRITERS.items():
+                timings = []
+                rows = 0
+                for _ in range(args.repeat):
+                    object_id, estimate_id = create_scratch_estimate(conn)
+                    try:
+                        writer = writer_cls(db_params)
+                        started = time.perf_counter()
+                        parse_xml_estimate(file_path, db_params, estimate_id, db_handler=writer)
+                        timings.append(time.perf_counter() - started)
+                        rows = count_rows(conn, estimate_id)
+                        del writer
+                    finally:
+                        with conn.cursor() as cursor:
+                            cursor.execute("DELETE FROM objects WHERE id = %s", (object_id,))
+                        conn.commit()
+
+                best = min(timings)
+                print(f"{os.path.basename(file_path)[:45]:<45} {writer_name:<21} {rows:>7} "
+                      f"{best:>9.3f} {rows / best:>10.0f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
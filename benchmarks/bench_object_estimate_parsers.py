@@ -0,0 +1,72 @@
+"""
+Сравнение разбора объектных смет XML и GGE: прежний режим (ET.parse всего документа
+и несколько обходов дерева) и потоковый (один проход iterparse с остановкой).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_object_estimate_parsers [--repeat 50] [файлы ...]
+
+БД не нужна: замеряется только разбор. Для каждого файла выводится лучшее время
+из --repeat прогонов и пиковый расход памяти Python (tracemalloc).
+"""
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+from parsing.object.processing_of_object_estimates_xml import parse_xml_file
+from parsing.object.processing_of_object_estimates_gge import parse_gge_file
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'test_estimates', 'object_estimates')
+
+PARSERS = {
+    '.xml': parse_xml_file,
+    '.gge': parse_gge_file,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='XML/GGE файлы объектных смет (по умолчанию test_estimates/object_estimates)')
+    parser.add_argument('--repeat', type=int, default=50, help='количество прогонов на файл')
+    return parser.parse_args()
+
+
+def measure(parse, file_path: str, streaming: bool, repeat: int) -> tuple:
+    """Возвращает (лучшее время, пиковая память в КБ, результат разбора)"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = parse(file_path, streaming=streaming)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    parse(file_path, streaming=streaming)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak / 1024, result
+
+
+def main():
+    args = parse_args()
+    files = args.files or sorted(
+        path for path in glob.glob(os.path.join(DEFAULT_DIR, '*'))
+        if os.path.splitext(path)[1].lower() in PARSERS
+    )
+
+    print(f"{'Файл':<45} {'Режим':<10} {'Время, мс':>10} {'Память, КБ':>11} {'Смет':>5}")
+    for file_path in files:
+        parse = PARSERS[os.path.splitext(file_path)[1].lower()]
+        results = []
+        for mode, streaming in (('дерево', False), ('поток', True)):
+            best, peak, result = measure(parse, file_path, streaming, args.repeat)
+            results.append(result)
+            count = len(result['local_estimates']) if result else 0
+            print(f"{os.path.basename(file_path)[:45]:<45} {mode:<10} {best * 1000:>10.2f} {peak:>11.0f} {count:>5}")
+        if results[0] != results[1]:
+            print("  ! результаты режимов различаются")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
+import multiprocessing
+
+from models.db_pool import close_pool
 from views.app import SmetaApp
 
 if __name__ == "__main__":
+    # Нужно для пула процессов пакетной загрузки в собранном .exe
+    multiprocessing.freeze_support()
     app = SmetaApp()
-    app.mainloop()
\ No newline at end of file
+    try:
+        app.mainloop()
+    finally:
+        close_pool()
\ No newline at end of file
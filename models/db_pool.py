@@ -0,0 +1,152 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import psycopg2
+from psycopg2 import pool
+
+from config import DB_CONFIG
+
+# Пул соединений процесса: парсеры и SmetaProcessor берут соединения отсюда,
+# а не открывают новое на каждый файл или действие пользователя
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8
+# Соединение, простоявшее в пуле дольше (секунд), перед выдачей проверяется SELECT 1;
+# недавно использованное выдается без лишнего запроса к серверу
+HEALTH_CHECK_INTERVAL = 30
+# Сколько ждать (секунд) освобождения соединения, если заняты все MAX_CONNECTIONS
+CHECKOUT_TIMEOUT = 30
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class HealthCheckedPool(pool.ThreadedConnectionPool):
+    """
+    Пул, который не выдает мертвые соединения (после перезапуска сервера или обрыва сети).
+
+    Переподключение происходит только после сбоя: закрытое соединение или не
+    ответившее на проверку удаляется из пула, и выдается следующее или новое.
+    Если все соединения заняты, getconn ждет освобождения, а не падает сразу.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # id соединения -> время последнего подтверждения, что оно живое
+        self._alive_at: Dict[int, float] = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        self._alive_at[id(conn)] = time.monotonic()
+        return conn
+
+    def is_alive(self, conn) -> bool:
+        """Проверка соединения перед выдачей (запрос к серверу - только после простоя)"""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._alive_at.get(id(conn), 0) < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise pool.PoolError("все соединения заняты")
+        try:
+            # Простаивающих соединений не больше MAX_CONNECTIONS: после их отбраковки
+            # пул создает новое соединение
+            for _ in range(self.maxconn + 1):
+                conn = super().getconn(key)
+                if self.is_alive(conn):
+                    return conn
+                super().putconn(conn, key, close=True)
+            raise pool.PoolError("не удалось получить рабочее соединение")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            if close or conn.closed:
+                self._alive_at.pop(id(conn), None)
+            else:
+                self._alive_at[id(conn)] = time.monotonic()
+            super().putconn(conn, key, close=close)
+        finally:
+            self._slots.release()
+
+
+def get_pool() -> HealthCheckedPool:
+    """Возвращает пул соединений, при первом обращении создает его"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    _pool = HealthCheckedPool(MIN_CONNECTIONS, MAX_CONNECTIONS, **DB_CONFIG)
+                except psycopg2.Error as e:
+                    raise ConnectionError(f"Ошибка подключения к базе данных: {e}")
+    return _pool
+
+
+def get_connection() -> psycopg2.extensions.connection:
+    """Берет соединение из пула (вернуть его нужно через release_connection)"""
+    try:
+        return get_pool().getconn()
+    except pool.PoolError as e:
+        raise ConnectionError(f"Нет свободных соединений с базой данных: {e}")
+    except psycopg2.Error as e:
+        raise ConnectionError(f"Ошибка подключения к базе данных: {e}")
+
+
+def release_connection(conn):
+    """
+    Возвращает соединение в пул. Незафиксированная транзакция откатывается,
+    закрытое или сломанное соединение удаляется из пула.
+    """
+    if conn is None:
+        return
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    get_pool().putconn(conn, close=broken)
+
+
+@contextmanager
+def connection(conn=None) -> Iterator[psycopg2.extensions.connection]:
+    """
+    Соединение для одной операции записи.
+
+    Если conn передан, транзакцией управляет вызывающий код: здесь нет ни commit,
+    ни rollback. Иначе соединение берется из пула, при успехе транзакция
+    фиксируется, при ошибке откатывается, и соединение возвращается в пул.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+
+def close_pool():
+    """Закрывает все соединения пула (при выходе из приложения)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
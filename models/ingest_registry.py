@@ -0,0 +1,68 @@
+import hashlib
+import os
+from typing import Dict, Optional
+
+# Виды файлов в реестре
+OBJECT_FILE = 'object'
+LOCAL_FILE = 'local'
+
+
+class AlreadyIngestedError(Exception):
+    """Файл с таким же содержимым уже загружен"""
+
+    def __init__(self, entry: Dict):
+        self.entry = entry
+        super().__init__(
+            f"Файл уже загружен {entry['ingested_at']:%d.%m.%Y %H:%M} "
+            f"как «{entry['file_name']}» ({entry['target_name']})"
+        )
+
+
+def file_content_hash(file_path, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 содержимого файла (читается блоками, без загрузки целиком)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_ingested_file(conn, file_kind: str, content_hash: str) -> Optional[Dict]:
+    """Ищет последнюю загрузку файла с таким содержимым, данные которой еще есть в БД"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                f.file_name,
+                f.ingested_at,
+                f.object_estimate_id,
+                f.local_estimate_id,
+                COALESCE(le.name_local_estimate, oe.name_object_estimate)
+            FROM ingested_files f
+            LEFT JOIN object_estimates oe ON f.object_estimate_id = oe.id
+            LEFT JOIN local_estimates le ON f.local_estimate_id = le.id
+            WHERE f.file_kind = %s AND f.content_hash = %s
+            ORDER BY f.id DESC
+            LIMIT 1
+        """, (file_kind, content_hash))
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    return {
+        'file_name': row[0],
+        'ingested_at': row[1],
+        'object_estimate_id': row[2],
+        'local_estimate_id': row[3],
+        'target_name': row[4]
+    }
+
+
+def register_ingested_file(conn, file_kind: str, content_hash: str, file_path,
+                           object_estimate_id: int = None, local_estimate_id: int = None):
+    """Добавляет файл в реестр (в текущей транзакции conn, без commit)"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO ingested_files
+                (content_hash, file_kind, file_name, object_estimate_id, local_estimate_id)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (content_hash, file_kind, os.path.basename(file_path), object_estimate_id, local_estimate_id))
@@ -0,0 +1,66 @@
+from typing import Dict, Iterable, Tuple
+
+# Ключ позиции справочника: (код, наименование, единица измерения)
+ItemKey = Tuple[str, str, str]
+
+
+class ItemDictionary:
+    """
+    Кэш ключей справочника estimate_codes/estimate_items.
+
+    Работы и материалы ссылаются на позицию справочника по item_id. Каждая новая
+    позиция добавляется в справочник один раз, дальше её ID берется из памяти.
+    ID, полученные в незафиксированной транзакции, хранятся отдельно: при откате
+    они забываются вместе с откатанными строками справочника.
+    """
+
+    def __init__(self):
+        self.item_ids: Dict[ItemKey, int] = {}
+        self.pending_ids: Dict[ItemKey, int] = {}
+
+    def get(self, key: ItemKey) -> int:
+        item_id = self.item_ids.get(key)
+        return item_id if item_id is not None else self.pending_ids[key]
+
+    def resolve(self, cursor, code: str, name: str, unit: str) -> int:
+        """Возвращает item_id позиции, при необходимости добавляя её в справочник"""
+        key = (code, name, unit)
+        if key not in self.item_ids and key not in self.pending_ids:
+            self.resolve_many(cursor, [key])
+        return self.get(key)
+
+    def resolve_many(self, cursor, keys: Iterable[ItemKey]):
+        """Добавляет в справочник и кэш все отсутствующие позиции (три запроса на весь набор)"""
+        missing = list({key for key in keys if key not in self.item_ids and key not in self.pending_ids})
+        if not missing:
+            return
+
+        codes, names, units = (list(column) for column in zip(*missing))
+        cursor.execute("""
+            INSERT INTO estimate_codes (code)
+            SELECT DISTINCT code FROM unnest(%s::text[]) AS k(code)
+            ON CONFLICT (code) DO NOTHING
+        """, (codes,))
+        cursor.execute("""
+            INSERT INTO estimate_items (code_id, name, measurement_unit)
+            SELECT c.id, k.name, k.unit
+            FROM unnest(%s::text[], %s::text[], %s::text[]) AS k(code, name, unit)
+            JOIN estimate_codes c ON c.code = k.code
+            ON CONFLICT DO NOTHING
+        """, (codes, names, units))
+        cursor.execute("""
+            SELECT k.code, k.name, k.unit, i.id
+            FROM unnest(%s::text[], %s::text[], %s::text[]) AS k(code, name, unit)
+            JOIN estimate_codes c ON c.code = k.code
+            JOIN estimate_items i
+                ON i.code_id = c.id AND i.measurement_unit = k.unit AND md5(i.name) = md5(k.name)
+        """, (codes, names, units))
+        for code, name, unit, item_id in cursor.fetchall():
+            self.pending_ids[(code, name, unit)] = item_id
+
+    def commit(self):
+        self.item_ids.update(self.pending_ids)
+        self.pending_ids.clear()
+
+    def rollback(self):
+        self.pending_ids.clear()
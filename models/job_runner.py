@@ -0,0 +1,208 @@
+import itertools
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Фоновые задания интерфейса: разбор смет и отчеты выполняются в пуле потоков,
+# окно Tk забирает их события методом poll() из after() и не зависает
+MAX_WORKERS = 4
+
+QUEUED = "В очереди"
+RUNNING = "Выполняется"
+DONE = "Готово"
+FAILED = "Ошибка"
+CANCELLED = "Отменено"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """
+    Задание отменено пользователем. Наследуется от BaseException (как
+    asyncio.CancelledError), чтобы не перехватываться обработчиками except Exception
+    """
+
+
+class Job:
+    """
+    Одно фоновое задание. Рабочий поток сообщает о ходе работы через report(),
+    интерфейс отменяет задание через cancel(): задание прерывается в ближайшей
+    точке report()/check_cancelled(), а выполняющиеся запросы в отслеживаемых
+    соединениях прерываются на сервере (connection.cancel()).
+    """
+
+    def __init__(self, job_id: int, title: str, events: queue.Queue):
+        self.id = job_id
+        self.title = title
+        self.status = QUEUED
+        self.progress: Optional[float] = 0.0  # доля 0..1, None - неизвестна
+        self.message = ""
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.future = None
+        self.on_done: Optional[Callable] = None
+        self.on_error: Optional[Callable] = None
+        self.notified = False
+        self._events = events
+        self._cancel = threading.Event()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def check_cancelled(self):
+        """Точка отмены: выбрасывает JobCancelled, если задание отменено"""
+        if self._cancel.is_set():
+            raise JobCancelled("Задание отменено")
+
+    def report(self, progress: Optional[float] = None, message: Optional[str] = None):
+        """Ход работы из рабочего потока (доля 0..1 и/или текст этапа); это же точка отмены"""
+        self.check_cancelled()
+        if progress is not None:
+            self.progress = progress
+        if message is not None:
+            self.message = message
+        self._events.put(self)
+
+    @contextmanager
+    def cancellable(self, conn):
+        """Соединение psycopg2, запрос в котором прерывается при отмене задания"""
+        with self._lock:
+            self._connections.add(conn)
+        try:
+            self.check_cancelled()
+            yield conn
+        finally:
+            with self._lock:
+                self._connections.discard(conn)
+
+    def watch_engine(self, engine):
+        """Движок SQLAlchemy: его соединения, выданные заданию, прерываются при отмене"""
+        from sqlalchemy import event
+
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            with self._lock:
+                self._connections.add(dbapi_connection)
+
+        def checkin(dbapi_connection, connection_record):
+            with self._lock:
+                self._connections.discard(dbapi_connection)
+
+        event.listen(engine, 'checkout', checkout)
+        event.listen(engine, 'checkin', checkin)
+
+    def cancel(self):
+        """Отмена из потока интерфейса"""
+        if self.finished:
+            return
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            # Задание еще не начиналось
+            self.status = CANCELLED
+            self._events.put(self)
+            return
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.cancel()
+            except Exception:
+                pass  # соединение уже закрыто
+
+
+class JobRunner:
+    """Пул фоновых заданий. submit() и poll() вызываются из потока интерфейса"""
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._events: queue.Queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self.jobs: List[Job] = []
+
+    def submit(self, title: str, fn: Callable, *args, on_done: Optional[Callable] = None,
+               on_error: Optional[Callable] = None, **kwargs) -> Job:
+        """
+        Ставит в очередь fn(job, *args, **kwargs).
+        :param on_done: вызывается в потоке интерфейса с результатом fn
+        :param on_error: вызывается в потоке интерфейса с исключением (кроме отмены)
+        """
+        job = Job(next(self._ids), title, self._events)
+        job.on_done = on_done
+        job.on_error = on_error
+        self.jobs.append(job)
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        self._events.put(job)
+        return job
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        if job.cancelled:
+            # Отменено после постановки в пул, но до запуска (future уже не отменить)
+            job.status = CANCELLED
+            self._events.put(job)
+            return
+        job.status = RUNNING
+        self._events.put(job)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            # Прерванный отменой запрос падает с QueryCanceledError - это тоже отмена
+            if job.cancelled:
+                job.status = CANCELLED
+            else:
+                job.error = e
+                job.status = FAILED
+        finally:
+            self._events.put(job)
+
+    def poll(self) -> List[Job]:
+        """
+        Забирает накопившиеся события (в потоке интерфейса, из after()) и вызывает
+        on_done/on_error завершившихся заданий
+        :return: задания, состояние которых изменилось
+        """
+        changed: Dict[int, Job] = {}
+        while True:
+            try:
+                job = self._events.get_nowait()
+            except queue.Empty:
+                break
+            changed[job.id] = job
+
+        for job in changed.values():
+            if not job.finished or job.notified:
+                continue
+            job.notified = True
+            try:
+                if job.status == DONE and job.on_done:
+                    job.on_done(job.result)
+                elif job.status == FAILED and job.on_error:
+                    job.on_error(job.error)
+            except Exception:
+                # Ошибка одного обработчика не должна терять события остальных заданий
+                traceback.print_exc()
+        return list(changed.values())
+
+    @property
+    def active(self) -> List[Job]:
+        return [job for job in self.jobs if not job.finished]
+
+    def shutdown(self):
+        """
+        Отменяет незавершенные задания и ждет их остановки (при закрытии окна:
+        соединения должны вернуться в пул до его закрытия)
+        """
+        for job in self.active:
+            job.cancel()
+        self._executor.shutdown(wait=True, cancel_futures=True)
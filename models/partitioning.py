@@ -0,0 +1,265 @@
+"""
+Секционирование work и materials по объекту (LIST по object_id) - необязательный
+режим для больших БД. Включается однократно:
+    python -m models.partitioning enable
+
+У каждого объекта свои секции work_object_<id> и materials_object_<id>:
+- удаление объекта удаляет его секции целиком (DROP TABLE) вместо каскадного
+  удаления строк разделов, работ и материалов;
+- архивирование отсоединяет секции (DETACH): данные остаются в отдельных таблицах,
+  но не попадают в отчеты, восстановление присоединяет их обратно; удаление
+  архивного объекта удаляет и отсоединенные секции;
+- отчеты с фильтром по объектам читают только секции этих объектов.
+
+Секции создаются и удаляются триггерами на objects, поэтому код загрузки и удаления
+смет не меняется. Создание и удаление секции ненадолго блокирует всю таблицу work
+(materials), а каскадное удаление отдельной сметы проверяет индексы всех секций.
+"""
+import psycopg2
+
+from config import DB_CONFIG
+from models.schema import ensure_schema
+
+PARTITIONED_TABLES = ('work', 'materials')
+
+# Секции объекта создаются при добавлении объекта и удаляются до каскадного
+# удаления его смет (BEFORE DELETE): разделам каскаду удалять уже нечего
+PARTITION_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION create_object_partitions() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF work FOR VALUES IN (%s)',
+                       'work_object_' || NEW.id, NEW.id);
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF materials FOR VALUES IN (%s)',
+                       'materials_object_' || NEW.id, NEW.id);
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER objects_create_partitions_trg
+        AFTER INSERT ON objects
+        FOR EACH ROW EXECUTE FUNCTION create_object_partitions()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION drop_object_partitions() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        work_partition TEXT := 'work_object_' || OLD.id;
+    BEGIN
+        -- Секции архивного объекта отсоединены и удаляются так же, как присоединенные.
+        -- На секцию work ссылается materials: присоединенную её можно удалить только
+        -- после отсоединения
+        EXECUTE format('DROP TABLE IF EXISTS %I', 'materials_object_' || OLD.id);
+        IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(work_partition) AND relispartition) THEN
+            EXECUTE format('ALTER TABLE work DETACH PARTITION %I', work_partition);
+        END IF;
+        EXECUTE format('DROP TABLE IF EXISTS %I', work_partition);
+        RETURN OLD;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER objects_drop_partitions_trg
+        BEFORE DELETE ON objects
+        FOR EACH ROW EXECUTE FUNCTION drop_object_partitions()
+    """,
+]
+
+
+def partition_name(table: str, object_id: int) -> str:
+    return f"{table}_object_{int(object_id)}"
+
+
+def is_partitioned(cursor) -> bool:
+    """Секционирована ли таблица work"""
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('work')")
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def table_indexes(cursor, table: str) -> list:
+    """Определения индексов таблицы, кроме первичного ключа"""
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+        ORDER BY i.indexrelid
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_foreign_keys(cursor, table: str) -> list:
+    """Внешние ключи таблицы: [(имя, определение, таблица ссылки), ...]"""
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        ORDER BY oid
+    """, (table,))
+    return cursor.fetchall()
+
+
+def enable_partitioning(conn):
+    """
+    Переводит work и materials на секции по объекту в одной транзакции: новые
+    секционированные таблицы с теми же столбцами, индексами и внешними ключами,
+    по секции на каждый существующий объект, перенос строк и замена таблиц.
+    Первичный ключ секционированной таблицы включает ключ секции, поэтому
+    materials ссылается на work по (object_id, work_id).
+    Приложение на время перевода должно быть закрыто.
+    """
+    # Ключ секции object_id добавляет миграция "Ключи объекта в работах и материалах"
+    ensure_schema(conn)
+    with conn.cursor() as cursor:
+        if is_partitioned(cursor):
+            raise ValueError("Таблицы work и materials уже секционированы")
+
+        cursor.execute("LOCK TABLE objects, work, materials IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("SELECT id FROM objects ORDER BY id")
+        object_ids = [row[0] for row in cursor.fetchall()]
+
+        definitions = {}
+        for table in PARTITIONED_TABLES:
+            definitions[table] = {
+                'indexes': table_indexes(cursor, table),
+                'foreign_keys': table_foreign_keys(cursor, table),
+            }
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+            definitions[table]['sequence'] = cursor.fetchone()[0]
+
+            cursor.execute(f"""
+                CREATE TABLE {table}_partitioned (LIKE {table} INCLUDING DEFAULTS)
+                PARTITION BY LIST (object_id)
+            """)
+            cursor.execute(f"ALTER TABLE {table}_partitioned ADD PRIMARY KEY (object_id, id)")
+            for object_id in object_ids:
+                cursor.execute(f"""
+                    CREATE TABLE {partition_name(table, object_id)}
+                    PARTITION OF {table}_partitioned FOR VALUES IN ({int(object_id)})
+                """)
+            cursor.execute(f"INSERT INTO {table}_partitioned SELECT * FROM {table}")
+
+        # Последовательности ID переходят к новым таблицам (иначе удалятся вместе со старыми)
+        for table in PARTITIONED_TABLES:
+            cursor.execute(f"ALTER SEQUENCE {definitions[table]['sequence']} OWNED BY NONE")
+        cursor.execute("DROP TABLE materials")
+        cursor.execute("DROP TABLE work")
+
+        for table in PARTITIONED_TABLES:
+            cursor.execute(f"ALTER TABLE {table}_partitioned RENAME TO {table}")
+            cursor.execute(f"ALTER INDEX {table}_partitioned_pkey RENAME TO {table}_pkey")
+            cursor.execute(f"ALTER SEQUENCE {definitions[table]['sequence']} OWNED BY {table}.id")
+            for index_definition in definitions[table]['indexes']:
+                cursor.execute(index_definition)
+            for name, definition, referenced in definitions[table]['foreign_keys']:
+                if referenced == 'work':
+                    # Ссылка на секционированную таблицу - по ключу с ключом секции
+                    definition = definition.replace("FOREIGN KEY (work_id) REFERENCES work(id)",
+                                                    "FOREIGN KEY (object_id, work_id) REFERENCES work(object_id, id)")
+                cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+        for statement in PARTITION_TRIGGERS:
+            cursor.execute(statement)
+        cursor.execute("ANALYZE work, materials")
+    conn.commit()
+
+
+def partition_attached(cursor, name: str):
+    """Присоединена ли таблица name как секция (None - таблицы нет)"""
+    cursor.execute("SELECT relispartition FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def check_object_partitions(cursor, object_id: int, attached: bool):
+    """ValueError, если объекта нет или его секции не в ожидаемом состоянии"""
+    if not is_partitioned(cursor):
+        raise ValueError("Таблицы work и materials не секционированы")
+    cursor.execute("SELECT 1 FROM objects WHERE id = %s", (object_id,))
+    if cursor.fetchone() is None:
+        raise ValueError(f"Объект {object_id} не найден")
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, object_id)
+        state = partition_attached(cursor, name)
+        if state is None:
+            raise ValueError(f"Секция {name} не найдена")
+        if state != attached:
+            raise ValueError(f"Секция {name} уже " + ("отсоединена" if state is False else "присоединена"))
+
+
+def archive_object(conn, object_id: int):
+    """
+    Отсоединяет секции объекта: строки остаются в таблицах work_object_<id> и
+    materials_object_<id>, но не входят в work/materials и отчеты. Ссылка
+    отсоединенных материалов на work заменяется ссылкой на отсоединенную секцию
+    работ, поэтому удаление раздела архивного объекта удаляет и его материалы
+    (ссылка на work восстанавливается при присоединении). Удаление архивного
+    объекта удаляет его секции триггером
+    """
+    work_partition = partition_name('work', object_id)
+    materials_partition = partition_name('materials', object_id)
+    with conn.cursor() as cursor:
+        check_object_partitions(cursor, object_id, attached=True)
+        cursor.execute(f"ALTER TABLE materials DETACH PARTITION {materials_partition}")
+        for name, _, referenced in table_foreign_keys(cursor, materials_partition):
+            if referenced == 'work':
+                cursor.execute(f"ALTER TABLE {materials_partition} DROP CONSTRAINT {name}")
+        cursor.execute(f"ALTER TABLE work DETACH PARTITION {work_partition}")
+        cursor.execute(f"""
+            ALTER TABLE {materials_partition} ADD CONSTRAINT {materials_partition}_work_fkey
+            FOREIGN KEY (object_id, work_id) REFERENCES {work_partition}(object_id, id) ON DELETE CASCADE
+        """)
+    conn.commit()
+
+
+def restore_object(conn, object_id: int):
+    """Присоединяет отсоединенные archive_object секции объекта обратно"""
+    work_partition = partition_name('work', object_id)
+    materials_partition = partition_name('materials', object_id)
+    with conn.cursor() as cursor:
+        check_object_partitions(cursor, object_id, attached=False)
+        cursor.execute(f"""
+            ALTER TABLE work ATTACH PARTITION {work_partition}
+            FOR VALUES IN ({int(object_id)})
+        """)
+        # Ссылку на work секция получит от materials при присоединении
+        for name, _, referenced in table_foreign_keys(cursor, materials_partition):
+            if referenced == work_partition:
+                cursor.execute(f"ALTER TABLE {materials_partition} DROP CONSTRAINT {name}")
+        cursor.execute(f"""
+            ALTER TABLE materials ATTACH PARTITION {materials_partition}
+            FOR VALUES IN ({int(object_id)})
+        """)
+    conn.commit()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Секционирование work и materials по объекту")
+    parser.add_argument('command', choices=('status', 'enable', 'archive', 'restore'))
+    parser.add_argument('object_id', nargs='?', type=int, help='ID объекта (для archive и restore)')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.command == 'enable':
+            enable_partitioning(connection)
+            print("Таблицы work и materials секционированы по объектам")
+        elif args.command in ('archive', 'restore'):
+            if args.object_id is None:
+                parser.error("укажите ID объекта")
+            (archive_object if args.command == 'archive' else restore_object)(connection, args.object_id)
+            print(f"Объект {args.object_id}: " +
+                  ("секции отсоединены" if args.command == 'archive' else "секции присоединены"))
+        else:
+            with connection.cursor() as status_cursor:
+                partitioned = is_partitioned(status_cursor)
+            print("Секционирование включено" if partitioned else "Секционирование не включено")
+    except Exception as e:
+        connection.rollback()
+        print(f"Ошибка: {e}")
+    finally:
+        connection.close()
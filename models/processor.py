@@ -1,39 +1,115 @@
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
 from psycopg2 import sql
 from config import DB_CONFIG
+from models.db_pool import get_connection, release_connection
 
 # Определения типа файла
 from models.file_type_by_signature import identify_file_type
+from models.schema import ensure_schema
+from models.ingest_registry import (
+    OBJECT_FILE, LOCAL_FILE, AlreadyIngestedError,
+    file_content_hash, find_ingested_file, register_ingested_file
+)
 
 # парсер локальных смет формата xml
-from parsing.local.processing_of_local_estimates_xml import parse_xml_estimate
+from parsing.local.processing_of_local_estimates_xml import PARSE_SUMMARY, parse_xml_estimate
+from parsing.local.bulk_estimate_writer import EstimateBulkWriter
+from parsing.local.batch_import import (
+    import_local_estimates, match_files_to_estimates, parse_estimate_file, write_parsed_estimates
+)
 
-# парсеры объектных смет
-from parsing.object.processing_of_object_estimates_xlsx import parse_and_save_smeta as parse_and_save_smeta_xlsx
-from parsing.object.processing_of_object_estimates_xls import parse_and_save_smeta as parse_and_save_smeta_xls
-from parsing.object.processing_of_object_estimates_xml import parse_and_save_smeta as parse_and_save_smeta_xml
-from parsing.object.processing_of_object_estimates_gge import parse_and_save_smeta as parse_and_save_smeta_gge
+# парсеры объектных смет (разбор отделен от записи, запись - общим save_object_estimate)
+from parsing.object.processing_of_object_estimates_xlsx import parse_object_estimate as parse_object_estimate_xlsx
+from parsing.object.processing_of_object_estimates_xls import parse_object_estimate as parse_object_estimate_xls
+from parsing.object.processing_of_object_estimates_xml import parse_object_estimate as parse_object_estimate_xml
+from parsing.object.processing_of_object_estimates_gge import parse_object_estimate as parse_object_estimate_gge
+from parsing.object.object_estimate_writer import save_object_estimate
+from parsing.object.object_package import classify_package_files, open_package
+
+OBJECT_ESTIMATE_PARSERS = {
+    "XLSX": parse_object_estimate_xlsx,
+    "XLS": parse_object_estimate_xls,
+    "XML": parse_object_estimate_xml,
+    "GGE": parse_object_estimate_gge,
+}
 
 class SmetaProcessor:
+    """
+    Операции с базой смет. Соединение берется из пула на время блока with и
+    привязано к потоку: один экземпляр можно использовать из интерфейса и из
+    фоновых потоков одновременно, каждый поток работает в своем соединении.
+    """
+    # Служебные таблицы проверяются один раз за запуск приложения
+    schema_ready = False
+    _schema_lock = threading.Lock()
+
     def __init__(self):
-        self.conn = None
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        """Соединение текущего потока (None вне блока with)"""
+        return getattr(self._local, 'conn', None)
+
+    @conn.setter
+    def conn(self, value):
+        self._local.conn = value
+
+    @property
+    def depth(self):
+        """Глубина вложенных with в текущем потоке: вложенный блок работает в соединении внешнего"""
+        return getattr(self._local, 'depth', 0)
+
+    @depth.setter
+    def depth(self, value):
+        self._local.depth = value
 
     def __enter__(self):
-        self.conn = self.get_db_connection()
+        if self.conn is None:
+            self.conn = self.get_db_connection()
+        self.depth += 1
+        try:
+            if not SmetaProcessor.schema_ready:
+                with SmetaProcessor._schema_lock:
+                    if not SmetaProcessor.schema_ready:
+                        ensure_schema(self.conn)
+                        SmetaProcessor.schema_ready = True
+        except BaseException:
+            # __exit__ при ошибке в __enter__ не вызывается: соединение возвращаем сами
+            self.depth -= 1
+            if self.depth <= 0:
+                self.depth = 0
+                self.release_db_connection()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            self.conn.close()
+        self.depth -= 1
+        if self.depth <= 0:
+            self.depth = 0
+            self.release_db_connection()
         if exc_val:
             print(f"Ошибка в SmetaProcessor: {exc_val}")
 
     def get_db_connection(self):
+        """Берет соединение из общего пула (вернуть - release_db_connection)"""
         try:
-            return psycopg2.connect(**DB_CONFIG)
-        except psycopg2.Error as e:
-            raise Exception(f"Ошибка подключения к базе данных: {e}")
+            return get_connection()
+        except ConnectionError as e:
+            raise Exception(str(e))
+
+    def release_db_connection(self):
+        """
+        Возвращает соединение потока в пул; незафиксированные изменения откатываются.
+        Соединение, сломавшееся во время работы, пул закрывает, и следующий блок
+        with получает новое.
+        """
+        if self.conn:
+            release_connection(self.conn)
+            self.conn = None
 
     def get_unprocessed_local_estimates(self):
         """Возвращает список необработанных локальных смет"""
@@ -76,8 +152,14 @@ class SmetaProcessor:
             self.conn.rollback()
             raise Exception(f"Ошибка при обновлении сметы: {e}")
 
-    def process_object_smeta(self, file_path, object_id):
-        """Обработка объектной сметы с улучшенной обработкой ошибок"""
+    def process_object_smeta(self, file_path, object_id, force=False, progress=None):
+        """
+        Обработка объектной сметы с улучшенной обработкой ошибок.
+        Если файл с таким же содержимым уже загружен, выбрасывает AlreadyIngestedError
+        (при force=True файл загружается повторно).
+        :param progress: progress(доля 0..1, этап) - ход работы (например, Job.report)
+        :return: ID созданной объектной сметы
+        """
         try:
             # Явная проверка типа пути
             if not isinstance(file_path, (str, bytes, os.PathLike)):
@@ -89,35 +171,273 @@ class SmetaProcessor:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"Файл не существует: {file_path}")
 
+            # Повторно загруженный файл не разбираем
+            content_hash = file_content_hash(file_path)
+            if not force:
+                existing = find_ingested_file(self.conn, OBJECT_FILE, content_hash)
+                if existing:
+                    raise AlreadyIngestedError(existing)
+
             file_type = identify_file_type(file_path)
             print(f"Тип файла объектной сметы: {file_type}")
 
-            if file_type == "XLSX":
-                return parse_and_save_smeta_xlsx(file_path, object_id)
-            elif file_type == "XLS":
-                return parse_and_save_smeta_xls(file_path, object_id)
-            elif file_type == "XML":
-                return parse_and_save_smeta_xml(file_path, object_id)
-            elif file_type == "GGE":
-                return parse_and_save_smeta_gge(file_path, object_id)
-            else:
+            parse_object_estimate = OBJECT_ESTIMATE_PARSERS.get(file_type)
+            if parse_object_estimate is None:
                 raise ValueError(f"Неподдерживаемый формат файла: {file_type}")
+            if progress is not None:
+                progress(0.1, "Разбор объектной сметы")
+            result = parse_object_estimate(file_path)
+
+            # Смета, её локальные сметы и запись реестра - одна транзакция
+            if progress is not None:
+                progress(0.8, "Запись в базу данных")
+            try:
+                estimate_id = save_object_estimate(self.conn, object_id, **result)
+                register_ingested_file(self.conn, OBJECT_FILE, content_hash, file_path,
+                                       object_estimate_id=estimate_id)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return estimate_id
 
         except Exception as e:
             print(f"Ошибка в process_object_smeta: {str(e)}")
             raise
 
-    def process_xml_estimate(self, xml_path, estimate_id):
+    def process_xml_estimate(self, xml_path, estimate_id, force=False, progress=None):
+        """
+        Загрузка локальной сметы из XML.
+        Если файл с таким же содержимым уже загружен, выбрасывает AlreadyIngestedError
+        (при force=True файл загружается повторно).
+        :param progress: см. process_object_smeta
+        """
         try:
+            content_hash = file_content_hash(xml_path)
+            if not force:
+                existing = find_ingested_file(self.conn, LOCAL_FILE, content_hash)
+                if existing:
+                    raise AlreadyIngestedError(existing)
+
+            if progress is not None:
+                progress(0.1, "Разбор и запись сметы")
+            # Данные сметы и запись реестра - одна транзакция: разбор не фиксирует запись
+            writer = EstimateBulkWriter(conn=self.conn)
             estimate_data = parse_xml_estimate(
                 xml_file_path=xml_path,
                 db_params=DB_CONFIG,
-                estimate_id=estimate_id
+                estimate_id=estimate_id,
+                db_handler=writer,
+                mode=PARSE_SUMMARY,
+                commit=False
             )
+            try:
+                if progress is not None:
+                    progress(0.95, "Фиксация изменений")
+                register_ingested_file(self.conn, LOCAL_FILE, content_hash, xml_path,
+                                       local_estimate_id=estimate_id)
+                writer.commit()
+            except BaseException:
+                writer.rollback()
+                raise
             return True, estimate_data['total_cost']
+        except AlreadyIngestedError:
+            raise
         except Exception as e:
             raise Exception(f"Ошибка обработки XML: {str(e)}")
 
+    def process_xml_estimates_batch(self, files, force=False, progress=None):
+        """
+        Пакетная загрузка локальных смет (разбор в пуле процессов, запись одним потоком).
+        Уже загруженные файлы (по хэшу содержимого) пропускаются, если не задан force.
+        :param files: список пар (путь к XML файлу, ID локальной сметы)
+        :param progress: см. process_object_smeta (вызывается после каждого файла)
+        :return: отчет по каждому файлу (см. import_local_estimates) с ключом skipped -
+                 причиной пропуска файла или None
+        """
+        reports, to_import, hashes = self.skip_ingested_local_files(files, force)
+        import_local_estimates(to_import, DB_CONFIG, conn=self.conn,
+                               on_written=self.local_report_recorder(reports, len(files), progress),
+                               before_commit=self.local_file_registrar(hashes))
+        return reports
+
+    def skip_ingested_local_files(self, files, force=False):
+        """
+        Отбирает из пар (файл, ID сметы) еще не загруженные файлы и дубликаты внутри пакета
+        :return: (отчеты по пропущенным файлам, пары для загрузки, хэши файлов для загрузки)
+        """
+        reports, to_import, hashes = [], [], {}
+        for file_path, estimate_id in files:
+            content_hash = file_content_hash(file_path)
+            existing = None if force else find_ingested_file(self.conn, LOCAL_FILE, content_hash)
+            if existing or content_hash in hashes.values():
+                reports.append({
+                    'file': file_path,
+                    'estimate_id': estimate_id,
+                    'parse_time': None,
+                    'write_time': None,
+                    'total_cost': None,
+                    'error': None,
+                    'skipped': str(AlreadyIngestedError(existing)) if existing else "Дубликат другого файла пакета"
+                })
+                continue
+            hashes[file_path] = content_hash
+            to_import.append((file_path, estimate_id))
+        return reports, to_import, hashes
+
+    def local_file_registrar(self, hashes):
+        """
+        Обработчик before_commit для write_parsed_estimates: записанный файл вносится
+        в реестр в транзакции его данных, поэтому реестр не отстает от записанных смет
+        ни при остановке пакета (ошибка, отмена), ни при сбое между фиксациями
+        """
+        def register(report):
+            register_ingested_file(self.conn, LOCAL_FILE, hashes[report['file']], report['file'],
+                                   local_estimate_id=report['estimate_id'])
+        return register
+
+    def local_report_recorder(self, reports, total, progress=None):
+        """Обработчик on_written для write_parsed_estimates: отчет по файлу и ход работы"""
+        def on_written(report):
+            report['skipped'] = None
+            reports.append(report)
+            if progress is not None:
+                progress(len(reports) / total, os.path.basename(report['file']))
+        return on_written
+
+    def process_object_package(self, package_path, object_id, force=False, max_workers=None, progress=None):
+        """
+        Загрузка пакета объекта: ZIP архив или папка с объектной сметой и XML её локальных смет.
+
+        Локальные сметы начинают разбираться в пуле процессов сразу, параллельно с
+        загрузкой объектной сметы. Когда строки local_estimates созданы, файлы
+        сопоставляются им по шифру (LocNum) и записываются по мере готовности разбора.
+        Если объектная смета уже загружена (и не задан force), используется существующая:
+        так можно догрузить пакет, часть файлов которого не загрузилась.
+        :param progress: см. process_object_smeta
+        :return: словарь object_file, object_estimate_id, object_reused (использована ранее
+                 загруженная объектная смета), local_reports (см. process_xml_estimates_batch),
+                 unmatched (несопоставленные XML) и ignored (файлы неизвестного формата)
+        """
+        with open_package(package_path) as folder:
+            package = classify_package_files(folder)
+            reports, to_import, hashes = self.skip_ingested_local_files(
+                [(file_path, None) for file_path in package['local_files']], force
+            )
+
+            pool = None
+            futures = {}
+            if to_import:
+                pool = ProcessPoolExecutor(max_workers=max_workers or min(len(to_import), os.cpu_count() or 1))
+                futures = {pool.submit(parse_estimate_file, file_path): file_path for file_path, _ in to_import}
+
+            try:
+                if progress is not None:
+                    progress(0.0, f"Объектная смета {os.path.basename(package['object_file'])}")
+                object_reused = False
+                try:
+                    object_estimate_id = self.process_object_smeta(package['object_file'], object_id, force=force)
+                except AlreadyIngestedError as e:
+                    object_estimate_id = e.entry['object_estimate_id']
+                    object_reused = True
+
+                matched, unmatched = self.match_local_estimate_files(list(futures.values()), object_estimate_id)
+                estimate_ids = dict(matched)
+                for future, file_path in futures.items():
+                    if file_path not in estimate_ids:
+                        future.cancel()
+
+                write_parsed_estimates(
+                    {future: (file_path, estimate_ids[file_path])
+                     for future, file_path in futures.items() if file_path in estimate_ids},
+                    EstimateBulkWriter(conn=self.conn),
+                    self.local_report_recorder(reports, len(package['local_files']) or 1, progress),
+                    self.local_file_registrar(hashes)
+                )
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+            folder_prefix = os.path.join(folder, '')
+            for report in reports:
+                report['file'] = report['file'].replace(folder_prefix, '', 1)
+            return {
+                'object_file': os.path.basename(package['object_file']),
+                'object_estimate_id': object_estimate_id,
+                'object_reused': object_reused,
+                'local_reports': reports,
+                'unmatched': [path.replace(folder_prefix, '', 1) for path in unmatched],
+                'ignored': [path.replace(folder_prefix, '', 1) for path in package['ignored']]
+            }
+
+    def match_local_estimate_files(self, file_paths, object_estimate_id):
+        """Сопоставляет XML файлы необработанным локальным сметам объектной сметы по шифру"""
+        estimates = [
+            (estimate_id, name)
+            for estimate_id, name, _, _, oe_id in self.get_unprocessed_local_estimates()
+            if oe_id == object_estimate_id
+        ]
+        return match_files_to_estimates(file_paths, estimates)
+
+    def delete_tree_nodes(self, object_ids=(), object_estimate_ids=(), local_estimate_ids=()):
+        """
+        Удаляет выбранные узлы дерева (объекты, объектные и локальные сметы) одной транзакцией.
+
+        На каждый уровень - один DELETE по списку ID, разделы, работы, материалы и
+        вложенные сметы удаляются каскадно внешними ключами. Объектные сметы, у
+        которых не осталось локальных, и объекты без объектных смет удаляются следом,
+        как в delete_empty_object_estimates / delete_object_if_empty.
+        :return: словарь objects, object_estimates, local_estimates - списки ID,
+                 удаленных явно или как опустевшие (без каскадно удаленных вложенных)
+        """
+        deleted = {'objects': [], 'object_estimates': [], 'local_estimates': []}
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("DELETE FROM objects WHERE id = ANY(%s) RETURNING id", (list(object_ids),))
+                deleted['objects'] = [row[0] for row in cursor.fetchall()]
+
+                cursor.execute(
+                    "DELETE FROM object_estimates WHERE id = ANY(%s) RETURNING id, object_id",
+                    (list(object_estimate_ids),)
+                )
+                rows = cursor.fetchall()
+                deleted['object_estimates'] = [oe_id for oe_id, _ in rows]
+                parent_objects = {object_id for _, object_id in rows}
+
+                cursor.execute(
+                    "DELETE FROM local_estimates WHERE id = ANY(%s) RETURNING id, object_estimates_id",
+                    (list(local_estimate_ids),)
+                )
+                rows = cursor.fetchall()
+                deleted['local_estimates'] = [le_id for le_id, _ in rows]
+                parent_estimates = list({oe_id for _, oe_id in rows})
+
+                # Опустевшие родители
+                cursor.execute("""
+                    DELETE FROM object_estimates oe
+                    WHERE oe.id = ANY(%s)
+                      AND NOT EXISTS (SELECT 1 FROM local_estimates le WHERE le.object_estimates_id = oe.id)
+                    RETURNING oe.id, oe.object_id
+                """, (parent_estimates,))
+                rows = cursor.fetchall()
+                deleted['object_estimates'].extend(oe_id for oe_id, _ in rows)
+                parent_objects.update(object_id for _, object_id in rows)
+
+                cursor.execute("""
+                    DELETE FROM objects o
+                    WHERE o.id = ANY(%s)
+                      AND NOT EXISTS (SELECT 1 FROM object_estimates oe WHERE oe.object_id = o.id)
+                    RETURNING o.id
+                """, (list(parent_objects),))
+                deleted['objects'].extend(row[0] for row in cursor.fetchall())
+
+            self.conn.commit()
+            return deleted
+
+        except Exception as e:
+            self.conn.rollback()
+            raise Exception(f"Ошибка при удалении: {e}")
+
     def delete_empty_object_estimates(self, object_id):
         """Удаляет пустые объектные сметы для указанного объекта"""
         try:
@@ -148,60 +468,45 @@ class SmetaProcessor:
             self.conn.rollback()
             raise Exception(f"Ошибка при удалении пустого объекта: {e}")
 
-    def get_full_hierarchy(self):
-        """Получение полной иерархии объектов, смет и разделов"""
-        try:
-            with self.conn.cursor() as cursor:
-                hierarchy = {'objects': []}
-
-                # Получаем все объекты
-                cursor.execute("SELECT id, object_name FROM objects ORDER BY object_name")
-                objects = cursor.fetchall()
-
-                for obj_id, obj_name in objects:
-                    obj_data = {
-                        'id': obj_id,
-                        'name': obj_name,
-                        'object_estimates': []
-                    }
-
-                    # Получаем объектные сметы для объекта
-                    cursor.execute(
-                        "SELECT id, name_object_estimate, object_estimates_price "
-                        "FROM object_estimates WHERE object_id = %s ORDER BY name_object_estimate",
-                        (obj_id,)
-                    )
-                    obj_estimates = cursor.fetchall()
-
-                    for oe_id, oe_name, oe_price in obj_estimates:
-                        oe_data = {
-                            'id': oe_id,
-                            'name': oe_name,
-                            'price': oe_price,
-                            'local_estimates': []
-                        }
-
-                        # Получаем локальные сметы для объектной сметы
-                        cursor.execute(
-                            "SELECT id, name_local_estimate, local_estimates_price "
-                            "FROM local_estimates WHERE object_estimates_id = %s "
-                            "ORDER BY name_local_estimate",
-                            (oe_id,)
-                        )
-                        local_estimates = cursor.fetchall()
-
-                        for le_id, le_name, le_price in local_estimates:
-                            oe_data['local_estimates'].append({
-                                'id': le_id,
-                                'name': le_name,
-                                'price': le_price
-                            })
-
-                        obj_data['object_estimates'].append(oe_data)
-
-                    hierarchy['objects'].append(obj_data)
-
-                return hierarchy
+    def get_objects(self):
+        """
+        Объекты по порядку добавления (для дерева вкладки "Управление")
+        :return: список (id, название, есть ли объектные сметы)
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT o.id, o.object_name,
+                       EXISTS (SELECT 1 FROM object_estimates oe WHERE oe.object_id = o.id)
+                FROM objects o
+                ORDER BY o.id
+            """)
+            return cursor.fetchall()
 
-        except Exception as e:
-            raise Exception(f"Ошибка при получении иерархии: {str(e)}")
\ No newline at end of file
+    def get_object_estimates(self, object_id):
+        """
+        Объектные сметы объекта
+        :return: список (id, название, стоимость, есть ли локальные сметы)
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT oe.id, oe.name_object_estimate, oe.object_estimates_price,
+                       EXISTS (SELECT 1 FROM local_estimates le WHERE le.object_estimates_id = oe.id)
+                FROM object_estimates oe
+                WHERE oe.object_id = %s
+                ORDER BY oe.name_object_estimate, oe.id
+            """, (object_id,))
+            return cursor.fetchall()
+
+    def get_local_estimates(self, object_estimate_id):
+        """
+        Локальные сметы объектной сметы
+        :return: список (id, название, стоимость или None для необработанной)
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, name_local_estimate, local_estimates_price
+                FROM local_estimates
+                WHERE object_estimates_id = %s
+                ORDER BY name_local_estimate, id
+            """, (object_estimate_id,))
+            return cursor.fetchall()
@@ -0,0 +1,518 @@
+"""
+Версионные миграции служебных таблиц, столбцов и индексов, которых нет в дампах
+из dump_database/.
+
+Примененные версии записываются в schema_migrations. ensure_schema выполняется при
+первом подключении SmetaProcessor и применяет недостающие миграции по порядку, каждую
+в своей транзакции (кроме пакетных шагов BatchedUpdate). Операторы миграций
+идемпотентны: БД, в которых служебные таблицы появились до версионирования, проходят
+их повторно без изменений. Дампы не обновляются под миграции: схема после
+восстановления дампа доводится ensure_schema. Новая миграция - новый элемент в конце
+MIGRATIONS, уже выпущенные не меняются (исправление - отдельной новой миграцией).
+Требуется PostgreSQL 14+.
+"""
+
+# Ключ рекомендательной блокировки: миграции из нескольких экземпляров приложения
+# выполняются по очереди
+MIGRATION_LOCK_ID = 7350001
+
+VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(250) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+# Строк в одном пакете BatchedUpdate
+BACKFILL_BATCH_SIZE = 50000
+
+
+class BatchedUpdate:
+    """
+    Шаг миграции: UPDATE таблицы по диапазонам id, каждый диапазон в своей транзакции,
+    чтобы заполнение большой таблицы не держало блокировки строк и не копило
+    изменения одной транзакцией. Предыдущие операторы миграции фиксируются перед
+    первым пакетом. После сбоя миграция выполняется заново с начала, поэтому
+    оператор сам пропускает уже обновленные строки.
+    """
+
+    def __init__(self, table: str, statement: str, pending: str, batch_size: int = BACKFILL_BATCH_SIZE):
+        """
+        :param statement: UPDATE с параметрами %(low)s и %(high)s: low < id <= high
+        :param pending: условие строк, которые еще нужно обновить (границы диапазонов)
+        """
+        self.table = table
+        self.statement = statement
+        self.pending = pending
+        self.batch_size = batch_size
+
+    def run(self, conn, cursor):
+        cursor.execute(f"SELECT min(id) - 1, max(id) FROM {self.table} WHERE {self.pending}")
+        low, max_id = cursor.fetchone()
+        while max_id is not None and low < max_id:
+            cursor.execute(self.statement, {'low': low, 'high': low + self.batch_size})
+            conn.commit()
+            low += self.batch_size
+
+
+def item_backfill(table: str, name_column: str) -> BatchedUpdate:
+    """Заполнение item_id у строк table, перенесенных в справочник"""
+    return BatchedUpdate(table, f"""
+        UPDATE {table} t
+        SET item_id = i.id
+        FROM estimate_items i
+        JOIN estimate_codes c ON i.code_id = c.id
+        WHERE t.id > %(low)s AND t.id <= %(high)s
+          AND t.item_id IS NULL
+          AND c.code = t.code
+          AND i.measurement_unit = t.measurement_unit
+          AND md5(i.name) = md5(t.{name_column})
+    """, pending="item_id IS NULL")
+
+
+MIGRATIONS = [
+    (1, "Реестр загруженных файлов", [
+        # Реестр загруженных файлов (по хэшу содержимого)
+        """
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            id SERIAL PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            file_kind VARCHAR(20) NOT NULL,
+            file_name VARCHAR(1000) NOT NULL,
+            object_estimate_id INT REFERENCES object_estimates(id) ON DELETE CASCADE,
+            local_estimate_id INT REFERENCES local_estimates(id) ON DELETE CASCADE,
+            ingested_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ingested_files_hash_idx ON ingested_files (file_kind, content_hash)",
+    ]),
+    (2, "Индексы по внешним ключам", [
+        # Индексы по внешним ключам: без них каскадное удаление ищет дочерние строки
+        # полным просмотром таблицы на каждую удаляемую родительскую строку
+        "CREATE INDEX IF NOT EXISTS object_estimates_object_id_idx ON object_estimates (object_id)",
+        "CREATE INDEX IF NOT EXISTS local_estimates_object_estimates_id_idx ON local_estimates (object_estimates_id)",
+        "CREATE INDEX IF NOT EXISTS sections_estimate_id_idx ON sections (estimate_id)",
+        "CREATE INDEX IF NOT EXISTS work_local_section_id_idx ON work (local_section_id)",
+        "CREATE INDEX IF NOT EXISTS materials_work_id_idx ON materials (work_id)",
+        "CREATE INDEX IF NOT EXISTS ingested_files_object_estimate_id_idx ON ingested_files (object_estimate_id)",
+        "CREATE INDEX IF NOT EXISTS ingested_files_local_estimate_id_idx ON ingested_files (local_estimate_id)",
+    ]),
+    (3, "Справочник позиций", [
+        # Справочник позиций: код, наименование и единица измерения хранятся один раз,
+        # work и materials ссылаются на них по item_id
+        """
+        CREATE TABLE IF NOT EXISTS estimate_codes (
+            id SERIAL PRIMARY KEY,
+            code VARCHAR(250) NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS estimate_items (
+            id SERIAL PRIMARY KEY,
+            code_id INT NOT NULL REFERENCES estimate_codes(id),
+            name VARCHAR(1000) NOT NULL,
+            measurement_unit VARCHAR(250) NOT NULL
+        )
+        """,
+        # Наименование в ключе по md5: длинный текст может не поместиться в строку индекса
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS estimate_items_key_idx
+            ON estimate_items (code_id, measurement_unit, md5(name))
+        """,
+        "ALTER TABLE work ADD COLUMN IF NOT EXISTS item_id INT REFERENCES estimate_items(id)",
+        "ALTER TABLE materials ADD COLUMN IF NOT EXISTS item_id INT REFERENCES estimate_items(id)",
+        # Текст позиции у новых строк не дублируется, он есть в справочнике; у старых
+        # строк остается до миграции "Удаление текста позиций из работ и материалов"
+        "ALTER TABLE work ALTER COLUMN name_work DROP NOT NULL, ALTER COLUMN measurement_unit DROP NOT NULL",
+        "ALTER TABLE materials ALTER COLUMN name_material DROP NOT NULL, ALTER COLUMN measurement_unit DROP NOT NULL",
+
+        # Перенос в справочник строк, загруженных до его появления (в т.ч. из дампов).
+        # Частичные индексы пусты после переноса, поэтому повторные проверки не сканируют таблицы
+        "CREATE INDEX IF NOT EXISTS work_without_item_idx ON work (id) WHERE item_id IS NULL",
+        "CREATE INDEX IF NOT EXISTS materials_without_item_idx ON materials (id) WHERE item_id IS NULL",
+        """
+        INSERT INTO estimate_codes (code)
+        SELECT code FROM work WHERE item_id IS NULL
+        UNION
+        SELECT code FROM materials WHERE item_id IS NULL
+        ON CONFLICT (code) DO NOTHING
+        """,
+        """
+        INSERT INTO estimate_items (code_id, name, measurement_unit)
+        SELECT c.id, t.name, t.measurement_unit
+        FROM (
+            SELECT code, name_work AS name, measurement_unit FROM work WHERE item_id IS NULL
+            UNION
+            SELECT code, name_material, measurement_unit FROM materials WHERE item_id IS NULL
+        ) t
+        JOIN estimate_codes c ON c.code = t.code
+        ON CONFLICT DO NOTHING
+        """,
+        item_backfill('work', 'name_work'),
+        item_backfill('materials', 'name_material'),
+    ]),
+    (4, "Категории локальных смет", [
+        # Категории локальных смет (АР, КР, ...) по шаблонам ILIKE наименования. Справочник
+        # заполняется при создании, дальше его можно дополнять: категория сметы проставляется
+        # триггером при загрузке и пересчитывается триггером при любом изменении справочника
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('estimate_categories') IS NULL THEN
+                CREATE TABLE estimate_categories (
+                    id SERIAL PRIMARY KEY,
+                    code VARCHAR(20) NOT NULL UNIQUE,
+                    name VARCHAR(250) NOT NULL,
+                    patterns TEXT[] NOT NULL
+                );
+                INSERT INTO estimate_categories (code, name, patterns) VALUES
+                    ('АР', 'Архитектурные решения', ARRAY[
+                        '%Архитектурные решения%',
+                        '%Кровля и кладка%',
+                        '%Витражи%',
+                        '%Отделочные работы%'
+                    ]),
+                    ('КР', 'Конструктивные решения', ARRAY[
+                        '%Конструктивные решения%',
+                        '%Конструкции железобетонные%',
+                        '%Конструктивные и объемно-планировочные решения%',
+                        '%Конструкции металлические%',
+                        '%Железобетонные,металлические конструкции%',
+                        '%Конструкции деревянные%',
+                        '%Железобетонные конструкции%'
+                    ]);
+            END IF;
+        END $$
+        """,
+        # При совпадении с несколькими категориями выбирается заведенная раньше
+        """
+        CREATE OR REPLACE FUNCTION local_estimate_category(estimate_name TEXT) RETURNS INT
+        LANGUAGE sql STABLE AS $$
+            SELECT id FROM estimate_categories
+            WHERE estimate_name ILIKE ANY(patterns)
+            ORDER BY id
+            LIMIT 1
+        $$
+        """,
+        # Столбец добавляется один раз вместе с разметкой уже загруженных смет
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = 'local_estimates' AND column_name = 'category_id'
+            ) THEN
+                ALTER TABLE local_estimates
+                    ADD COLUMN category_id INT REFERENCES estimate_categories(id) ON DELETE SET NULL;
+                UPDATE local_estimates SET category_id = local_estimate_category(name_local_estimate);
+            END IF;
+        END $$
+        """,
+        "CREATE INDEX IF NOT EXISTS local_estimates_category_id_idx ON local_estimates (category_id)",
+        """
+        CREATE OR REPLACE FUNCTION set_local_estimate_category() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.category_id := local_estimate_category(NEW.name_local_estimate);
+            RETURN NEW;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER local_estimates_category_trg
+            BEFORE INSERT OR UPDATE OF name_local_estimate ON local_estimates
+            FOR EACH ROW EXECUTE FUNCTION set_local_estimate_category()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION reclassify_local_estimates() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE local_estimates
+            SET category_id = local_estimate_category(name_local_estimate)
+            WHERE category_id IS DISTINCT FROM local_estimate_category(name_local_estimate);
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER estimate_categories_reclassify_trg
+            AFTER INSERT OR UPDATE OR DELETE ON estimate_categories
+            FOR EACH STATEMENT EXECUTE FUNCTION reclassify_local_estimates()
+        """,
+    ]),
+    (5, "Индексы по кодам позиций", [
+        # Индексы для выборок по кодам: отчеты и поиск позиций идут от кода через справочник
+        # (estimate_codes.code уже уникален). Индексы на work.code/materials.code - миграция
+        # "Индексы по кодам работ и материалов"
+        "CREATE INDEX IF NOT EXISTS estimate_items_code_id_idx ON estimate_items (code_id)",
+        "CREATE INDEX IF NOT EXISTS work_item_id_idx ON work (item_id)",
+        "CREATE INDEX IF NOT EXISTS materials_item_id_idx ON materials (item_id)",
+    ]),
+    (6, "Ключи объекта в работах и материалах", [
+        # Объект и объектная смета хранятся прямо в строках work и materials (заполняются
+        # при загрузке), чтобы отчеты по объектам не проходили цепочку разделов и смет.
+        # Локальные сметы между объектными сметами не переносятся, поэтому ключи строки
+        # после загрузки не меняются
+        """
+        ALTER TABLE work
+            ADD COLUMN IF NOT EXISTS object_id INT,
+            ADD COLUMN IF NOT EXISTS object_estimates_id INT
+        """,
+        """
+        ALTER TABLE materials
+            ADD COLUMN IF NOT EXISTS object_id INT,
+            ADD COLUMN IF NOT EXISTS object_estimates_id INT
+        """,
+        """
+        UPDATE work w
+        SET object_id = oe.object_id, object_estimates_id = oe.id
+        FROM sections s
+        JOIN local_estimates le ON s.estimate_id = le.id
+        JOIN object_estimates oe ON le.object_estimates_id = oe.id
+        WHERE w.local_section_id = s.id AND w.object_id IS NULL
+        """,
+        """
+        UPDATE materials m
+        SET object_id = w.object_id, object_estimates_id = w.object_estimates_id
+        FROM work w
+        WHERE m.work_id = w.id AND m.object_id IS NULL
+        """,
+        "ALTER TABLE work ALTER COLUMN object_id SET NOT NULL, ALTER COLUMN object_estimates_id SET NOT NULL",
+        "ALTER TABLE materials ALTER COLUMN object_id SET NOT NULL, ALTER COLUMN object_estimates_id SET NOT NULL",
+        # Выборка объекта по позициям справочника (код - через item_id)
+        "CREATE INDEX IF NOT EXISTS work_object_item_idx ON work (object_id, item_id)",
+        "CREATE INDEX IF NOT EXISTS materials_object_item_idx ON materials (object_id, item_id)",
+    ]),
+    (7, "Удаление текста позиций из работ и материалов", [
+        # Наименование и единица измерения строк work и materials есть в справочнике
+        # (item_id заполнен у всех строк миграцией "Справочник позиций"). Удаление
+        # столбцов не переписывает таблицы: место старых строк освобождает VACUUM FULL
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM work WHERE item_id IS NULL)
+                    OR EXISTS (SELECT 1 FROM materials WHERE item_id IS NULL) THEN
+                RAISE EXCEPTION 'есть работы или материалы без позиции справочника (item_id)';
+            END IF;
+        END
+        $$
+        """,
+        "DROP INDEX IF EXISTS work_without_item_idx",
+        "DROP INDEX IF EXISTS materials_without_item_idx",
+        "ALTER TABLE work ALTER COLUMN item_id SET NOT NULL",
+        "ALTER TABLE materials ALTER COLUMN item_id SET NOT NULL",
+        "ALTER TABLE work DROP COLUMN IF EXISTS name_work, DROP COLUMN IF EXISTS measurement_unit",
+        "ALTER TABLE materials DROP COLUMN IF EXISTS name_material, DROP COLUMN IF EXISTS measurement_unit",
+        # Секции архивных объектов (models.partitioning) отсоединены от work/materials:
+        # присоединить их обратно можно только с теми же столбцами
+        """
+        DO $$
+        DECLARE
+            archived RECORD;
+            missing BOOLEAN;
+        BEGIN
+            FOR archived IN
+                SELECT c.relname, CASE WHEN c.relname LIKE 'work%' THEN 'name_work'
+                                       ELSE 'name_material' END AS name_column
+                FROM pg_class c
+                WHERE c.relkind = 'r' AND NOT c.relispartition AND pg_table_is_visible(c.oid)
+                  AND c.relname ~ '^(work|materials)_object_[0-9]+$'
+            LOOP
+                EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE item_id IS NULL)', archived.relname)
+                    INTO missing;
+                IF missing THEN
+                    RAISE EXCEPTION '% : есть строки без позиции справочника (item_id)', archived.relname;
+                END IF;
+                EXECUTE format('ALTER TABLE %I ALTER COLUMN item_id SET NOT NULL, '
+                               'DROP COLUMN IF EXISTS %I, DROP COLUMN IF EXISTS measurement_unit',
+                               archived.relname, archived.name_column);
+            END LOOP;
+        END
+        $$
+        """,
+    ]),
+    (8, "Несколько категорий у локальной сметы", [
+        # Смета, наименование которой подходит под шаблоны нескольких категорий (например,
+        # АР и КР сразу), относится ко всем им, как в отчетах до появления справочника.
+        # Связи смет с категориями - в отдельной таблице вместо одного category_id
+        """
+        CREATE TABLE IF NOT EXISTS local_estimate_categories (
+            local_estimate_id INT NOT NULL REFERENCES local_estimates(id) ON DELETE CASCADE,
+            category_id INT NOT NULL REFERENCES estimate_categories(id) ON DELETE CASCADE,
+            PRIMARY KEY (local_estimate_id, category_id)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS local_estimate_categories_category_id_idx
+            ON local_estimate_categories (category_id)
+        """,
+        """
+        INSERT INTO local_estimate_categories (local_estimate_id, category_id)
+        SELECT le.id, c.id
+        FROM local_estimates le
+        JOIN estimate_categories c ON le.name_local_estimate ILIKE ANY(c.patterns)
+        ON CONFLICT DO NOTHING
+        """,
+        "DROP TRIGGER IF EXISTS local_estimates_category_trg ON local_estimates",
+        "DROP FUNCTION IF EXISTS set_local_estimate_category()",
+        "ALTER TABLE local_estimates DROP COLUMN IF EXISTS category_id",
+        "DROP FUNCTION IF EXISTS local_estimate_category(TEXT)",
+        # Связи ссылаются на строку сметы, поэтому проставляются после её записи
+        """
+        CREATE OR REPLACE FUNCTION set_local_estimate_categories() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM local_estimate_categories WHERE local_estimate_id = NEW.id;
+            INSERT INTO local_estimate_categories (local_estimate_id, category_id)
+            SELECT NEW.id, c.id FROM estimate_categories c
+            WHERE NEW.name_local_estimate ILIKE ANY(c.patterns);
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER local_estimates_categories_trg
+            AFTER INSERT OR UPDATE OF name_local_estimate ON local_estimates
+            FOR EACH ROW EXECUTE FUNCTION set_local_estimate_categories()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION reclassify_local_estimates() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM local_estimate_categories;
+            INSERT INTO local_estimate_categories (local_estimate_id, category_id)
+            SELECT le.id, c.id
+            FROM local_estimates le
+            JOIN estimate_categories c ON le.name_local_estimate ILIKE ANY(c.patterns);
+            RETURN NULL;
+        END
+        $$
+        """,
+    ]),
+    (9, "Индексы по кодам работ и материалов", [
+        # Выборка строк work/materials по коду напрямую, без справочника (поиск позиции
+        # по всем сметам, ручные запросы). Стоимость - поддержка индекса при загрузке
+        "CREATE INDEX IF NOT EXISTS work_code_idx ON work (code)",
+        "CREATE INDEX IF NOT EXISTS materials_code_idx ON materials (code)",
+    ]),
+    (10, "Промежуточные таблицы загрузки смет", [
+        # Строки пакета загрузки (EstimateStagingWriter) до переноса в sections, work и
+        # materials. UNLOGGED: запись не попадает в WAL, после сбоя сервера таблицы
+        # очищаются - незавершенный пакет загружается заново. Номера строк задаются
+        # внутри пакета, ID разделов и работ выдаются из последовательностей рабочих
+        # таблиц при COPY, в порядке строк документа
+        "CREATE SEQUENCE IF NOT EXISTS staging_batch_id_seq",
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS staging_sections (
+            batch_id BIGINT NOT NULL,
+            section_no INT NOT NULL,
+            section_id INT NOT NULL DEFAULT nextval(pg_get_serial_sequence('sections', 'id')),
+            estimate_id INT,
+            name_section TEXT,
+            PRIMARY KEY (batch_id, section_no)
+        )
+        """,
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS staging_work (
+            batch_id BIGINT NOT NULL,
+            work_no INT NOT NULL,
+            work_id INT NOT NULL DEFAULT nextval(pg_get_serial_sequence('work', 'id')),
+            section_no INT,
+            code TEXT,
+            name TEXT,
+            measurement_unit TEXT,
+            price NUMERIC,
+            PRIMARY KEY (batch_id, work_no)
+        )
+        """,
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS staging_materials (
+            batch_id BIGINT NOT NULL,
+            material_no INT NOT NULL,
+            work_no INT,
+            code TEXT,
+            name TEXT,
+            measurement_unit TEXT,
+            price NUMERIC,
+            PRIMARY KEY (batch_id, material_no)
+        )
+        """,
+    ]),
+]
+
+
+def applied_versions(conn) -> set:
+    """Примененные версии (пустое множество, если таблицы версий еще нет)"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return set()
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+    conn.rollback()
+    return versions
+
+
+def pending_migrations(conn) -> list:
+    """Миграции, которые еще не применены к БД: [(версия, название), ...]"""
+    applied = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def ensure_schema(conn) -> list:
+    """
+    Применяет недостающие миграции
+    :return: примененные сейчас версии (пустой список, если схема актуальна)
+    """
+    if not pending_migrations(conn):
+        return []
+
+    applied_now = []
+    with conn.cursor() as cursor:
+        # Блокировка сеанса, а не транзакции: пакеты BatchedUpdate фиксируются по одному
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            for version, name, statements in MIGRATIONS:
+                try:
+                    cursor.execute(VERSION_TABLE)
+                    # Другой экземпляр мог применить миграцию, пока ждали блокировку
+                    cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                    if cursor.fetchone():
+                        conn.rollback()
+                        continue
+                    for statement in statements:
+                        if isinstance(statement, BatchedUpdate):
+                            conn.commit()
+                            statement.run(conn, cursor)
+                        else:
+                            cursor.execute(statement)
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                                   (version, name))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    raise Exception(f"Ошибка миграции {version} ({name}): {e}")
+                applied_now.append(version)
+        finally:
+            if not conn.closed:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                conn.commit()
+    return applied_now
+
+
+if __name__ == "__main__":
+    # Ручная проверка и применение миграций: python -m models.schema
+    import psycopg2
+    from config import DB_CONFIG
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        for version, name in pending_migrations(connection):
+            print(f"Ожидает применения: {version}. {name}")
+        applied = ensure_schema(connection)
+        print(f"Применены миграции: {applied}" if applied else "Схема БД актуальна")
+    finally:
+        connection.close()
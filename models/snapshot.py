@@ -0,0 +1,293 @@
+"""
+Снимки БД для быстрого развертывания тестовых и аналитических копий.
+
+Снимок - zip-архив: manifest.json со схемой и по CSV-файлу на таблицу. Данные
+выгружаются COPY TO в одной транзакции REPEATABLE READ (согласованный срез всех
+таблиц) и загружаются COPY FROM в пустую БД. Схема восстанавливается в порядке
+pg_dump: сначала последовательности и таблицы без ограничений, затем данные,
+и только после загрузки - ключи, внешние ключи, индексы, функции и триггеры
+(построение индекса по готовой таблице быстрее поддержки его на каждой строке,
+а триггеры не пересчитывают уже выгруженные значения).
+
+    python -m models.snapshot export snapshot.zip
+    python -m models.snapshot import snapshot.zip --dbname smeta_test --create
+
+Переносится схема public: таблицы (в том числе секционированные), последовательности,
+функции и триггеры. Представления, расширения и права не переносятся.
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+import zipfile
+
+import psycopg2
+from psycopg2 import sql
+
+from config import DB_CONFIG
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+SCHEMA = "public"
+
+# Таблицы схемы; секции - после своих таблиц
+TABLES_QUERY = """
+    SELECT c.oid, c.relname, quote_ident(c.relname), c.relkind, c.relpersistence = 'u',
+           pg_get_partkeydef(c.oid), quote_ident(parent.relname), pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_class c
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+    LEFT JOIN pg_class parent ON parent.oid = i.inhparent
+    WHERE c.relnamespace = %(schema)s::regnamespace AND c.relkind IN ('r', 'p')
+    ORDER BY c.relispartition, c.relname
+"""
+
+COLUMNS_QUERY = """
+    SELECT quote_ident(a.attname), format_type(a.atttypid, a.atttypmod), a.attnotnull,
+           pg_get_expr(d.adbin, d.adrelid)
+    FROM pg_attribute a
+    LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+    WHERE a.attrelid = %(oid)s AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+"""
+
+SEQUENCES_QUERY = """
+    SELECT quote_ident(s.sequencename), s.data_type, s.start_value, s.increment_by,
+           s.min_value, s.max_value, s.cache_size, s.cycle,
+           quote_ident(t.relname) || '.' || quote_ident(a.attname)
+    FROM pg_sequences s
+    LEFT JOIN pg_depend d ON d.objid = format('%%I.%%I', s.schemaname, s.sequencename)::regclass
+                         AND d.classid = 'pg_class'::regclass AND d.deptype = 'a'
+    LEFT JOIN pg_class t ON t.oid = d.refobjid
+    LEFT JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE s.schemaname = %(schema)s
+    ORDER BY s.sequencename
+"""
+
+FUNCTIONS_QUERY = """
+    SELECT pg_get_functiondef(p.oid)
+    FROM pg_proc p
+    WHERE p.pronamespace = %(schema)s::regnamespace AND p.prokind IN ('f', 'p')
+      AND NOT EXISTS (SELECT 1 FROM pg_depend d WHERE d.objid = p.oid AND d.deptype = 'e')
+    ORDER BY p.oid
+"""
+
+# Ограничения, унаследованные секциями от таблицы, создаются вместе с ней
+CONSTRAINTS_QUERY = """
+    SELECT format('ALTER TABLE %%s ADD CONSTRAINT %%I %%s',
+                  c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid))
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    WHERE t.relnamespace = %(schema)s::regnamespace AND c.contype IN ('p', 'u', 'x', 'c', 'f')
+      AND c.conparentid = 0
+    ORDER BY position(c.contype IN 'puxcf'), c.oid
+"""
+
+# Индексы, кроме созданных ограничениями и индексов секций. Индекс секционированной
+# таблицы описывается как "ON ONLY" - без ONLY он создается и на всех секциях
+INDEXES_QUERY = """
+    SELECT replace(pg_get_indexdef(i.indexrelid), ' ON ONLY ', ' ON ')
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    WHERE ic.relnamespace = %(schema)s::regnamespace AND NOT ic.relispartition
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                      WHERE c.conindid = i.indexrelid AND c.contype IN ('p', 'u', 'x'))
+    ORDER BY i.indexrelid
+"""
+
+TRIGGERS_QUERY = """
+    SELECT pg_get_triggerdef(tg.oid)
+    FROM pg_trigger tg
+    JOIN pg_class t ON t.oid = tg.tgrelid
+    WHERE t.relnamespace = %(schema)s::regnamespace AND NOT tg.tgisinternal AND tg.tgparentid = 0
+    ORDER BY tg.oid
+"""
+
+
+def fetch_column(cursor, query: str, params: dict) -> list:
+    cursor.execute(query, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_definition(cursor, oid: int, name: str, kind: str, unlogged: bool, partition_key, parent, bound) -> str:
+    """CREATE TABLE без ограничений, кроме NOT NULL"""
+    create = "CREATE UNLOGGED TABLE" if unlogged else "CREATE TABLE"
+    if parent is not None:
+        definition = f"{create} {name} PARTITION OF {parent} {bound}"
+    else:
+        cursor.execute(COLUMNS_QUERY, {'oid': oid})
+        columns = [
+            f"{column} {column_type}" + (" NOT NULL" if not_null else "") +
+            (f" DEFAULT {default}" if default is not None else "")
+            for column, column_type, not_null, default in cursor.fetchall()
+        ]
+        definition = f"{create} {name} (\n    " + ",\n    ".join(columns) + "\n)"
+    if kind == 'p':
+        definition += f" PARTITION BY {partition_key}"
+    return definition
+
+
+def read_schema(cursor) -> dict:
+    """
+    Схема в порядке восстановления: pre_data - до загрузки данных, post_data - после;
+    tables - таблицы с данными: (имя, имя для SQL); секционированные таблицы данных не хранят
+    """
+    params = {'schema': SCHEMA}
+    pre_data, post_data, tables = [], [], []
+
+    cursor.execute(SEQUENCES_QUERY, params)
+    sequences = cursor.fetchall()
+    for name, data_type, start, increment, min_value, max_value, cache, cycle, owner in sequences:
+        pre_data.append(
+            f"CREATE SEQUENCE {name} AS {data_type} START WITH {start} INCREMENT BY {increment} "
+            f"MINVALUE {min_value} MAXVALUE {max_value} CACHE {cache}{' CYCLE' if cycle else ''}"
+        )
+        cursor.execute(f"SELECT last_value, is_called FROM {name}")
+        last_value, is_called = cursor.fetchone()
+        post_data.append(f"SELECT setval('{name}', {last_value}, {str(is_called).lower()})")
+        if owner is not None:
+            post_data.append(f"ALTER SEQUENCE {name} OWNED BY {owner}")
+
+    cursor.execute(TABLES_QUERY, params)
+    for oid, relname, name, kind, unlogged, partition_key, parent, bound in cursor.fetchall():
+        pre_data.append(table_definition(cursor, oid, name, kind, unlogged, partition_key, parent, bound))
+        if kind == 'r':
+            tables.append((relname, name))
+
+    # Функции - раньше ограничений и триггеров, которые могут их вызывать
+    post_data += fetch_column(cursor, FUNCTIONS_QUERY, params)
+    post_data += fetch_column(cursor, CONSTRAINTS_QUERY, params)
+    post_data += fetch_column(cursor, INDEXES_QUERY, params)
+    post_data += fetch_column(cursor, TRIGGERS_QUERY, params)
+    return {'pre_data': pre_data, 'post_data': post_data, 'tables': tables}
+
+
+def export_snapshot(db_params: dict, filename: str) -> dict:
+    """
+    Выгружает схему и данные БД в снимок filename
+    :return: манифест снимка
+    """
+    conn = psycopg2.connect(**db_params)
+    try:
+        # Все таблицы читаются из одного среза данных
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with conn.cursor() as cursor, \
+                zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            schema = read_schema(cursor)
+            cursor.execute("SHOW server_version")
+            server_version = cursor.fetchone()[0]
+
+            tables = []
+            for relname, table in schema['tables']:
+                member = f"{relname}.csv"
+                with archive.open(member, 'w', force_zip64=True) as data:
+                    cursor.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv)", data)
+                tables.append({'name': table, 'file': member, 'rows': cursor.rowcount})
+
+            manifest = {
+                'format': SNAPSHOT_FORMAT,
+                'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'database': db_params['dbname'],
+                'server_version': server_version,
+                'tables': tables,
+                'pre_data': schema['pre_data'],
+                'post_data': schema['post_data'],
+            }
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+        conn.rollback()
+        return manifest
+    except Exception:
+        # Недописанный снимок без манифеста не оставляется
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+    finally:
+        conn.close()
+
+
+def create_database(db_params: dict):
+    """Создает пустую БД db_params['dbname'] (через служебную БД postgres)"""
+    conn = psycopg2.connect(**{**db_params, 'dbname': 'postgres'})
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(db_params['dbname'])))
+    finally:
+        conn.close()
+
+
+def import_snapshot(db_params: dict, filename: str, create: bool = False) -> dict:
+    """
+    Загружает снимок filename в пустую БД одной транзакцией: при ошибке БД остается пустой
+    :param create: сначала создать БД
+    :return: манифест снимка
+    """
+    if create:
+        create_database(db_params)
+
+    with zipfile.ZipFile(filename) as archive:
+        manifest = json.loads(archive.read(MANIFEST_NAME))
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат снимка: {manifest.get('format')}")
+
+        conn = psycopg2.connect(**db_params)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT count(*) FROM pg_class
+                    WHERE relnamespace = %s::regnamespace AND relkind IN ('r', 'p', 'S', 'v', 'm')
+                """, (SCHEMA,))
+                if cursor.fetchone()[0]:
+                    raise ValueError(f"БД {db_params['dbname']} не пуста: снимок загружается только в пустую БД")
+
+                for statement in manifest['pre_data']:
+                    cursor.execute(statement)
+                for table in manifest['tables']:
+                    with archive.open(table['file']) as data:
+                        cursor.copy_expert(f"COPY {table['name']} FROM STDIN WITH (FORMAT csv)", data)
+                    if cursor.rowcount != table['rows']:
+                        raise ValueError(f"{table['name']}: загружено {cursor.rowcount} строк "
+                                         f"из {table['rows']}")
+                for statement in manifest['post_data']:
+                    cursor.execute(statement)
+                cursor.execute("ANALYZE")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('filename', help='файл снимка (.zip)')
+    parser.add_argument('--create', action='store_true', help='создать БД перед загрузкой (import)')
+    for key in ('dbname', 'user', 'password', 'host', 'port'):
+        parser.add_argument(f'--{key}', default=DB_CONFIG[key])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_params = {key: getattr(args, key) for key in ('dbname', 'user', 'password', 'host', 'port')}
+
+    started = time.perf_counter()
+    try:
+        if args.command == 'export':
+            manifest = export_snapshot(db_params, args.filename)
+            action = f"Снимок {args.filename} записан"
+        else:
+            manifest = import_snapshot(db_params, args.filename, args.create)
+            action = f"Снимок загружен в БД {args.dbname}"
+    except (ValueError, OSError, psycopg2.Error) as e:
+        raise SystemExit(f"Ошибка: {e}")
+    rows = sum(table['rows'] for table in manifest['tables'])
+    print(f"{action}: {len(manifest['tables'])} таблиц, {rows} строк "
+          f"за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
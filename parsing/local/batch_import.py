@@ -0,0 +1,193 @@
+import os
+import re
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+from parsing.local.processing_of_local_estimates_xml import (
+    PARSE_SUMMARY, MaterialRecord, WorkRecord, parse_xml_estimate, read_estimate_properties
+)
+from parsing.local.bulk_estimate_writer import EstimateBulkWriter
+
+
+class EstimateRecorder:
+    """
+    Объект записи для parse_xml_estimate, который ничего не пишет в БД, а запоминает
+    разделы, работы и материалы. Используется в дочерних процессах: результат
+    передается в основной процесс и там записывается через replay().
+    """
+
+    def __init__(self):
+        self.sections = []   # (estimate_id, название раздела)
+        self.works = []      # (номер раздела, WorkRecord)
+        self.materials = []  # (номер работы, MaterialRecord)
+        self.total_cost = None
+
+    def save_section(self, estimate_id: int, section_name: str) -> int:
+        self.sections.append((estimate_id, section_name))
+        return len(self.sections)
+
+    def save_work(self, section_id: int, work: WorkRecord) -> int:
+        self.works.append((section_id, work))
+        return len(self.works)
+
+    def save_material(self, work_id: int, material: MaterialRecord):
+        self.materials.append((work_id, material))
+
+    def update_local_estimate_price(self, estimate_id: int, total_cost: float):
+        self.total_cost = total_cost
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def replay(self, db_handler, estimate_id: int):
+        """Записывает запомненные строки через db_handler (без commit)"""
+        section_ids = [db_handler.save_section(estimate_id, name) for _, name in self.sections]
+        work_ids = [db_handler.save_work(section_ids[section_no - 1], work)
+                    for section_no, work in self.works]
+        for work_no, material in self.materials:
+            db_handler.save_material(work_ids[work_no - 1], material)
+        db_handler.flush()
+        db_handler.update_local_estimate_price(estimate_id, self.total_cost)
+
+
+def parse_estimate_file(xml_file_path: str, estimate_id: Optional[int] = None) -> Tuple[EstimateRecorder, float]:
+    """
+    Разбирает XML без обращения к БД (выполняется в дочернем процессе).
+    ID сметы можно не знать заранее: он нужен только при записи (replay)
+    """
+    started = time.perf_counter()
+    recorder = EstimateRecorder()
+    parse_xml_estimate(xml_file_path, None, estimate_id, db_handler=recorder, mode=PARSE_SUMMARY)
+    return recorder, time.perf_counter() - started
+
+
+def write_parsed_estimates(futures: Dict[Future, Tuple[str, int]], writer,
+                           on_written: Optional[Callable[[Dict], None]] = None,
+                           before_commit: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Записывает результаты разбора по мере их готовности, каждый файл - в своей транзакции
+    :param futures: задачи parse_estimate_file и соответствующие им пары (путь к файлу, ID сметы)
+    :param writer: объект записи (EstimateBulkWriter, EstimateStagingWriter)
+    :param on_written: вызывается с отчетом после каждого файла; исключение из него
+                       останавливает запись оставшихся файлов
+    :param before_commit: вызывается с отчетом в транзакции файла перед её фиксацией
+                          (например, запись в реестр загруженных файлов); ошибка в нем
+                          откатывает файл
+    :return: отчет по каждому файлу: file, estimate_id, parse_time, write_time, total_cost, error
+    """
+    reports = []
+    for future in as_completed(futures):
+        file_path, estimate_id = futures[future]
+        report = {
+            'file': file_path,
+            'estimate_id': estimate_id,
+            'parse_time': None,
+            'write_time': None,
+            'total_cost': None,
+            'error': None
+        }
+        try:
+            recorder, report['parse_time'] = future.result()
+            started = time.perf_counter()
+            recorder.replay(writer, estimate_id)
+            report['total_cost'] = round(recorder.total_cost, 2)
+            if before_commit is not None:
+                before_commit(report)
+            writer.commit()
+            report['write_time'] = time.perf_counter() - started
+        except Exception as e:
+            writer.rollback()
+            report['total_cost'] = None
+            report['error'] = str(e)
+        reports.append(report)
+        if on_written is not None:
+            on_written(report)
+
+    return reports
+
+
+def import_local_estimates(files: List[Tuple[str, int]], db_params: Dict,
+                           max_workers: Optional[int] = None, conn=None,
+                           on_written: Optional[Callable[[Dict], None]] = None,
+                           before_commit: Optional[Callable[[Dict], None]] = None,
+                           writer_cls=EstimateBulkWriter) -> List[Dict]:
+    """
+    Пакетная загрузка локальных смет.
+
+    Файлы разбираются параллельно в пуле процессов (по процессу на ядро), готовые
+    результаты по мере поступления записываются одним объектом записи. Каждый файл
+    пишется в своей транзакции: ошибка в одном файле не отменяет остальные.
+    :param files: список пар (путь к XML файлу, ID локальной сметы)
+    :param db_params: параметры подключения к БД
+    :param max_workers: число процессов разбора (по умолчанию - число ядер)
+    :param conn: соединение для записи (по умолчанию открывается новое по db_params)
+    :param on_written: см. write_parsed_estimates
+    :param before_commit: см. write_parsed_estimates
+    :param writer_cls: класс записи: EstimateBulkWriter (COPY сразу в рабочие таблицы)
+                       или EstimateStagingWriter (через промежуточные таблицы с проверкой)
+    :return: отчет по каждому файлу (см. write_parsed_estimates)
+    """
+    if not files:
+        return []
+
+    max_workers = max_workers or min(len(files), os.cpu_count() or 1)
+    writer = writer_cls(db_params, conn=conn)
+
+    pool = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            pool.submit(parse_estimate_file, file_path, estimate_id): (file_path, estimate_id)
+            for file_path, estimate_id in files
+        }
+        return write_parsed_estimates(futures, writer, on_written, before_commit)
+    finally:
+        # При остановке (ошибка или отмена) еще не начатый разбор не нужен
+        pool.shutdown(cancel_futures=True)
+
+
+def extract_estimate_code(text: str) -> Optional[str]:
+    """Выделяет шифр сметы вида 02-01-01 (или 02-01-02.3) из строки"""
+    match = re.search(r'\d+(?:[-.]\d+)+', text or '')
+    return match.group(0) if match else None
+
+
+def match_files_to_estimates(file_paths: List[str],
+                             estimates: List[Tuple[int, str]]) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """
+    Сопоставляет XML файлы локальным сметам по шифру.
+
+    Шифр файла берется из LocNum документа (если его нет - из имени файла), шифр
+    сметы - из её названия в объектной смете. Смета с неоднозначным шифром или уже
+    занятая другим файлом не сопоставляется.
+    :param file_paths: пути к XML файлам
+    :param estimates: пары (ID локальной сметы, название)
+    :return: (список пар (файл, ID сметы), список несопоставленных файлов)
+    """
+    by_code = {}
+    for estimate_id, name in estimates:
+        by_code.setdefault(extract_estimate_code(name), []).append(estimate_id)
+
+    matched, unmatched, used = [], [], set()
+    for file_path in file_paths:
+        try:
+            code = extract_estimate_code(read_estimate_properties(file_path).get('LocNum'))
+        except Exception:
+            code = None
+        if code is None:
+            code = extract_estimate_code(os.path.basename(file_path))
+
+        candidates = by_code.get(code, []) if code else []
+        if len(candidates) == 1 and candidates[0] not in used:
+            used.add(candidates[0])
+            matched.append((file_path, candidates[0]))
+        else:
+            unmatched.append(file_path)
+
+    return matched, unmatched
@@ -0,0 +1,133 @@
+import csv
+import io
+import psycopg2
+from typing import Dict, List
+
+from models.item_dictionary import ItemDictionary
+from parsing.local.processing_of_local_estimates_xml import MaterialRecord, ObjectKeys, WorkRecord
+
+
+class EstimateBulkWriter:
+    """
+    Пакетная запись локальной сметы для parse_xml_estimate.
+
+    Интерфейс совпадает с EstimateDBHandler, но строки не вставляются по одной:
+    разделы, работы и материалы копятся в памяти и при flush() пишутся тремя COPY.
+    ID разделов и работ нужны сразу (на них ссылаются дочерние строки), поэтому они
+    резервируются заранее блоками из последовательностей таблиц - без RETURNING
+    на каждую строку. Ключи справочника позиций для всего буфера получаются
+    перед COPY одним набором запросов.
+    """
+
+    # Размер блока резервируемых ID растет от MIN до MAX, чтобы маленькие сметы
+    # не оставляли больших пропусков в последовательностях
+    MIN_ID_BLOCK = 64
+    MAX_ID_BLOCK = 4096
+
+    def __init__(self, db_params: Dict = None, conn=None):
+        self.owns_conn = conn is None
+        self.conn = conn if conn is not None else psycopg2.connect(**db_params)
+        self.cur = self.conn.cursor()
+        self.reserved_ids = {'sections': [], 'work': []}
+        self.block_sizes = {'sections': self.MIN_ID_BLOCK, 'work': self.MIN_ID_BLOCK}
+        self.sections: List[tuple] = []
+        self.works: List[tuple] = []
+        self.materials: List[tuple] = []
+        self.items = ItemDictionary()
+        self.keys = ObjectKeys()
+
+    def __del__(self):
+        if getattr(self, 'owns_conn', False):
+            self.cur.close()
+            self.conn.close()
+
+    def _next_id(self, table: str) -> int:
+        """Выдает следующий зарезервированный ID, при необходимости резервирует новый блок"""
+        ids = self.reserved_ids[table]
+        if not ids:
+            block_size = self.block_sizes[table]
+            self.cur.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                (table, block_size)
+            )
+            ids.extend(row[0] for row in self.cur.fetchall())
+            ids.reverse()  # pop() с конца списка выдает ID по возрастанию
+            self.block_sizes[table] = min(block_size * 2, self.MAX_ID_BLOCK)
+        return ids.pop()
+
+    def save_section(self, estimate_id: int, section_name: str) -> int:
+        """Добавляет раздел в буфер и возвращает зарезервированный ID"""
+        section_id = self._next_id('sections')
+        self.keys.add_section(self.cur, estimate_id, section_id)
+        self.sections.append((section_id, estimate_id, section_name))
+        return section_id
+
+    def save_work(self, section_id: int, work: WorkRecord) -> int:
+        """Добавляет работу в буфер и возвращает зарезервированный ID"""
+        work_id = self._next_id('work')
+        self.keys.add_work(section_id, work_id)
+        self.works.append((
+            work_id,
+            section_id,
+            (work.clean_code, work.caption, work.units),
+            work.price,
+            work.clean_code,
+            *self.keys.section(section_id)
+        ))
+        return work_id
+
+    def save_material(self, work_id: int, material: MaterialRecord):
+        """Добавляет материал в буфер"""
+        self.materials.append((
+            work_id,
+            (material.clean_code, material.name, material.units),
+            material.price,
+            material.clean_code,
+            *self.keys.work(work_id)
+        ))
+
+    def update_local_estimate_price(self, estimate_id: int, total_cost: float):
+        """Обновляет общую стоимость в local_estimates"""
+        self.cur.execute(
+            "UPDATE local_estimates SET local_estimates_price = %s WHERE id = %s",
+            (total_cost, estimate_id)
+        )
+
+    def _copy(self, table: str, columns: str, rows: List[tuple]):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        # Строки всегда в кавычках: пустое значение без кавычек COPY считает NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n').writerows(rows)
+        buffer.seek(0)
+        self.cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def flush(self):
+        """Записывает накопленные строки (родительские таблицы раньше дочерних)"""
+        self.items.resolve_many(self.cur, [row[2] for row in self.works] + [row[1] for row in self.materials])
+        get_item = self.items.get
+        self._copy('sections', 'id, estimate_id, name_section', self.sections)
+        self._copy('work', 'id, local_section_id, item_id, price, code, object_id, object_estimates_id',
+                   [(work_id, section_id, get_item(key), price, code, object_id, object_estimates_id)
+                    for work_id, section_id, key, price, code, object_id, object_estimates_id in self.works])
+        self._copy('materials', 'work_id, item_id, price, code, object_id, object_estimates_id',
+                   [(work_id, get_item(key), price, code, object_id, object_estimates_id)
+                    for work_id, key, price, code, object_id, object_estimates_id in self.materials])
+        self._clear()
+
+    def _clear(self):
+        self.sections.clear()
+        self.works.clear()
+        self.materials.clear()
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+        self.items.commit()
+        self.keys.clear()
+
+    def rollback(self):
+        self._clear()
+        self.conn.rollback()
+        self.items.rollback()
+        self.keys.clear()
@@ -1,14 +1,91 @@
 import xml.etree.ElementTree as ET
 import psycopg2
-from typing import Dict
+from typing import Dict, Iterator, Optional
 from psycopg2 import sql
 import re
 
+from models.item_dictionary import ItemDictionary
+
+
+# Префиксы кодов работ и материалов
+WORK_CODE_TYPES = ('ФЕР', 'ТЕР')
+MATERIAL_CODE_TYPES = ('ФССЦ', 'ТССЦ')
+
+# Режимы parse_xml_estimate
+PARSE_FULL = 'full'
+PARSE_SUMMARY = 'summary'
+
+
+class WorkRecord:
+    """Данные работы для записи в БД"""
+    __slots__ = ('caption', 'units', 'price', 'clean_code')
+
+    def __init__(self, caption: str, units: str, price: float, clean_code: str):
+        self.caption = caption
+        self.units = units
+        self.price = price
+        self.clean_code = clean_code
+
+
+class MaterialRecord:
+    """Данные материала для записи в БД"""
+    __slots__ = ('name', 'units', 'price', 'clean_code')
+
+    def __init__(self, name: str, units: str, price: float, clean_code: str):
+        self.name = name
+        self.units = units
+        self.price = price
+        self.clean_code = clean_code
+
+
+class ObjectKeys:
+    """
+    Ключи (object_id, object_estimates_id) для строк work и materials. Определяются
+    одним запросом на локальную смету и запоминаются для ее разделов и работ
+    до commit()/rollback() записи.
+    """
+
+    def __init__(self):
+        self.by_estimate: Dict[int, tuple] = {}
+        self.by_section: Dict[int, tuple] = {}
+        self.by_work: Dict[int, tuple] = {}
+
+    def add_section(self, cursor, estimate_id: int, section_id: int):
+        keys = self.by_estimate.get(estimate_id)
+        if keys is None:
+            cursor.execute("""
+                SELECT oe.object_id, oe.id
+                FROM local_estimates le
+                JOIN object_estimates oe ON le.object_estimates_id = oe.id
+                WHERE le.id = %s
+            """, (estimate_id,))
+            keys = cursor.fetchone()
+            if keys is None:
+                raise ValueError(f"Локальная смета {estimate_id} не найдена")
+            self.by_estimate[estimate_id] = keys
+        self.by_section[section_id] = keys
+
+    def section(self, section_id: int) -> tuple:
+        return self.by_section[section_id]
+
+    def add_work(self, section_id: int, work_id: int):
+        self.by_work[work_id] = self.by_section[section_id]
+
+    def work(self, work_id: int) -> tuple:
+        return self.by_work[work_id]
+
+    def clear(self):
+        self.by_estimate.clear()
+        self.by_section.clear()
+        self.by_work.clear()
+
 
 class EstimateDBHandler:
     def __init__(self, db_params):
         self.conn = psycopg2.connect(**db_params)
         self.cur = self.conn.cursor()
+        self.items = ItemDictionary()
+        self.keys = ObjectKeys()
 
     def __del__(self):
         self.cur.close()
@@ -22,36 +99,40 @@ class EstimateDBHandler:
             RETURNING id
         """)
         self.cur.execute(query, (estimate_id, section_name))
-        return self.cur.fetchone()[0]
+        section_id = self.cur.fetchone()[0]
+        self.keys.add_section(self.cur, estimate_id, section_id)
+        return section_id
 
-    def save_work(self, section_id: int, work_data: Dict) -> int:
+    def save_work(self, section_id: int, work: WorkRecord) -> int:
         """Сохраняет работу в таблицу work и возвращает её ID"""
         query = sql.SQL("""
-            INSERT INTO work (local_section_id, name_work, price, measurement_unit, code)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO work (local_section_id, item_id, price, code, object_id, object_estimates_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING id
         """)
         self.cur.execute(query, (
             section_id,
-            work_data['caption'],
-            work_data['price'],
-            work_data['units'],
-            work_data.get('clean_code', '')  # Используем очищенный код без ФЕР/ТЕР
+            self.items.resolve(self.cur, work.clean_code, work.caption, work.units),
+            work.price,
+            work.clean_code,  # Используем очищенный код без ФЕР/ТЕР
+            *self.keys.section(section_id)
         ))
-        return self.cur.fetchone()[0]
+        work_id = self.cur.fetchone()[0]
+        self.keys.add_work(section_id, work_id)
+        return work_id
 
-    def save_material(self, work_id: int, material_data: Dict):
+    def save_material(self, work_id: int, material: MaterialRecord):
         """Сохраняет материал в таблицу materials"""
         query = sql.SQL("""
-            INSERT INTO materials (work_id, name_material, price, measurement_unit, code)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO materials (work_id, item_id, price, code, object_id, object_estimates_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
         """)
         self.cur.execute(query, (
             work_id,
-            material_data['name'],
-            material_data['price'],
-            material_data['units'],
-            material_data.get('clean_code', '')  # Используем очищенный код без ФССЦ/ТССЦ
+            self.items.resolve(self.cur, material.clean_code, material.name, material.units),
+            material.price,
+            material.clean_code,  # Используем очищенный код без ФССЦ/ТССЦ
+            *self.keys.work(work_id)
         ))
 
     def update_local_estimate_price(self, estimate_id: int, total_cost: float):
@@ -63,6 +144,19 @@ class EstimateDBHandler:
         """)
         self.cur.execute(query, (total_cost, estimate_id))
 
+    def flush(self):
+        """Строки пишутся сразу, буфера нет"""
+
+    def commit(self):
+        self.conn.commit()
+        self.items.commit()
+        self.keys.clear()
+
+    def rollback(self):
+        self.conn.rollback()
+        self.items.rollback()
+        self.keys.clear()
+
 
 def clean_work_code(original_code: str) -> str:
     """Очищает код работы от префиксов ФЕР/ТЕР и лишних символов"""
@@ -84,122 +178,204 @@ def clean_material_code(original_code: str) -> str:
     return clean_code.strip()
 
 
-def parse_xml_estimate(xml_file_path: str, db_params: Dict, estimate_id: int) -> Dict:
+def iter_estimate_elements(xml_file_path: str, streaming: bool = True) -> Iterator[ET.Element]:
+    """
+    Перебирает разделы (Chapter) и позиции (Position) сметы в порядке документа.
+
+    В потоковом режиме файл читается через iterparse: раздел отдается по открывающему
+    тегу (атрибуты уже доступны), позиция - по закрывающему, когда прочитан весь её
+    PriceBase. Обработанные поддеревья сразу удаляются из дерева, поэтому расход памяти
+    не зависит от размера файла.
+    :param xml_file_path: путь к XML файлу
+    :param streaming: False - загрузить весь документ через ET.parse (прежний режим)
+    """
+    if not streaming:
+        root = ET.parse(xml_file_path).getroot()
+        for elem in root.iter():
+            if elem.tag in ('Chapter', 'Position'):
+                yield elem
+        return
+
+    stack = []
+    open_positions = 0
+    for event, elem in ET.iterparse(xml_file_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if elem.tag == 'Chapter':
+                yield elem
+            elif elem.tag == 'Position':
+                open_positions += 1
+            continue
+
+        stack.pop()
+        if elem.tag == 'Position':
+            open_positions -= 1
+            yield elem
+
+        # Внутри незакрытой позиции поддерево еще понадобится для поиска PriceBase
+        if open_positions == 0:
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+
+
+def read_estimate_properties(xml_file_path: str) -> Dict:
+    """Возвращает атрибуты <Properties> (LocNum, Description, ...), не читая позиции сметы"""
+    for event, elem in ET.iterparse(xml_file_path, events=('start',)):
+        if elem.tag == 'Properties':
+            return dict(elem.attrib)
+        if elem.tag == 'Chapters':
+            break
+    return {}
+
+
+def find_price_base(position: ET.Element) -> Optional[ET.Element]:
+    """Возвращает PriceBase самой позиции (а не её ресурсов)"""
+    price_base = position.find('PriceBase')
+    if price_base is None:
+        price_base = position.find('.//PriceBase')
+    return price_base
+
+
+def parse_xml_estimate(xml_file_path: str, db_params: Dict, estimate_id: int, streaming: bool = True,
+                       db_handler=None, mode: str = PARSE_FULL, commit: bool = True) -> Dict:
     """
     Парсит XML смету и сохраняет данные в БД
     :param xml_file_path: путь к XML файлу
     :param db_params: параметры подключения к БД
     :param estimate_id: ID локальной сметы в БД
+    :param streaming: потоковый разбор через iterparse (см. iter_estimate_elements)
+    :param db_handler: объект записи в БД (EstimateDBHandler, EstimateBulkWriter);
+                       по умолчанию создается EstimateDBHandler(db_params)
+    :param mode: PARSE_FULL - вернуть полную структуру сметы (разделы, работы, материалы);
+                 PARSE_SUMMARY - только итоги {'total_cost', 'sections', 'works', 'materials'},
+                 структура в памяти не строится
+    :param commit: зафиксировать запись; при False транзакция db_handler остается открытой,
+                   фиксирует (или откатывает) её вызывающий код
     :return: словарь с данными сметы
     """
+    if mode not in (PARSE_FULL, PARSE_SUMMARY):
+        raise ValueError(f"Неизвестный режим разбора: {mode}")
+    full = mode == PARSE_FULL
+
     try:
         # Инициализация подключения к БД
-        db_handler = EstimateDBHandler(db_params)
+        if db_handler is None:
+            db_handler = EstimateDBHandler(db_params)
 
-        # Парсинг XML
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
         result = {}
         total_cost = 0.0
         current_section = None
         current_section_id = None
         current_work_id = None
+        section_works = 0
+        counts = {'sections': 0, 'works': 0, 'materials': 0}
 
-        for elem in root.iter():
+        for elem in iter_estimate_elements(xml_file_path, streaming):
             if elem.tag == 'Chapter' and 'Caption' in elem.attrib:
                 # Обработка раздела
                 section_name = elem.get('Caption')
                 current_section = section_name
                 current_section_id = db_handler.save_section(estimate_id, section_name)
-                result[section_name] = []
+                section_works = 0
+                counts['sections'] += 1
+                if full:
+                    result[section_name] = []
 
             elif elem.tag == 'Position' and 'Caption' in elem.attrib:
                 original_code = elem.get('Code', '')
-                position_data = {
-                    'caption': elem.get('Caption'),
-                    'units': elem.get('Units', ''),
-                    'code': original_code,
-                    'code_type': None
-                }
 
                 # Определяем тип кода (ФЕР/ТЕР/ФССЦ/ТССЦ) только для внутренней обработки
-                if original_code.startswith('ФЕР'):
-                    position_data['code_type'] = 'ФЕР'
-                    position_data['clean_code'] = clean_work_code(original_code)
-                elif original_code.startswith('ТЕР'):
-                    position_data['code_type'] = 'ТЕР'
-                    position_data['clean_code'] = clean_work_code(original_code)
-                elif original_code.startswith('ФССЦ'):
-                    position_data['code_type'] = 'ФССЦ'
-                    position_data['clean_code'] = clean_material_code(original_code)
-                elif original_code.startswith('ТССЦ'):
-                    position_data['code_type'] = 'ТССЦ'
-                    position_data['clean_code'] = clean_material_code(original_code)
+                if original_code.startswith(WORK_CODE_TYPES):
+                    code_type = original_code[:3]
+                elif original_code.startswith(MATERIAL_CODE_TYPES):
+                    code_type = original_code[:4]
+                else:
+                    continue
 
                 # Обработка работ (ФЕР или ТЕР)
-                if position_data['code_type'] in ('ФЕР', 'ТЕР'):
-                    price_base = elem.find('.//PriceBase')
+                if code_type in WORK_CODE_TYPES:
+                    price_base = find_price_base(elem)
+                    price = None
                     if price_base is not None:
                         price = sum(
                             float(price_base.get(attr, '0').replace(',', '.'))
                             for attr in ['PZ', 'OZ', 'EM', 'ZM', 'MT']
                         )
-                        position_data['price'] = price
                         total_cost += price
 
                     if current_section and current_section_id:
-                        position_data['materials'] = []
-                        result[current_section].append(position_data)
-
-                        # Создаем копию данных для сохранения в БД
-                        work_db_data = {
-                            'caption': position_data['caption'],
-                            'price': position_data['price'],
-                            'units': position_data['units'],
-                            'clean_code': position_data['clean_code']  # Очищенный код
-                        }
-                        current_work_id = db_handler.save_work(current_section_id, work_db_data)
+                        if price is None:
+                            raise Exception(f"у работы {original_code} нет цены (PriceBase)")
+
+                        work = WorkRecord(elem.get('Caption'), elem.get('Units', ''), price,
+                                          clean_work_code(original_code))  # Очищенный код
+                        current_work_id = db_handler.save_work(current_section_id, work)
+                        section_works += 1
+                        counts['works'] += 1
+
+                        if full:
+                            result[current_section].append({
+                                'caption': work.caption,
+                                'units': work.units,
+                                'code': original_code,
+                                'code_type': code_type,
+                                'clean_code': work.clean_code,
+                                'price': price,
+                                'materials': []
+                            })
 
                 # Обработка материалов (ФССЦ или ТССЦ)
-                elif position_data['code_type'] in ('ФССЦ', 'ТССЦ') and current_work_id:
-                    price_base = elem.find('.//PriceBase')
+                elif current_work_id:
+                    if not section_works:
+                        raise Exception(f"материал {original_code} в разделе «{current_section}» "
+                                        f"указан раньше первой работы")
+
+                    price_base = find_price_base(elem)
                     material_price = 0.0
                     if price_base is not None:
                         material_price = float(price_base.get('PZ', '0').replace(',', '.'))
                         total_cost += material_price
 
-                    material = {
-                        'name': position_data['caption'],
-                        'units': position_data['units'],
-                        'price': material_price,
-                        'clean_code': position_data['clean_code']  # Очищенный код
-                    }
+                    material = MaterialRecord(elem.get('Caption'), elem.get('Units', ''), material_price,
+                                              clean_material_code(original_code))  # Очищенный код
 
                     # Добавляем материал в текущую работу
-                    if 'materials' in result[current_section][-1]:
-                        result[current_section][-1]['materials'].append(material)
+                    if full:
+                        result[current_section][-1]['materials'].append({
+                            'name': material.name,
+                            'units': material.units,
+                            'price': material.price,
+                            'clean_code': material.clean_code
+                        })
 
                     # Сохраняем материал в БД
                     db_handler.save_material(current_work_id, material)
+                    counts['materials'] += 1
 
         # Обновляем общую стоимость
+        db_handler.flush()
         db_handler.update_local_estimate_price(estimate_id, total_cost)
-        db_handler.conn.commit()
+        if commit:
+            db_handler.commit()
+
+        if not full:
+            return {'total_cost': round(total_cost, 2), **counts}
 
         result['total_cost'] = round(total_cost, 2)
         return result
 
     except ET.ParseError as e:
-        if 'db_handler' in locals():
-            db_handler.conn.rollback()
+        if db_handler is not None:
+            db_handler.rollback()
         raise Exception(f"Ошибка парсинга XML: {e}")
     except psycopg2.Error as e:
-        if 'db_handler' in locals():
-            db_handler.conn.rollback()
+        if db_handler is not None:
+            db_handler.rollback()
         raise Exception(f"Ошибка базы данных: {e}")
     except Exception as e:
-        if 'db_handler' in locals():
-            db_handler.conn.rollback()
+        if db_handler is not None:
+            db_handler.rollback()
         raise Exception(f"Произошла ошибка: {e}")
 
 
@@ -0,0 +1,208 @@
+import csv
+import io
+import psycopg2
+from typing import Dict, List
+
+from parsing.local.processing_of_local_estimates_xml import MaterialRecord, WorkRecord
+
+# Проверки строк пакета перед переносом: (описание, запрос количества нарушений)
+STAGING_CHECKS = [
+    ("разделы несуществующих локальных смет", """
+        SELECT COUNT(*) FROM staging_sections s
+        LEFT JOIN local_estimates le ON le.id = s.estimate_id
+        WHERE s.batch_id = %(batch_id)s AND le.id IS NULL
+    """),
+    ("разделы без названия", """
+        SELECT COUNT(*) FROM staging_sections
+        WHERE batch_id = %(batch_id)s AND name_section IS NULL
+    """),
+    ("работы без раздела в пакете", """
+        SELECT COUNT(*) FROM staging_work w
+        LEFT JOIN staging_sections s ON s.batch_id = w.batch_id AND s.section_no = w.section_no
+        WHERE w.batch_id = %(batch_id)s AND s.section_no IS NULL
+    """),
+    ("материалы без работы в пакете", """
+        SELECT COUNT(*) FROM staging_materials m
+        LEFT JOIN staging_work w ON w.batch_id = m.batch_id AND w.work_no = m.work_no
+        WHERE m.batch_id = %(batch_id)s AND w.work_no IS NULL
+    """),
+    ("позиции без кода, наименования, единицы измерения или цены", """
+        SELECT COUNT(*) FROM (
+            SELECT code, name, measurement_unit, price FROM staging_work WHERE batch_id = %(batch_id)s
+            UNION ALL
+            SELECT code, name, measurement_unit, price FROM staging_materials WHERE batch_id = %(batch_id)s
+        ) p
+        WHERE code IS NULL OR code = '' OR name IS NULL OR measurement_unit IS NULL OR price IS NULL
+    """),
+]
+
+# Позиции пакета: работы и материалы вместе
+BATCH_ITEMS = """
+    SELECT code, name, measurement_unit FROM staging_work WHERE batch_id = %(batch_id)s
+    UNION
+    SELECT code, name, measurement_unit FROM staging_materials WHERE batch_id = %(batch_id)s
+"""
+
+# Перенос пакета в рабочие таблицы. Родительские ключи, позиции справочника и ключи
+# объекта находятся соединениями; строки вставляются в порядке документа
+MERGE_STATEMENTS = [
+    ('estimate_codes', f"""
+        INSERT INTO estimate_codes (code)
+        SELECT DISTINCT code FROM ({BATCH_ITEMS}) k
+        ON CONFLICT (code) DO NOTHING
+    """),
+    ('estimate_items', f"""
+        INSERT INTO estimate_items (code_id, name, measurement_unit)
+        SELECT c.id, k.name, k.measurement_unit
+        FROM ({BATCH_ITEMS}) k
+        JOIN estimate_codes c ON c.code = k.code
+        ON CONFLICT DO NOTHING
+    """),
+    ('sections', """
+        INSERT INTO sections (id, estimate_id, name_section)
+        SELECT section_id, estimate_id, name_section
+        FROM staging_sections
+        WHERE batch_id = %(batch_id)s
+        ORDER BY section_no
+    """),
+    ('work', """
+        INSERT INTO work (id, local_section_id, item_id, price, code, object_id, object_estimates_id)
+        SELECT w.work_id, s.section_id, i.id, w.price, w.code, oe.object_id, oe.id
+        FROM staging_work w
+        JOIN staging_sections s ON s.batch_id = w.batch_id AND s.section_no = w.section_no
+        JOIN local_estimates le ON le.id = s.estimate_id
+        JOIN object_estimates oe ON oe.id = le.object_estimates_id
+        JOIN estimate_codes c ON c.code = w.code
+        JOIN estimate_items i
+            ON i.code_id = c.id AND i.measurement_unit = w.measurement_unit AND md5(i.name) = md5(w.name)
+        WHERE w.batch_id = %(batch_id)s
+        ORDER BY w.work_no
+    """),
+    ('materials', """
+        INSERT INTO materials (work_id, item_id, price, code, object_id, object_estimates_id)
+        SELECT w.work_id, i.id, m.price, m.code, oe.object_id, oe.id
+        FROM staging_materials m
+        JOIN staging_work w ON w.batch_id = m.batch_id AND w.work_no = m.work_no
+        JOIN staging_sections s ON s.batch_id = w.batch_id AND s.section_no = w.section_no
+        JOIN local_estimates le ON le.id = s.estimate_id
+        JOIN object_estimates oe ON oe.id = le.object_estimates_id
+        JOIN estimate_codes c ON c.code = m.code
+        JOIN estimate_items i
+            ON i.code_id = c.id AND i.measurement_unit = m.measurement_unit AND md5(i.name) = md5(m.name)
+        WHERE m.batch_id = %(batch_id)s
+        ORDER BY m.material_no
+    """),
+]
+
+
+class EstimateStagingWriter:
+    """
+    Запись локальных смет через промежуточные таблицы для пакетной загрузки.
+
+    Интерфейс совпадает с EstimateBulkWriter. Строки копятся в памяти и при flush()
+    одним пакетом (batch_id) пишутся COPY в UNLOGGED таблицы staging_*, там
+    проверяются и переносятся в sections, work и materials несколькими
+    INSERT ... SELECT. Разделы и работы до переноса нумеруются внутри пакета,
+    поэтому ID не резервируются заранее, а справочник позиций и ключи объекта
+    не запрашиваются построчно. Рабочие таблицы изменяются только на шаге переноса,
+    ошибочный пакет в них не попадает.
+    """
+
+    def __init__(self, db_params: Dict = None, conn=None):
+        self.owns_conn = conn is None
+        self.conn = conn if conn is not None else psycopg2.connect(**db_params)
+        self.cur = self.conn.cursor()
+        self.sections: List[tuple] = []
+        self.works: List[tuple] = []
+        self.materials: List[tuple] = []
+
+    def __del__(self):
+        if getattr(self, 'owns_conn', False):
+            self.cur.close()
+            self.conn.close()
+
+    def save_section(self, estimate_id: int, section_name: str) -> int:
+        """Добавляет раздел в пакет и возвращает его номер в пакете"""
+        self.sections.append((len(self.sections) + 1, estimate_id, section_name))
+        return len(self.sections)
+
+    def save_work(self, section_no: int, work: WorkRecord) -> int:
+        """Добавляет работу в пакет и возвращает ее номер в пакете"""
+        self.works.append((len(self.works) + 1, section_no, work.clean_code, work.caption, work.units, work.price))
+        return len(self.works)
+
+    def save_material(self, work_no: int, material: MaterialRecord):
+        """Добавляет материал в пакет"""
+        self.materials.append((len(self.materials) + 1, work_no, material.clean_code, material.name,
+                               material.units, material.price))
+
+    def update_local_estimate_price(self, estimate_id: int, total_cost: float):
+        """Обновляет общую стоимость в local_estimates"""
+        self.cur.execute(
+            "UPDATE local_estimates SET local_estimates_price = %s WHERE id = %s",
+            (total_cost, estimate_id)
+        )
+
+    def _copy(self, table: str, columns: str, batch_id: int, rows: List[tuple], options: str = ""):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        # Строки всегда в кавычках: пустое значение без кавычек COPY считает NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n').writerows(
+            (batch_id, *row) for row in rows
+        )
+        buffer.seek(0)
+        self.cur.copy_expert(f"COPY {table} (batch_id, {columns}) FROM STDIN WITH (FORMAT csv{options})", buffer)
+
+    def _validate(self, batch_id: int):
+        """Проверяет строки пакета, при нарушениях - ValueError с их перечнем"""
+        self.cur.execute("SELECT " + ", ".join(f"({query})" for _, query in STAGING_CHECKS),
+                         {'batch_id': batch_id})
+        problems = [f"{description}: {count}"
+                    for (description, _), count in zip(STAGING_CHECKS, self.cur.fetchone()) if count]
+        if problems:
+            raise ValueError("Пакет загрузки не прошел проверку: " + "; ".join(problems))
+
+    def _merge(self, batch_id: int):
+        """Переносит пакет в рабочие таблицы; число строк должно совпасть с пакетом"""
+        expected = {'sections': len(self.sections), 'work': len(self.works), 'materials': len(self.materials)}
+        for table, statement in MERGE_STATEMENTS:
+            self.cur.execute(statement, {'batch_id': batch_id})
+            if table in expected and self.cur.rowcount != expected[table]:
+                raise ValueError(f"{table}: перенесено {self.cur.rowcount} строк из {expected[table]}")
+
+    def flush(self):
+        """Записывает накопленные строки одним пакетом и очищает его из промежуточных таблиц"""
+        if not self.sections and not self.works and not self.materials:
+            return
+        self.cur.execute("SELECT nextval('staging_batch_id_seq')")
+        batch_id = self.cur.fetchone()[0]
+
+        self._copy('staging_sections', 'section_no, estimate_id, name_section', batch_id, self.sections)
+        # Отсутствующая цена (None пишется как "") - NULL, её найдет проверка пакета
+        self._copy('staging_work', 'work_no, section_no, code, name, measurement_unit, price',
+                   batch_id, self.works, ", FORCE_NULL (price)")
+        self._copy('staging_materials', 'material_no, work_no, code, name, measurement_unit, price',
+                   batch_id, self.materials, ", FORCE_NULL (price)")
+        # Статистика промежуточных таблиц обновляется под пакет: автоанализ застает их
+        # пустыми, и с такой оценкой планировщик выбирает вложенные циклы по всему пакету
+        self.cur.execute("ANALYZE staging_sections, staging_work, staging_materials")
+        self._validate(batch_id)
+        self._merge(batch_id)
+        for table in ('staging_materials', 'staging_work', 'staging_sections'):
+            self.cur.execute(f"DELETE FROM {table} WHERE batch_id = %s", (batch_id,))
+        self._clear()
+
+    def _clear(self):
+        self.sections.clear()
+        self.works.clear()
+        self.materials.clear()
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+
+    def rollback(self):
+        # Строки пакета в промежуточных таблицах откатываются вместе с транзакцией
+        self._clear()
+        self.conn.rollback()
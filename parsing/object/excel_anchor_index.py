@@ -0,0 +1,66 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class ExcelAnchorIndex:
+    """
+    Поиск опорных строк ("(объектная смета)", "Сметная стоимость" и т.п.) на листе Excel.
+
+    Лист один раз переводится в плоский столбец строк (построчно, как при обходе
+    for row / for col), поиск фразы - одна маска pandas по нужной части листа
+    вместо обращения к каждой ячейке через df.iat. Найденные позиции запоминаются,
+    поэтому повторный поиск той же фразы бесплатный.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.n_rows, self.n_cols = df.shape
+        values = pd.Series(df.to_numpy(dtype=object).ravel())
+        # Пустая ячейка - пустая строка (как str(...) if pd.notna(...) else "" в парсерах)
+        self.text = values.where(values.notna(), '').astype(str)
+        self._found: Dict[tuple, List[Tuple[int, int]]] = {}
+
+    def find_all(self, phrase: str, exact: bool = False, upper: bool = False,
+                 max_rows: Optional[int] = None, col: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Ячейки (строка, столбец) с фразой в порядке обхода листа
+        :param exact: ячейка должна совпадать с фразой целиком, иначе - содержать её
+        :param upper: сравнивать с текстом ячейки в верхнем регистре
+        :param max_rows: искать только в первых max_rows строках
+        :param col: искать только в этом столбце
+        """
+        key = (phrase, exact, upper, max_rows, col)
+        found = self._found.get(key)
+        if found is None:
+            found = self._search(phrase, exact, upper, max_rows, col)
+            self._found[key] = found
+        return found
+
+    def _search(self, phrase, exact, upper, max_rows, col) -> List[Tuple[int, int]]:
+        if not self.n_cols:
+            return []
+        # Маска строится только по той части листа, где нужен поиск
+        stop = len(self.text) if max_rows is None else min(max_rows, self.n_rows) * self.n_cols
+        if col is None:
+            start, step = 0, 1
+        else:
+            start, step = col, self.n_cols
+        text = self.text.iloc[start:stop:step]
+        if upper:
+            text = text.str.upper()
+        mask = text == phrase if exact else text.str.contains(phrase, regex=False)
+        positions = start + np.flatnonzero(mask.to_numpy()) * step
+        rows, cols = np.divmod(positions, self.n_cols)
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    def find_first(self, phrase: str, exact: bool = False, upper: bool = False,
+                   max_rows: Optional[int] = None, col: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """Первая ячейка с фразой или None"""
+        found = self.find_all(phrase, exact, upper, max_rows, col)
+        return found[0] if found else None
+
+    def cell_text(self, row: int, col: int) -> str:
+        """Текст ячейки (пустая строка для пустой ячейки)"""
+        return self.text.iat[row * self.n_cols + col]
@@ -0,0 +1,120 @@
+import math
+from typing import Callable, Iterator, List, Optional
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from models.file_type_by_signature import identify_file_type
+
+# Условие остановки: (номер строки, значения строки) -> True, если дальше читать не нужно
+StopCondition = Callable[[int, list], bool]
+
+
+def _iter_xlsx_rows(file_path) -> Iterator[list]:
+    """Строки первого листа XLSX в режиме read-only (ячейки без стилей, по одной строке)"""
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        for row in sheet.rows:
+            values = []
+            for cell in row:
+                # Те же преобразования, что у pd.read_excel
+                if cell.value is None:
+                    values.append("")
+                elif cell.data_type == TYPE_ERROR:
+                    values.append(float('nan'))
+                elif cell.data_type == TYPE_NUMERIC:
+                    integer = int(cell.value)
+                    values.append(integer if integer == cell.value else float(cell.value))
+                else:
+                    values.append(cell.value)
+            yield values
+    finally:
+        workbook.close()
+
+
+def _iter_xls_rows(file_path) -> Iterator[list]:
+    """Строки первого листа XLS (книга открывается on_demand, остальные листы не загружаются)"""
+    import xlrd
+    from xlrd import XL_CELL_BOOLEAN, XL_CELL_DATE, XL_CELL_ERROR, XL_CELL_NUMBER
+
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    epoch_day = (1904, 1, 1) if workbook.datemode else (1899, 12, 31)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for row_no in range(sheet.nrows):
+            values = []
+            for value, cell_type in zip(sheet.row_values(row_no), sheet.row_types(row_no)):
+                # Те же преобразования, что у pd.read_excel
+                if cell_type == XL_CELL_DATE:
+                    try:
+                        value = xlrd.xldate.xldate_as_datetime(value, workbook.datemode)
+                    except OverflowError:
+                        pass
+                    else:
+                        # Дата, совпадающая с началом эпохи Excel, - это только время
+                        if value.timetuple()[0:3] == epoch_day:
+                            value = value.time()
+                elif cell_type == XL_CELL_ERROR:
+                    value = float('nan')
+                elif cell_type == XL_CELL_BOOLEAN:
+                    value = bool(value)
+                elif cell_type == XL_CELL_NUMBER and math.isfinite(value) and int(value) == value:
+                    value = int(value)
+                values.append(value)
+            yield values
+    finally:
+        workbook.release_resources()
+
+
+def iter_sheet_rows(file_path) -> Iterator[list]:
+    """Перебирает строки первого листа Excel (формат - по сигнатуре файла)"""
+    file_type = identify_file_type(file_path)
+    if file_type == "XLSX":
+        return _iter_xlsx_rows(file_path)
+    if file_type == "XLS":
+        return _iter_xls_rows(file_path)
+    raise ValueError(f"Файл не является книгой Excel: {file_type}")
+
+
+def read_sheet_until(file_path, stop: Optional[StopCondition] = None) -> pd.DataFrame:
+    """
+    Читает первый лист Excel построчно, пока stop не вернет True (или до конца листа).
+
+    Результат совпадает с первыми строками pd.read_excel(file_path, sheet_name=0, header=None):
+    пустые ячейки - NaN, целые числа - int.
+    """
+    data: List[list] = []
+    last_row_with_data = -1
+    rows = iter_sheet_rows(file_path)
+    try:
+        for row_no, values in enumerate(rows):
+            while values and values[-1] == "":
+                values.pop()
+            if values:
+                last_row_with_data = row_no
+            data.append(values)
+            if stop is not None and stop(row_no, values):
+                break
+    finally:
+        rows.close()  # книга закрывается сразу, не дожидаясь сборщика мусора
+
+    data = data[:last_row_with_data + 1]
+    if not data:
+        return pd.DataFrame()
+
+    width = max(len(values) for values in data)
+    data = [values + [""] * (width - len(values)) for values in data]
+    return TextParser(data, header=None, skip_blank_lines=False).read()
+
+
+def cell_is_empty(values: list, col: int) -> bool:
+    """Пустая ли ячейка строки, прочитанной iter_sheet_rows"""
+    if col >= len(values):
+        return True
+    value = values[col]
+    return value == "" or value is None or (isinstance(value, float) and math.isnan(value))
@@ -0,0 +1,31 @@
+from typing import List
+
+from psycopg2.extras import execute_values
+
+
+def save_object_estimate(conn, object_id: int, estimate_name: str, total_cost: float,
+                         local_estimates: List[str]) -> int:
+    """
+    Записывает объектную смету и её локальные сметы в текущей транзакции conn (без commit).
+
+    Локальные сметы вставляются одним запросом на весь список, а не по строке.
+    :return: ID созданной объектной сметы
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO object_estimates
+               (object_id, name_object_estimate, object_estimates_price)
+               VALUES (%s, %s, %s) RETURNING id""",
+            (object_id, estimate_name, total_cost)
+        )
+        estimate_id = cursor.fetchone()[0]
+
+        if local_estimates:
+            execute_values(
+                cursor,
+                "INSERT INTO local_estimates (object_estimates_id, name_local_estimate) VALUES %s",
+                [(estimate_id, name) for name in local_estimates],
+                page_size=1000
+            )
+
+    return estimate_id
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from models.file_type_by_signature import identify_file_type
+from parsing.object.processing_of_object_estimates_xml import is_object_estimate_xml
+
+# Форматы объектной сметы (локальные сметы в пакете - только XML)
+OBJECT_FILE_TYPES = ("XLSX", "XLS", "GGE")
+
+
+def member_name(info: zipfile.ZipInfo) -> str:
+    """
+    Имя файла в архиве. Архиваторы Windows без флага UTF-8 пишут имена в cp866,
+    а zipfile читает их как cp437 - кириллицу нужно перекодировать
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('cp866')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def extract_zip(archive_path, target_dir: str):
+    """Распаковывает архив в target_dir (файлы с путями за пределами папки пропускаются)"""
+    target_dir = os.path.abspath(target_dir)
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            path = os.path.abspath(os.path.join(target_dir, member_name(info)))
+            if os.path.commonpath([target_dir, path]) != target_dir:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.open(info) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+
+
+@contextmanager
+def open_package(package_path) -> Iterator[str]:
+    """
+    Папка с файлами пакета: сама папка или временная папка с распакованным ZIP
+    (удаляется при выходе из блока)
+    """
+    if os.path.isdir(package_path):
+        yield package_path
+        return
+
+    if not zipfile.is_zipfile(package_path):
+        raise ValueError("Пакет должен быть папкой или ZIP архивом")
+    # XLSX - тоже ZIP: отличаем по содержимому
+    with zipfile.ZipFile(package_path) as archive:
+        if '[Content_Types].xml' in archive.namelist():
+            raise ValueError("Пакет должен быть папкой или ZIP архивом, а не книгой Excel")
+
+    with tempfile.TemporaryDirectory(prefix='smeta_package_') as folder:
+        extract_zip(package_path, folder)
+        yield folder
+
+
+def classify_package_files(folder: str) -> Dict:
+    """
+    Разбирает файлы пакета (включая вложенные папки) по видам
+    :return: словарь object_file (путь к объектной смете), local_files (XML локальных
+             смет) и ignored (файлы неизвестного формата)
+    :raises ValueError: если объектная смета не найдена или их несколько
+    """
+    object_files: List[str] = []
+    local_files: List[str] = []
+    ignored: List[str] = []
+
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            file_type = identify_file_type(path)
+            if file_type in OBJECT_FILE_TYPES:
+                object_files.append(path)
+            elif file_type == "XML":
+                try:
+                    is_object = is_object_estimate_xml(path)
+                except Exception:
+                    ignored.append(path)
+                    continue
+                (object_files if is_object else local_files).append(path)
+            else:
+                ignored.append(path)
+
+    if not object_files:
+        raise ValueError("В пакете не найдена объектная смета")
+    if len(object_files) > 1:
+        raise ValueError("В пакете несколько объектных смет: " +
+                         ", ".join(os.path.basename(path) for path in object_files))
+
+    return {
+        'object_file': object_files[0],
+        'local_files': local_files,
+        'ignored': ignored
+    }
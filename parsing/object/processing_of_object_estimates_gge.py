@@ -1,93 +1,87 @@
 import os
 import xml.etree.ElementTree as ET
-import psycopg2
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from config import DB_CONFIG
+from models.db_pool import connection
+from parsing.object.object_estimate_writer import save_object_estimate
 
 
-def connect_to_db(
-        dbname: str = None,
-        user: str = None,
-        password: str = None,
-        host: str = None,
-        port: str = None,
-        **kwargs
-) -> Optional[psycopg2.extensions.connection]:
-    """
-    Подключается к PostgreSQL с возможностью переопределения параметров
-
-    Args:
-        dbname: Название БД (переопределяет DB_CONFIG['dbname'])
-        user: Пользователь (переопределяет DB_CONFIG['user'])
-        password: Пароль (переопределяет DB_CONFIG['password'])
-        host: Хост (переопределяет DB_CONFIG['host'])
-        port: Порт (переопределяет DB_CONFIG['port'])
-        **kwargs: Дополнительные параметры для psycopg2.connect()
-
-    Returns:
-        Connection object или None при ошибке
-    """
-    # Копируем базовую конфигурацию, чтобы не менять оригинал
-    connection_params = DB_CONFIG.copy()
-
-    # Переопределяем только те параметры, которые переданы
-    if dbname is not None:
-        connection_params['dbname'] = dbname
-    if user is not None:
-        connection_params['user'] = user
-    if password is not None:
-        connection_params['password'] = password
-    if host is not None:
-        connection_params['host'] = host
-    if port is not None:
-        connection_params['port'] = port
-
-    # Добавляем дополнительные параметры (если есть)
-    connection_params.update(kwargs)
+# Результат чтения GGE: (найден ли Object/Summary, текст его Total, названия локальных смет)
+GgeContent = Tuple[bool, Optional[str], List[str]]
 
-    try:
-        conn = psycopg2.connect(**connection_params)
-        print("Успешное подключение к БД")
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к PostgreSQL: {e}")
-        return None
 
-def parse_gge_file(file_path: Union[str, bytes, os.PathLike]) -> Optional[Dict[str, Union[str, float, List[str]]]]:
-    """Основная функция парсинга GGE файла"""
+def local_estimate_name(estimate: ET.Element) -> Optional[str]:
+    """Название локальной сметы: обоснование (Reason) и наименование (Name)"""
+    reason = estimate.find("Reason")
+    name = estimate.find("Name")
+    if reason is not None and name is not None and reason.text and name.text:
+        return f"{reason.text.strip()} {name.text.strip()}"
+    return None
+
+
+def read_gge_tree(file_path) -> GgeContent:
+    """Прежний режим: весь документ загружается через ET.parse"""
+    root = ET.parse(file_path).getroot()
+
+    summary = root.find(".//Object/Summary")
+    total_element = summary.find("Total") if summary is not None else None
+    total_text = total_element.text if total_element is not None else None
+
+    local_estimates = [name for name in map(local_estimate_name, root.findall(".//LocalEstimate")) if name]
+    return summary is not None, total_text, local_estimates
+
+
+def read_gge_streaming(file_path) -> GgeContent:
+    """
+    Один проход iterparse по документу (только закрывающие теги).
+
+    Каждая LocalEstimate разбирается, как только закрыта, и сразу очищается - они
+    и составляют основной объем файла. Summary берется из закрытого Object, после
+    чего чтение прекращается (по схеме ObjectEstimate объект в документе один),
+    поэтому хвост файла после объекта не читается.
+    """
+    local_estimates = []
+    for event, elem in ET.iterparse(file_path, events=('end',)):
+        if elem.tag == 'LocalEstimate':
+            name = local_estimate_name(elem)
+            if name:
+                local_estimates.append(name)
+            elem.clear()
+        elif elem.tag == 'Object':
+            summary = elem.find("Summary")
+            if summary is not None:
+                total_element = summary.find("Total")
+                return True, total_element.text if total_element is not None else None, local_estimates
+
+    return False, None, local_estimates
+
+
+def parse_gge_file(file_path: Union[str, bytes, os.PathLike],
+                   streaming: bool = True) -> Optional[Dict[str, Union[str, float, List[str]]]]:
+    """
+    Основная функция парсинга GGE файла
+    :param streaming: False - загрузить весь документ через ET.parse (прежний режим)
+    """
     try:
         # Извлекаем название сметы из имени файла (без расширения .gge)
         estimate_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        # Парсим XML файл
-        tree = ET.parse(file_path)
-        root = tree.getroot()
+        summary_found, total_text, local_estimates = (
+            read_gge_streaming(file_path) if streaming else read_gge_tree(file_path)
+        )
 
-        # Извлекаем общую стоимость из тега <Total> внутри <Summary>
-        summary = root.find(".//Object/Summary")
-        if summary is None:
+        # Общая стоимость - из тега <Total> внутри <Summary> объекта
+        if not summary_found:
             raise ValueError("Не найден раздел с общей стоимостью (Summary)")
 
-        total_element = summary.find("Total")
-        if total_element is None or not total_element.text:
+        if not total_text:
             raise ValueError("Не удалось извлечь общую стоимость сметы")
 
         try:
-            total_cost = float(total_element.text)
+            total_cost = float(total_text)
         except ValueError:
             raise ValueError("Некорректный формат общей стоимости")
 
-        # Извлекаем локальные сметы
-        local_estimates = []
-        for estimate in root.findall(".//LocalEstimate"):
-            reason = estimate.find("Reason")
-            name = estimate.find("Name")
-
-            if reason is not None and name is not None and reason.text and name.text:
-                local_estimate_name = f"{reason.text.strip()} {name.text.strip()}"
-                local_estimates.append(local_estimate_name)
-
         return {
             "estimate_name": estimate_name,
             "total_cost": total_cost,
@@ -102,76 +96,37 @@ def parse_gge_file(file_path: Union[str, bytes, os.PathLike]) -> Optional[Dict[s
         return None
 
 
-def save_to_database(object_id: int, estimate_name: str, cost_value: float,
-                     local_estimates: List[str]) -> bool:
-    """Сохранение данных в базу данных"""
-    conn = connect_to_db()
-    if not conn:
-        return False
-
-    try:
-        # Вставка объектной сметы
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """INSERT INTO object_estimates 
-                   (object_id, name_object_estimate, object_estimates_price) 
-                   VALUES (%s, %s, %s) RETURNING id""",
-                (object_id, estimate_name, cost_value)
-            )
-            estimate_id = cursor.fetchone()[0]
-
-        # Вставка локальных смет
-        with conn.cursor() as cursor:
-            for estimate in local_estimates:
-                cursor.execute(
-                    """INSERT INTO local_estimates 
-                       (object_estimates_id, name_local_estimate) 
-                       VALUES (%s, %s)""",
-                    (estimate_id, estimate)
-                )
-
-        conn.commit()
-        return True
+def parse_object_estimate(file_path: Union[str, bytes, os.PathLike]) -> Dict[str, Union[str, float, List[str]]]:
+    """
+    Разбирает объектную смету из GGE без обращения к БД
+    :return: словарь с ключами estimate_name, total_cost, local_estimates
+    """
+    if not isinstance(file_path, (str, bytes, os.PathLike)):
+        raise TypeError("Некорректный тип пути к файлу")
 
-    except Exception as e:
-        print(f"Ошибка при сохранении в базу данных: {e}")
-        conn.rollback()
-        return False
-    finally:
-        if conn:
-            conn.close()
+    file_path = os.path.abspath(os.path.normpath(file_path))
 
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Файл не существует: {file_path}")
 
-def parse_and_save_smeta(file_path: Union[str, bytes, os.PathLike], object_id: int) -> bool:
-    """Парсит объектную смету из GGE и сохраняет в базу данных"""
-    try:
-        # Проверка входных параметров
-        if not isinstance(file_path, (str, bytes, os.PathLike)):
-            raise TypeError("Некорректный тип пути к файлу")
+    if not file_path.lower().endswith('.gge'):
+        raise ValueError("Файл должен иметь расширение .gge")
 
-        file_path = os.path.abspath(os.path.normpath(file_path))
+    result = parse_gge_file(file_path)
+    if not result:
+        raise ValueError("Не удалось обработать GGE файл")
+    return result
 
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"Файл не существует: {file_path}")
 
-        if not file_path.lower().endswith('.gge'):
-            raise ValueError("Файл должен иметь расширение .gge")
-
-        # Парсинг GGE файла
-        result = parse_gge_file(file_path)
-        if not result:
-            raise ValueError("Не удалось обработать GGE файл")
-
-        # Сохранение в базу данных
-        if not save_to_database(
-                object_id,
-                result["estimate_name"],
-                result["total_cost"],
-                result["local_estimates"]
-        ):
-            raise Exception("Ошибка при сохранении в базу данных")
-
-        return True
+def parse_and_save_smeta(file_path: Union[str, bytes, os.PathLike], object_id: int, conn=None) -> int:
+    """
+    Парсит объектную смету из GGE и сохраняет в базу данных.
+    Если conn передан, запись идет в его транзакции (commit делает вызывающий код)
+    """
+    try:
+        result = parse_object_estimate(file_path)
+        with connection(conn) as db_conn:
+            return save_object_estimate(db_conn, object_id, **result)
 
     except Exception as e:
         print(f"Ошибка при обработке файла {file_path}: {str(e)}")
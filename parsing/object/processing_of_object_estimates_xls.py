@@ -1,150 +1,128 @@
 import pandas as pd
 import re
-import psycopg2
-from typing import Optional
-from config import DB_CONFIG
-
-
-def connect_to_db(
-        dbname: str = None,
-        user: str = None,
-        password: str = None,
-        host: str = None,
-        port: str = None,
-        **kwargs
-) -> Optional[psycopg2.extensions.connection]:
+
+from models.db_pool import connection
+from parsing.object.excel_anchor_index import ExcelAnchorIndex
+from parsing.object.excel_reader import cell_is_empty, read_sheet_until
+from parsing.object.object_estimate_writer import save_object_estimate
+
+
+# Заголовок сметы (название и стоимость) ищется в первых строках листа
+HEADER_ROWS = 50
+
+# Подписи раздела локальных смет в порядке приоритета
+LOCAL_ESTIMATE_PHRASES = [
+    "Локальные сметы (расчеты)",
+    "ЛОКАЛЬНЫЕ СМЕТЫ",
+    "Локальные сметные расчеты",
+    "Локальные сметы"
+]
+
+
+class ObjectEstimateScan:
     """
-    Подключается к PostgreSQL с возможностью переопределения параметров
-
-    Args:
-        dbname: Название БД (переопределяет DB_CONFIG['dbname'])
-        user: Пользователь (переопределяет DB_CONFIG['user'])
-        password: Пароль (переопределяет DB_CONFIG['password'])
-        host: Хост (переопределяет DB_CONFIG['host'])
-        port: Порт (переопределяет DB_CONFIG['port'])
-        **kwargs: Дополнительные параметры для psycopg2.connect()
-
-    Returns:
-        Connection object или None при ошибке
+    Условие остановки чтения листа: прочитаны строки заголовка и закончилась
+    таблица локальных смет. Остановка возможна только по основной подписи раздела:
+    для остальных подписей extract_local_estimates может выбрать строку ниже,
+    поэтому лист дочитывается до конца.
     """
-    # Копируем базовую конфигурацию, чтобы не менять оригинал
-    connection_params = DB_CONFIG.copy()
-
-    # Переопределяем только те параметры, которые переданы
-    if dbname is not None:
-        connection_params['dbname'] = dbname
-    if user is not None:
-        connection_params['user'] = user
-    if password is not None:
-        connection_params['password'] = password
-    if host is not None:
-        connection_params['host'] = host
-    if port is not None:
-        connection_params['port'] = port
-
-    # Добавляем дополнительные параметры (если есть)
-    connection_params.update(kwargs)
 
-    try:
-        conn = psycopg2.connect(**connection_params)
-        print("Успешное подключение к БД")
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к PostgreSQL: {e}")
-        return None
+    def __init__(self):
+        self.table_row = None
+        self.has_estimates = False
+        self.table_ended = False
+
+    def __call__(self, row_no: int, values: list) -> bool:
+        if self.table_row is None:
+            if values and LOCAL_ESTIMATE_PHRASES[0] in str(values[0]):
+                self.table_row = row_no
+        elif not self.table_ended:
+            # Те же условия конца таблицы, что в extract_local_estimates
+            if not cell_is_empty(values, 1) and not cell_is_empty(values, 2):
+                name = f"{values[1]} {values[2]}".strip()
+                self.has_estimates = self.has_estimates or (name and name not in LOCAL_ESTIMATE_PHRASES)
+            elif self.has_estimates:
+                self.table_ended = True
+            if row_no >= self.table_row + 99:
+                self.table_ended = True
+        return self.table_ended and row_no + 1 >= HEADER_ROWS
 
 
 def parse_excel_file(file_path):
-    """Чтение Excel файла (XLS или XLSX)"""
+    """Чтение Excel файла (XLS или XLSX) до конца таблицы локальных смет"""
     try:
-        if file_path.lower().endswith('.xlsx'):
-            engine = 'openpyxl'
-        elif file_path.lower().endswith('.xls'):
-            engine = 'xlrd'
-        else:
+        if not file_path.lower().endswith(('.xlsx', '.xls')):
             raise ValueError("Поддерживаются только файлы .xls и .xlsx")
 
-        return pd.read_excel(file_path, sheet_name=0, header=None, engine=engine)
+        return read_sheet_until(file_path, ObjectEstimateScan())
     except Exception as e:
         print(f"Ошибка при чтении файла Excel: {e}")
         return None
 
 
-def extract_estimate_info(df):
+def extract_estimate_info(df, index=None):
     """Извлечение точного названия объектной сметы"""
-    # Ищем строку, содержащую "ОБЪЕКТНЫЙ СМЕТНЫЙ РАСЧЕТ"
-    for row in range(min(50, df.shape[0])):
-        for col in range(df.shape[1]):
-            cell_value = str(df.iat[row, col]).strip() if pd.notna(df.iat[row, col]) else ""
-            if "ОБЪЕКТНЫЙ СМЕТНЫЙ РАСЧЕТ" in cell_value.upper():
-                return cell_value.strip()
-
-    # Альтернативные варианты
-    alternative_phrases = [
+    if index is None:
+        index = ExcelAnchorIndex(df)
+
+    # Ищем строку, содержащую "ОБЪЕКТНЫЙ СМЕТНЫЙ РАСЧЕТ", затем альтернативные варианты
+    phrases = [
+        "ОБЪЕКТНЫЙ СМЕТНЫЙ РАСЧЕТ",
         "ОБЪЕКТНАЯ СМЕТА",
         "ОБЪЕКТНЫЙ РАСЧЕТ",
         "СМЕТА №",
         "ОС №"
     ]
 
-    for phrase in alternative_phrases:
-        for row in range(min(50, df.shape[0])):
-            for col in range(df.shape[1]):
-                cell_value = str(df.iat[row, col]).strip() if pd.notna(df.iat[row, col]) else ""
-                if phrase in cell_value.upper():
-                    return cell_value.strip()
+    for phrase in phrases:
+        found = index.find_first(phrase, upper=True, max_rows=HEADER_ROWS)
+        if found is not None:
+            return index.cell_text(*found).strip()
 
     return None
 
 
-def extract_cost_info(df):
+def extract_cost_info(df, index=None):
     """Извлечение информации о стоимости с учетом структуры файла"""
+    if index is None:
+        index = ExcelAnchorIndex(df)
+
     # Ищем строку с "Сметная стоимость"
-    for row in range(min(50, df.shape[0])):
-        for col in range(df.shape[1]):
-            cell_value = str(df.iat[row, col]).strip() if pd.notna(df.iat[row, col]) else ""
-            if "Сметная стоимость" in cell_value:
-                # Проверяем 5 столбцов справа
-                for offset in range(1, 6):
-                    if col + offset >= df.shape[1]:
-                        continue
-                    cost_cell = str(df.iat[row, col + offset]).strip()
-                    match = re.search(r"(\d[\d\s.,]+)\s*тыс\.?\s*руб\.?", cost_cell.replace("\xa0", " "))
-                    if match:
-                        try:
-                            value = float(match.group(1).replace(" ", "").replace(",", "."))
-                            return value * 1000
-                        except ValueError:
-                            continue
+    for row, col in index.find_all("Сметная стоимость", max_rows=HEADER_ROWS):
+        # Проверяем 5 столбцов справа
+        for offset in range(1, 6):
+            if col + offset >= df.shape[1]:
+                continue
+            cost_cell = str(df.iat[row, col + offset]).strip()
+            match = re.search(r"(\d[\d\s.,]+)\s*тыс\.?\s*руб\.?", cost_cell.replace("\xa0", " "))
+            if match:
+                try:
+                    value = float(match.group(1).replace(" ", "").replace(",", "."))
+                    return value * 1000
+                except ValueError:
+                    continue
 
     return None
 
 
-def extract_local_estimates(df):
+def extract_local_estimates(df, index=None):
     """Извлечение локальных смет с поддержкой разных формулировок"""
-    local_estimates = []
-    search_phrases = [
-        "Локальные сметы (расчеты)",
-        "ЛОКАЛЬНЫЕ СМЕТЫ",
-        "Локальные сметные расчеты",
-        "Локальные сметы"
-    ]
+    if index is None:
+        index = ExcelAnchorIndex(df)
 
+    local_estimates = []
     local_estimate_row = None
-    for phrase in search_phrases:
-        for row in range(df.shape[0]):
-            cell_value = str(df.iat[row, 0]) if pd.notna(df.iat[row, 0]) else ""
-            if phrase in cell_value:
-                local_estimate_row = row
-                break
-        if local_estimate_row is not None:
+    for phrase in LOCAL_ESTIMATE_PHRASES:
+        found = index.find_first(phrase, col=0)
+        if found is not None:
+            local_estimate_row = found[0]
             break
 
     if local_estimate_row is not None:
         for row in range(local_estimate_row + 1, min(local_estimate_row + 100, df.shape[0])):
             if pd.notna(df.iat[row, 1]) and pd.notna(df.iat[row, 2]):
                 local_estimate_name = f"{df.iat[row, 1]} {df.iat[row, 2]}".strip()
-                if local_estimate_name and local_estimate_name not in search_phrases:
+                if local_estimate_name and local_estimate_name not in LOCAL_ESTIMATE_PHRASES:
                     local_estimates.append(local_estimate_name)
             elif local_estimates:  # Если уже нашли какие-то сметы и встретили пустую строку
                 break
@@ -152,67 +130,45 @@ def extract_local_estimates(df):
     return local_estimates
 
 
-def save_to_database(object_id, estimate_name, cost_value, local_estimates):
-    """Сохранение данных в базу данных"""
-    conn = connect_to_db()
-    if not conn:
-        return False
-
-    try:
-        with conn.cursor() as cursor:
-            # Вставка объектной сметы
-            cursor.execute(
-                """INSERT INTO object_estimates 
-                   (object_id, name_object_estimate, object_estimates_price) 
-                   VALUES (%s, %s, %s) RETURNING id""",
-                (object_id, estimate_name, cost_value)
-            )
-            estimate_id = cursor.fetchone()[0]
-
-            # Вставка локальных смет
-            for estimate in local_estimates:
-                cursor.execute(
-                    """INSERT INTO local_estimates 
-                       (object_estimates_id, name_local_estimate) 
-                       VALUES (%s, %s)""",
-                    (estimate_id, estimate)
-                )
-
-        conn.commit()
-        return True
-
-    except Exception as e:
-        print(f"Ошибка при сохранении в базу данных: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
-
+def parse_object_estimate(file_path):
+    """
+    Разбирает объектную смету из Excel без обращения к БД
+    :return: словарь с ключами estimate_name, total_cost, local_estimates
+    """
+    df = parse_excel_file(file_path)
+    if df is None:
+        raise ValueError("Не удалось прочитать файл Excel")
+    index = ExcelAnchorIndex(df)
 
-def parse_and_save_smeta(file_path, object_id):
-    """Основная функция обработки файла"""
-    try:
-        df = parse_excel_file(file_path)
-        if df is None:
-            raise ValueError("Не удалось прочитать файл Excel")
+    estimate_name = extract_estimate_info(df, index)
+    if not estimate_name:
+        raise ValueError("Не удалось извлечь название объектной сметы")
 
-        estimate_name = extract_estimate_info(df)
-        if not estimate_name:
-            raise ValueError("Не удалось извлечь название объектной сметы")
+    cost_value = extract_cost_info(df, index)
+    if cost_value is None:
+        raise ValueError("Не удалось извлечь сметную стоимость")
 
-        cost_value = extract_cost_info(df)
-        if cost_value is None:
-            raise ValueError("Не удалось извлечь сметную стоимость")
+    local_estimates = extract_local_estimates(df, index)
+    if not local_estimates:
+        print("Предупреждение: не найдено локальных смет")
 
-        local_estimates = extract_local_estimates(df)
-        if not local_estimates:
-            print("Предупреждение: не найдено локальных смет")
+    return {
+        "estimate_name": estimate_name,
+        "total_cost": cost_value,
+        "local_estimates": local_estimates
+    }
 
-        if not save_to_database(object_id, estimate_name, cost_value, local_estimates):
-            raise Exception("Ошибка при сохранении в базу данных")
 
-        return True
+def parse_and_save_smeta(file_path, object_id, conn=None):
+    """
+    Основная функция обработки файла.
+    Если conn передан, запись идет в его транзакции (commit делает вызывающий код)
+    """
+    try:
+        result = parse_object_estimate(file_path)
+        with connection(conn) as db_conn:
+            return save_object_estimate(db_conn, object_id, **result)
 
     except Exception as e:
         print(f"Ошибка при обработке файла {file_path}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
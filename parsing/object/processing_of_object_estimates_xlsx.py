@@ -1,106 +1,73 @@
 import os
-from typing import Optional
+import numpy as np
 import pandas as pd
 import re
 import psycopg2
 
-from config import DB_CONFIG
+from models.db_pool import connection
+from parsing.object.excel_anchor_index import ExcelAnchorIndex
+from parsing.object.excel_reader import cell_is_empty, read_sheet_until
+from parsing.object.object_estimate_writer import save_object_estimate
 
 
-def connect_to_db(
-        dbname: str = None,
-        user: str = None,
-        password: str = None,
-        host: str = None,
-        port: str = None,
-        **kwargs
-) -> Optional[psycopg2.extensions.connection]:
+class ObjectEstimateScan:
     """
-    Подключается к PostgreSQL с возможностью переопределения параметров
-
-    Args:
-        dbname: Название БД (переопределяет DB_CONFIG['dbname'])
-        user: Пользователь (переопределяет DB_CONFIG['user'])
-        password: Пароль (переопределяет DB_CONFIG['password'])
-        host: Хост (переопределяет DB_CONFIG['host'])
-        port: Порт (переопределяет DB_CONFIG['port'])
-        **kwargs: Дополнительные параметры для psycopg2.connect()
-
-    Returns:
-        Connection object или None при ошибке
+    Условие остановки чтения листа: уже встретились название и стоимость сметы
+    и закончилась таблица локальных смет (дальше extract_* ничего не ищут)
     """
-    # Копируем базовую конфигурацию, чтобы не менять оригинал
-    connection_params = DB_CONFIG.copy()
-
-    # Переопределяем только те параметры, которые переданы
-    if dbname is not None:
-        connection_params['dbname'] = dbname
-    if user is not None:
-        connection_params['user'] = user
-    if password is not None:
-        connection_params['password'] = password
-    if host is not None:
-        connection_params['host'] = host
-    if port is not None:
-        connection_params['port'] = port
-
-    # Добавляем дополнительные параметры (если есть)
-    connection_params.update(kwargs)
 
-    try:
-        conn = psycopg2.connect(**connection_params)
-        print("Успешное подключение к БД")
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к PostgreSQL: {e}")
-        return None
+    def __init__(self):
+        self.name_found = False
+        self.cost_found = False
+        self.table_started = False
+        self.table_ended = False
+
+    def __call__(self, row_no: int, values: list) -> bool:
+        if not self.name_found:
+            self.name_found = "(объектная смета)" in values
+        if not self.cost_found:
+            self.cost_found = any(isinstance(value, str) and "Сметная стоимость" in value for value in values)
+        if not self.table_started:
+            self.table_started = bool(values) and values[0] == "Локальные сметы (расчеты)"
+        elif not self.table_ended:
+            self.table_ended = cell_is_empty(values, 1) or cell_is_empty(values, 2)
+        return self.name_found and self.cost_found and self.table_ended
 
 
 def parse_excel_file(file_path):
-    """Основная функция парсинга Excel файла"""
+    """Основная функция парсинга Excel файла (лист читается до конца таблицы локальных смет)"""
     try:
-        # Чтение Excel-файла
-        df = pd.read_excel(file_path, sheet_name=0, header=None)
-        return df
+        return read_sheet_until(file_path, ObjectEstimateScan())
     except Exception as e:
         print(f"Ошибка при чтении файла Excel: {e}")
         return None
 
 
-def extract_estimate_info(df):
+def extract_estimate_info(df, index=None):
     """Извлечение информации о смете"""
-    # Поиск названия объектной сметы ("(объектная смета)")
-    estimate_row, estimate_col = None, None
-    for row in range(df.shape[0]):
-        for col in range(df.shape[1]):
-            if df.iat[row, col] == "(объектная смета)":
-                estimate_row, estimate_col = row, col
-                break
-        if estimate_row is not None:
-            break
+    if index is None:
+        index = ExcelAnchorIndex(df)
 
+    # Поиск названия объектной сметы ("(объектная смета)")
     estimate_name = None
-    if estimate_row is not None and estimate_col is not None:
+    found = index.find_first("(объектная смета)", exact=True)
+    if found is not None:
+        estimate_row, estimate_col = found
         estimate_name = df.iat[estimate_row - 1, estimate_col]
 
     return estimate_name
 
 
-def extract_cost_info(df):
+def extract_cost_info(df, index=None):
     """Извлечение информации о стоимости"""
-    # Поиск сметной стоимости
-    cost_row, cost_col = None, None
-    for row in range(df.shape[0]):
-        for col in range(df.shape[1]):
-            if isinstance(df.iat[row, col], str) and "Сметная стоимость" in df.iat[row, col]:
-                cost_row, cost_col = row, col
-                break
-        if cost_row is not None:
-            break
+    if index is None:
+        index = ExcelAnchorIndex(df)
 
+    # Поиск сметной стоимости
     cost_value_number = None
-    if cost_row is not None and cost_col is not None:
-        cost_value = df.iat[cost_row, cost_col]
+    found = index.find_first("Сметная стоимость")
+    if found is not None:
+        cost_value = df.iat[found]
         match = re.search(r"\d+[\.,]?\d*", cost_value)
         if match:
             cost_value_cleaned = match.group(0).replace(",", ".")
@@ -112,129 +79,79 @@ def extract_cost_info(df):
     return cost_value_number * 1000 if cost_value_number else None
 
 
-def extract_local_estimates(df):
+def extract_local_estimates(df, index=None):
     """Извлечение локальных смет"""
+    if index is None:
+        index = ExcelAnchorIndex(df)
+
     local_estimates = []
     # Поиск начала локальных смет
-    local_estimate_row = None
-    for row in range(df.shape[0]):
-        if df.iat[row, 0] == "Локальные сметы (расчеты)":
-            local_estimate_row = row
-            break
-
-    if local_estimate_row is not None:
-        for row in range(local_estimate_row + 1, df.shape[0]):
-            if pd.notna(df.iat[row, 1]) and pd.notna(df.iat[row, 2]):
-                local_estimate_name = f"{df.iat[row, 1]} {df.iat[row, 2]}"
-                local_estimates.append(local_estimate_name)
-            else:
-                break
+    found = index.find_first("Локальные сметы (расчеты)", exact=True, col=0)
 
-    return local_estimates
-
-
-def save_to_database(object_id, estimate_name, cost_value, local_estimates):
-    """Сохранение данных в базу данных"""
-    conn = connect_to_db()
-    if not conn:
-        return False
-
-    try:
-        # Вставка объектной сметы
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """INSERT INTO object_estimates 
-                   (object_id, name_object_estimate, object_estimates_price) 
-                   VALUES (%s, %s, %s) RETURNING id""",
-                (object_id, estimate_name, cost_value)
-            )
-            estimate_id = cursor.fetchone()[0]
-
-        # Вставка локальных смет
-        with conn.cursor() as cursor:
-            for estimate in local_estimates:
-                cursor.execute(
-                    """INSERT INTO local_estimates 
-                       (object_estimates_id, name_local_estimate) 
-                       VALUES (%s, %s)""",
-                    (estimate_id, estimate)
-                )
-
-        conn.commit()
-        return True
-
-    except Exception as e:
-        print(f"Ошибка при сохранении в базу данных: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    if found is not None:
+        # Таблица идет до первой строки, где пуст шифр или наименование
+        rows = df.iloc[found[0] + 1:, [1, 2]]
+        filled = rows.notna().all(axis=1).to_numpy()
+        end = len(filled) if filled.all() else int(np.argmin(filled))
+        for code, name in rows.iloc[:end].itertuples(index=False):
+            local_estimates.append(f"{code} {name}")
 
+    return local_estimates
 
-def parse_and_save_smeta(file_path, object_id):
-    """Парсит объектную смету из Excel и сохраняет в базу данных"""
 
-    # Проверка входных параметров
+def parse_object_estimate(file_path):
+    """
+    Разбирает объектную смету из Excel без обращения к БД
+    :return: словарь с ключами estimate_name, total_cost, local_estimates
+    """
     if not file_path or not isinstance(file_path, (str, bytes, os.PathLike)):
         raise ValueError("Неверный путь к файлу")
-    if not object_id or not isinstance(object_id, int):
-        raise ValueError("Неверный ID объекта")
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Файл не существует: {file_path}")
 
-    try:
-        # Чтение Excel-файла
-        df = parse_excel_file(file_path)
-        if df is None:
-            raise ValueError("Не удалось прочитать файл Excel")
+    # Чтение Excel-файла
+    df = parse_excel_file(file_path)
+    if df is None:
+        raise ValueError("Не удалось прочитать файл Excel")
+    index = ExcelAnchorIndex(df)
 
-        # Извлечение информации о смете
-        estimate_name = extract_estimate_info(df)
-        if not estimate_name:
-            raise ValueError("Не удалось извлечь название объектной сметы")
+    # Извлечение информации о смете
+    estimate_name = extract_estimate_info(df, index)
+    if not estimate_name:
+        raise ValueError("Не удалось извлечь название объектной сметы")
 
-        cost_value = extract_cost_info(df)
-        if cost_value is None:
-            raise ValueError("Не удалось извлечь сметную стоимость")
+    cost_value = extract_cost_info(df, index)
+    if cost_value is None:
+        raise ValueError("Не удалось извлечь сметную стоимость")
 
-        local_estimates = extract_local_estimates(df)
-        if not local_estimates:
-            print("Предупреждение: не найдено локальных смет")
+    local_estimates = extract_local_estimates(df, index)
+    if not local_estimates:
+        print("Предупреждение: не найдено локальных смет")
 
-        # Подключение к базе данных
-        conn = connect_to_db()
-        if not conn:
-            raise ConnectionError("Не удалось подключиться к базе данных")
+    return {
+        "estimate_name": estimate_name,
+        "total_cost": cost_value,
+        "local_estimates": local_estimates
+    }
 
-        try:
-            with conn.cursor() as cursor:
-                # Вставка объектной сметы
-                cursor.execute(
-                    """INSERT INTO object_estimates 
-                       (object_id, name_object_estimate, object_estimates_price) 
-                       VALUES (%s, %s, %s) RETURNING id""",
-                    (object_id, estimate_name, cost_value)
-                )
-                estimate_id = cursor.fetchone()[0]
-
-                # Вставка локальных смет
-                for estimate in local_estimates:
-                    cursor.execute(
-                        """INSERT INTO local_estimates 
-                           (object_estimates_id, name_local_estimate) 
-                           VALUES (%s, %s)""",
-                        (estimate_id, estimate)
-                    )
-
-                conn.commit()
-                return True
 
+def parse_and_save_smeta(file_path, object_id, conn=None):
+    """
+    Парсит объектную смету из Excel и сохраняет в базу данных.
+    Если conn передан, запись идет в его транзакции (commit делает вызывающий код)
+    """
+    if not object_id or not isinstance(object_id, int):
+        raise ValueError("Неверный ID объекта")
+
+    try:
+        result = parse_object_estimate(file_path)
+
+        try:
+            with connection(conn) as db_conn:
+                return save_object_estimate(db_conn, object_id, **result)
         except psycopg2.Error as e:
-            conn.rollback()
             raise Exception(f"Ошибка при сохранении в базу данных: {e}")
-        finally:
-            conn.close()
 
     except Exception as e:
         print(f"Ошибка при обработке файла {file_path}: {str(e)}")
-        raise  # Пробрасываем исключение дальше
\ No newline at end of file
+        raise  # Пробрасываем исключение дальше
@@ -1,105 +1,135 @@
 import os
 import xml.etree.ElementTree as ET
-import psycopg2
-from typing import Optional
+from typing import List, Optional, Tuple
 
-from config import DB_CONFIG
+from models.db_pool import connection
+from parsing.object.object_estimate_writer import save_object_estimate
 
 
-def connect_to_db(
-        dbname: str = None,
-        user: str = None,
-        password: str = None,
-        host: str = None,
-        port: str = None,
-        **kwargs
-) -> Optional[psycopg2.extensions.connection]:
+# DocumentType корневого элемента в выгрузках GrandSmeta
+OBJECT_DOCUMENT_TYPE = "{2B0470FD-477C-4359-9F34-EEBE36B7D345}"
+LOCAL_DOCUMENT_TYPE = "{2B0470FD-477C-4359-9F34-EEBE36B7D340}"
+
+# Названия раздела с локальными сметами в порядке приоритета
+LOCAL_ESTIMATE_CHAPTERS = [
+    "Локальные сметы (расчеты)",
+    "Локальные сметные расчеты"
+]
+
+
+def local_estimate_name(position: ET.Element) -> str:
+    """Название локальной сметы по позиции раздела: обоснование и наименование"""
+    return f"{position.get('Obosn', '')} {position.get('Caption', '')}".strip()
+
+
+def read_chapter_tree(file_path) -> Optional[Tuple[Optional[float], List[str]]]:
     """
-    Подключается к PostgreSQL с возможностью переопределения параметров
-
-    Args:
-        dbname: Название БД (переопределяет DB_CONFIG['dbname'])
-        user: Пользователь (переопределяет DB_CONFIG['user'])
-        password: Пароль (переопределяет DB_CONFIG['password'])
-        host: Хост (переопределяет DB_CONFIG['host'])
-        port: Порт (переопределяет DB_CONFIG['port'])
-        **kwargs: Дополнительные параметры для psycopg2.connect()
-
-    Returns:
-        Connection object или None при ошибке
+    Прежний режим: весь документ загружается через ET.parse.
+    :return: (общая стоимость, названия локальных смет) или None, если раздела нет
     """
-    # Копируем базовую конфигурацию, чтобы не менять оригинал
-    connection_params = DB_CONFIG.copy()
-
-    # Переопределяем только те параметры, которые переданы
-    if dbname is not None:
-        connection_params['dbname'] = dbname
-    if user is not None:
-        connection_params['user'] = user
-    if password is not None:
-        connection_params['password'] = password
-    if host is not None:
-        connection_params['host'] = host
-    if port is not None:
-        connection_params['port'] = port
-
-    # Добавляем дополнительные параметры (если есть)
-    connection_params.update(kwargs)
+    root = ET.parse(file_path).getroot()
 
-    try:
-        conn = psycopg2.connect(**connection_params)
-        print("Успешное подключение к БД")
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к PostgreSQL: {e}")
+    chapter = None
+    for chapter_name in LOCAL_ESTIMATE_CHAPTERS:
+        chapters = root.findall(f".//Chapter[@Caption='{chapter_name}']")
+        if chapters:
+            chapter = chapters[0]
+            break
+
+    if chapter is None:
         return None
 
+    # Общая стоимость - из первого Summary с атрибутом Total
+    total_cost = None
+    for summary in chapter.findall(".//Summary[@Total]"):
+        total_cost = float(summary.get("Total"))
+        break
+
+    local_estimates = [name for name in map(local_estimate_name, chapter.findall(".//Position")) if name]
+    return total_cost, local_estimates
 
-def parse_xml_file(file_path):
-    """Основная функция парсинга XML файла"""
+
+def read_chapter_streaming(file_path) -> Optional[Tuple[Optional[float], List[str]]]:
+    """
+    Один проход iterparse по документу.
+
+    Для каждого названия из LOCAL_ESTIMATE_CHAPTERS запоминается первый такой раздел:
+    первый Summary с Total и все позиции внутри него (атрибуты доступны уже по
+    открывающему тегу). Как только закрыт раздел с основным названием, чтение
+    прекращается. Закрытые элементы удаляются из дерева.
+    :return: (общая стоимость, названия локальных смет) или None, если раздела нет
+    """
+    chapters = {}  # название -> {'elem', 'total_cost', 'local_estimates', 'closed'}
+    stack = []
+    for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            caption = elem.get('Caption') if elem.tag == 'Chapter' else None
+            if caption in LOCAL_ESTIMATE_CHAPTERS and caption not in chapters:
+                chapters[caption] = {'elem': elem, 'total_cost': None, 'local_estimates': [], 'closed': False}
+            elif elem.tag in ('Summary', 'Position'):
+                for chapter in chapters.values():
+                    if chapter['closed']:
+                        continue
+                    if elem.tag == 'Position':
+                        name = local_estimate_name(elem)
+                        if name:
+                            chapter['local_estimates'].append(name)
+                    elif chapter['total_cost'] is None and elem.get('Total') is not None:
+                        chapter['total_cost'] = float(elem.get('Total'))
+            continue
+
+        stack.pop()
+        chapter = chapters.get(elem.get('Caption')) if elem.tag == 'Chapter' else None
+        if chapter is not None and chapter['elem'] is elem:
+            chapter['closed'] = True
+            if elem.get('Caption') == LOCAL_ESTIMATE_CHAPTERS[0]:
+                break
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+    for chapter_name in LOCAL_ESTIMATE_CHAPTERS:
+        if chapter_name in chapters:
+            return chapters[chapter_name]['total_cost'], chapters[chapter_name]['local_estimates']
+    return None
+
+
+def is_object_estimate_xml(file_path) -> bool:
+    """
+    Отличает объектную смету GrandSmeta от локальной: по DocumentType корневого
+    элемента, а если он не указан или неизвестен - по наличию раздела с локальными сметами
+    """
+    document_type = None
+    for event, elem in ET.iterparse(file_path, events=('start',)):
+        document_type = elem.get('DocumentType')
+        break
+
+    if document_type == OBJECT_DOCUMENT_TYPE:
+        return True
+    if document_type == LOCAL_DOCUMENT_TYPE:
+        return False
+    return read_chapter_streaming(file_path) is not None
+
+
+def parse_xml_file(file_path, streaming: bool = True):
+    """
+    Основная функция парсинга XML файла
+    :param streaming: False - загрузить весь документ через ET.parse (прежний режим)
+    """
     try:
         # Извлекаем название сметы из имени файла (без расширения)
         estimate_name = os.path.splitext(os.path.basename(file_path))[0]
 
-        # Парсим XML файл
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
-        # Ищем раздел с локальными сметами (пробуем оба возможных названия)
-        chapter = None
-        possible_chapter_names = [
-            "Локальные сметы (расчеты)",
-            "Локальные сметные расчеты"
-        ]
-
-        for chapter_name in possible_chapter_names:
-            chapters = root.findall(f".//Chapter[@Caption='{chapter_name}']")
-            if chapters:
-                chapter = chapters[0]
-                break
-
+        chapter = read_chapter_streaming(file_path) if streaming else read_chapter_tree(file_path)
         if chapter is None:
             raise ValueError("Не найден раздел с локальными сметами (пробовали: " +
-                             ", ".join(possible_chapter_names) + ")")
-
-        # Извлекаем общую стоимость (из первого Summary с атрибутом Total)
-        total_cost = None
-        for summary in chapter.findall(".//Summary[@Total]"):
-            total_cost = float(summary.get("Total"))
-            break
+                             ", ".join(LOCAL_ESTIMATE_CHAPTERS) + ")")
 
+        total_cost, local_estimates = chapter
         if total_cost is None:
             raise ValueError("Не удалось извлечь общую стоимость сметы")
 
-        # Извлекаем локальные сметы
-        local_estimates = []
-        for position in chapter.findall(".//Position"):
-            obosn = position.get("Obosn", "")
-            caption = position.get("Caption", "")
-            local_estimate_name = f"{obosn} {caption}".strip()
-            if local_estimate_name:
-                local_estimates.append(local_estimate_name)
-
         return {
             "estimate_name": estimate_name,
             "total_cost": total_cost,
@@ -111,72 +141,36 @@ def parse_xml_file(file_path):
         return None
 
 
-def save_to_database(object_id, estimate_name, cost_value, local_estimates):
-    """Сохранение данных в базу данных"""
-    conn = connect_to_db()
-    if not conn:
-        return False
-
-    try:
-        # Вставка объектной сметы
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """INSERT INTO object_estimates 
-                   (object_id, name_object_estimate, object_estimates_price) 
-                   VALUES (%s, %s, %s) RETURNING id""",
-                (object_id, estimate_name, cost_value)
-            )
-            estimate_id = cursor.fetchone()[0]
-
-        # Вставка локальных смет
-        with conn.cursor() as cursor:
-            for estimate in local_estimates:
-                cursor.execute(
-                    """INSERT INTO local_estimates 
-                       (object_estimates_id, name_local_estimate) 
-                       VALUES (%s, %s)""",
-                    (estimate_id, estimate)
-                )
-
-        conn.commit()
-        return True
-
-    except Exception as e:
-        print(f"Ошибка при сохранении в базу данных: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
-
-
-def parse_and_save_smeta(file_path, object_id):
-    """Парсит объектную смету из XML и сохраняет в базу данных"""
-    # Проверка входных параметров
+def parse_object_estimate(file_path):
+    """
+    Разбирает объектную смету из XML без обращения к БД
+    :return: словарь с ключами estimate_name, total_cost, local_estimates
+    """
     if not file_path or not isinstance(file_path, (str, bytes, os.PathLike)):
         raise ValueError("Неверный путь к файлу")
-    if not object_id or not isinstance(object_id, int):
-        raise ValueError("Неверный ID объекта")
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Файл не существует: {file_path}")
     if not file_path.lower().endswith('.xml'):
         raise ValueError("Файл должен быть в формате .xml")
 
-    try:
-        # Парсинг XML файла
-        result = parse_xml_file(file_path)
-        if not result:
-            raise ValueError("Не удалось обработать XML файл")
-
-        # Сохранение в базу данных
-        if not save_to_database(
-                object_id,
-                result["estimate_name"],
-                result["total_cost"],
-                result["local_estimates"]
-        ):
-            raise Exception("Ошибка при сохранении в базу данных")
+    result = parse_xml_file(file_path)
+    if not result:
+        raise ValueError("Не удалось обработать XML файл")
+    return result
 
-        return True
+
+def parse_and_save_smeta(file_path, object_id, conn=None):
+    """
+    Парсит объектную смету из XML и сохраняет в базу данных.
+    Если conn передан, запись идет в его транзакции (commit делает вызывающий код)
+    """
+    if not object_id or not isinstance(object_id, int):
+        raise ValueError("Неверный ID объекта")
+
+    try:
+        result = parse_object_estimate(file_path)
+        with connection(conn) as db_conn:
+            return save_object_estimate(db_conn, object_id, **result)
 
     except Exception as e:
         print(f"Ошибка при обработке файла {file_path}: {str(e)}")
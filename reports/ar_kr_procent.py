@@ -1,16 +1,28 @@
 import psycopg2
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
 
+from reports.report_writer import write_report
 
-def generate_report(db_params, filename):
+# Коды категорий в справочнике estimate_categories
+AR_CATEGORY = 'АР'
+KR_CATEGORY = 'КР'
+
+
+def generate_report(db_params, filename, job=None):
+    """
+    Отчет о доле АР и КР в стоимости объектов
+    :param job: фоновое задание (models.job_runner.Job): ход работы и отмена, в том
+                числе прерывание выполняющихся запросов; None - без интерфейса
+    :return: True, если отчет сохранен
+    """
+    conn = None
     try:
         # Подключаемся к БД
         conn = psycopg2.connect(**db_params)
         cursor = conn.cursor()
 
-        # SQL-запрос
+        # SQL-запрос: категории смет размечены при загрузке (estimate_categories); смета
+        # нескольких категорий входит в сумму каждой из них
         query = """
         WITH object_total_costs AS (
             SELECT 
@@ -21,85 +33,50 @@ def generate_report(db_params, filename):
             JOIN object_estimates oe ON o.id = oe.object_id
             GROUP BY o.id, o.object_name
         ),
-        ar_costs AS (
-            SELECT 
-                o.id AS object_id,
-                SUM(le.local_estimates_price) AS total_ar_cost
-            FROM objects o
-            JOIN object_estimates oe ON o.id = oe.object_id
-            JOIN local_estimates le ON oe.id = le.object_estimates_id
-            WHERE le.name_local_estimate ILIKE ANY(ARRAY[
-                '%Архитектурные решения%', 
-                '%Кровля и кладка%',
-                '%Витражи%',
-                '%Отделочные работы%'
-            ])
-            GROUP BY o.id
-        ),
-        kr_costs AS (
+        category_costs AS (
             SELECT 
-                o.id AS object_id,
-                SUM(le.local_estimates_price) AS total_kr_cost
-            FROM objects o
-            JOIN object_estimates oe ON o.id = oe.object_id
-            JOIN local_estimates le ON oe.id = le.object_estimates_id
-            WHERE le.name_local_estimate ILIKE ANY(ARRAY[
-                '%Конструктивные решения%',
-                '%Конструкции железобетонные%',
-                '%Конструктивные и объемно-планировочные решения%',
-                '%Конструкции металлические%',
-                '%Железобетонные,металлические конструкции%',
-                '%Конструкции деревянные%',
-                '%Железобетонные конструкции%'
-            ])
-            GROUP BY o.id
+                oe.object_id,
+                SUM(le.local_estimates_price) FILTER (WHERE c.code = %(ar)s) AS total_ar_cost,
+                SUM(le.local_estimates_price) FILTER (WHERE c.code = %(kr)s) AS total_kr_cost
+            FROM local_estimates le
+            JOIN local_estimate_categories lc ON lc.local_estimate_id = le.id
+            JOIN estimate_categories c ON lc.category_id = c.id
+            JOIN object_estimates oe ON le.object_estimates_id = oe.id
+            WHERE c.code IN (%(ar)s, %(kr)s)
+            GROUP BY oe.object_id
         )
         SELECT 
             otc.object_name,
-            ROUND((COALESCE(ac.total_ar_cost, 0) / NULLIF(otc.object_total_cost, 0)) * 100, 2) AS ar_percentage,
-            ROUND((COALESCE(kc.total_kr_cost, 0) / NULLIF(otc.object_total_cost, 0)) * 100, 2) AS kr_percentage
+            ROUND((COALESCE(cc.total_ar_cost, 0) / NULLIF(otc.object_total_cost, 0)) * 100, 2) AS ar_percentage,
+            ROUND((COALESCE(cc.total_kr_cost, 0) / NULLIF(otc.object_total_cost, 0)) * 100, 2) AS kr_percentage
         FROM object_total_costs otc
-        LEFT JOIN ar_costs ac ON otc.object_id = ac.object_id
-        LEFT JOIN kr_costs kc ON otc.object_id = kc.object_id
+        LEFT JOIN category_costs cc ON otc.object_id = cc.object_id
         ORDER BY otc.object_id;
         """
+        params = {'ar': AR_CATEGORY, 'kr': KR_CATEGORY}
 
-        cursor.execute(query)
+        if job is not None:
+            job.report(0.1, "Расчет долей АР и КР")
+            with job.cancellable(conn):
+                cursor.execute(query, params)
+        else:
+            cursor.execute(query, params)
         results = cursor.fetchall()
 
         # Формируем DataFrame
         df = pd.DataFrame(results, columns=["Название объекта", "% АР", "% КР"])
 
         # Сохраняем в Excel
-        df.to_excel(filename, index=False)
-
-        # Настройка ширины столбцов по содержимому
-        wb = load_workbook(filename)
-        sheet = wb.active
-
-        for column in sheet.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-
-            # Проверяем длину каждого значения в столбце
-            for cell in column:
-                try:
-                    value_length = len(str(cell.value))
-                    if value_length > max_length:
-                        max_length = value_length
-                except:
-                    pass
-
-            # Устанавливаем ширину с небольшим запасом
-            adjusted_width = (max_length + 2)
-            sheet.column_dimensions[column_letter].width = adjusted_width
-
-        wb.save(filename)
+        if job is not None:
+            job.report(0.7, "Запись Excel")
+        write_report(filename, [('Sheet1', df)])
 
         print(f"Отчет успешно сохранен: {filename}")
+        return True
 
     except Exception as e:
         print(f"Ошибка при генерации отчета: {str(e)}")
+        return False
     finally:
         if conn:
             cursor.close()
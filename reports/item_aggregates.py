@@ -0,0 +1,112 @@
+import pandas as pd
+
+from reports.report_writer import write_report
+
+# Сводка по кодам работ и материалов для отчетов sorting_1..3. Агрегирует сервер:
+# по сети передается одна строка на код, а не все строки work/materials. Объект и
+# объектная смета берутся из самих строк (object_id, object_estimates_id), без
+# соединения через разделы и локальные сметы.
+
+# Строки позиций: таблица и её псевдоним
+ITEM_SOURCES = {
+    'work': ("work", "w"),
+    'materials': ("materials", "m"),
+}
+
+# Заголовки столбцов отчета
+ITEM_COLUMNS = {
+    'work': ('Код работы', 'Наименование работы'),
+    'materials': ('Код материала', 'Наименование материала'),
+}
+
+# Порядок сортировки отчетов: столбцы по убыванию, при равенстве - по коду
+ORDER_BY_OCCURRENCES = ('occurrences',)
+ORDER_BY_ESTIMATES = ('estimates', 'occurrences')
+ORDER_BY_UNIT_COST = ('unit_cost', 'estimates', 'occurrences')
+
+# Столбцы запроса и их заголовки в отчете
+REPORT_COLUMNS = {
+    'occurrences': 'Общее количество вхождения',
+    'estimates': 'Количество разных смет',
+    'unit_cost': 'Удельная стоимость, %',
+}
+
+ITEM_AGGREGATE_QUERY = """
+    SELECT
+        i.code_id,
+        c.code,
+        (array_agg(i.name ORDER BY {alias}.id) FILTER (WHERE i.name IS NOT NULL))[1] AS name,
+        (array_agg(i.measurement_unit ORDER BY {alias}.id)
+         FILTER (WHERE i.measurement_unit IS NOT NULL))[1] AS measurement_unit,
+        COUNT(*) AS occurrences,
+        COUNT(DISTINCT {alias}.object_estimates_id) AS estimates,
+        SUM({alias}.price::float8 / NULLIF(oe.object_estimates_price, 0)::float8) AS unit_cost
+    FROM {table} {alias}
+    JOIN estimate_items i ON {alias}.item_id = i.id
+    JOIN estimate_codes c ON i.code_id = c.id
+    JOIN object_estimates oe ON {alias}.object_estimates_id = oe.id
+    {object_filter}
+    GROUP BY i.code_id, c.code
+    ORDER BY {order_by}
+"""
+
+
+def aggregate_items(engine, kind: str, object_ids=None, order_by=ORDER_BY_OCCURRENCES) -> pd.DataFrame:
+    """
+    Сводка по кодам работ (kind='work') или материалов (kind='materials') одним запросом.
+
+    На код - одна строка: наименование и единица измерения из первой по порядку
+    загрузки строки, где они заполнены, общее количество вхождений, количество
+    разных объектных смет и удельная стоимость - сумма отношений цены позиции
+    к стоимости объектной сметы.
+    :param object_ids: ID объектов (None или пустой список - все объекты)
+    :param order_by: порядок строк (ORDER_BY_*)
+    :return: DataFrame со столбцами отчета
+    """
+    table, alias = ITEM_SOURCES[kind]
+    object_filter = f"WHERE {alias}.object_id = ANY(%(object_ids)s)" if object_ids else ""
+    order_clause = ''.join(f"{column} DESC NULLS LAST, " for column in order_by) + "code_id"
+    query = ITEM_AGGREGATE_QUERY.format(table=table, alias=alias,
+                                        object_filter=object_filter, order_by=order_clause)
+    params = {'object_ids': sorted(set(object_ids))} if object_ids else None
+    df = pd.read_sql(query, engine, params=params)
+
+    code_column, name_column = ITEM_COLUMNS[kind]
+    df = df.rename(columns={
+        'code': code_column,
+        'name': name_column,
+        'measurement_unit': 'Единица измерения',
+        **REPORT_COLUMNS,
+    })
+    return df[[code_column, name_column, 'Единица измерения',
+               'Общее количество вхождения', 'Количество разных смет', 'Удельная стоимость, %']]
+
+
+def sort_items(df: pd.DataFrame, order_by) -> pd.DataFrame:
+    """
+    Пересортировка сводки aggregate_items в другом порядке (ORDER_BY_*) без
+    повторного запроса. Сортировка устойчивая: сводка уже упорядочена по коду
+    внутри равных значений, поэтому порядок совпадает с запросом с этим order_by
+    """
+    return df.sort_values([REPORT_COLUMNS[column] for column in order_by],
+                          ascending=False, kind='stable', na_position='last')
+
+
+def get_object_names(engine, object_ids) -> list:
+    """Названия объектов по их ID"""
+    query = "SELECT object_name FROM objects WHERE id = ANY(%(object_ids)s) ORDER BY object_name"
+    return pd.read_sql(query, engine, params={'object_ids': sorted(set(object_ids))})['object_name'].tolist()
+
+
+def write_report_workbook(filename, works_df: pd.DataFrame, materials_df: pd.DataFrame, object_names: list):
+    """
+    Книга отчета: лист "Информация" и листы "Работы" и "Материалы" (пустые сводки
+    пропускаются)
+    """
+    info_rows = [
+        ["Отчет по объектам"],
+        ["Количество объектов:", len(object_names)],
+        ["Названия объектов:", ', '.join(object_names)],
+        ["Дата создания:", pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')],
+    ]
+    write_report(filename, [('Работы', works_df), ('Материалы', materials_df)], info_rows)
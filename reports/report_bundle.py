@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+
+from sqlalchemy import create_engine
+
+from reports.item_aggregates import (aggregate_items, get_object_names, sort_items, write_report_workbook,
+                                     ORDER_BY_OCCURRENCES, ORDER_BY_ESTIMATES, ORDER_BY_UNIT_COST)
+
+# Полный комплект отчетов анализа по выбранным объектам: файл и порядок строк.
+# Отчеты различаются только сортировкой, поэтому сводка считается один раз.
+BUNDLE_REPORTS = (
+    ("анализ_вхождения_по_вхождениям.xlsx", ORDER_BY_OCCURRENCES),
+    ("анализ_смет_по_количеству_смет.xlsx", ORDER_BY_ESTIMATES),
+    ("анализ_смет_по_удельной_стоимости.xlsx", ORDER_BY_UNIT_COST),
+)
+
+
+def generate_all_reports(db_params, folder, object_ids, job=None):
+    """
+    Формирует все отчеты BUNDLE_REPORTS в папке folder по одной выборке: сводки по
+    работам и материалам запрашиваются один раз, книги пишутся параллельно в потоках
+    (запись XlsxWriter быстрая, запуск процессов с импортом pandas обошелся бы дороже)
+    :param job: фоновое задание (models.job_runner.Job): ход работы и отмена, в том
+                числе прерывание выполняющихся запросов; None - без интерфейса
+    :return: список записанных файлов (пустой, если отчет не сформирован)
+    """
+    try:
+        engine = create_engine(
+            f"postgresql://{db_params['user']}:{quote_plus(db_params['password'])}@"
+            f"{db_params['host']}:{db_params['port']}/{db_params['dbname']}"
+        )
+        if job is not None:
+            job.watch_engine(engine)
+
+        if not object_ids:
+            print("Не указаны ID объектов.")
+            return []
+
+        object_names = get_object_names(engine, object_ids)
+
+        if job is not None:
+            job.report(0.1, "Работы")
+        works_df = aggregate_items(engine, 'work', object_ids, ORDER_BY_OCCURRENCES)
+        if job is not None:
+            job.report(0.3, "Материалы")
+        materials_df = aggregate_items(engine, 'materials', object_ids, ORDER_BY_OCCURRENCES)
+
+        if works_df.empty and materials_df.empty:
+            print("Нет данных для отчета.")
+            return []
+
+        if job is not None:
+            job.report(0.5, "Запись Excel")
+        filenames = [os.path.join(folder, name) for name, _ in BUNDLE_REPORTS]
+        with ThreadPoolExecutor(max_workers=len(BUNDLE_REPORTS)) as pool:
+            futures = [
+                pool.submit(write_report_workbook, filename,
+                            sort_items(works_df, order_by), sort_items(materials_df, order_by), object_names)
+                for filename, (_, order_by) in zip(filenames, BUNDLE_REPORTS)
+            ]
+            for future in futures:
+                future.result()
+
+        print(f"\nОтчеты по {len(object_names)} объектам сохранены в {folder}")
+        return filenames
+
+    except Exception as e:
+        print(f"Ошибка при генерации отчетов: {e}")
+        return []
+
+    finally:
+        if 'engine' in locals():
+            engine.dispose()
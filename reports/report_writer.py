@@ -0,0 +1,80 @@
+import pandas as pd
+import xlsxwriter
+
+# Запись Excel отчетов через XlsxWriter в режиме constant_memory: строки сразу уходят
+# в файл, книга пишется один раз без повторного открытия и обхода ячеек.
+
+# Числовые форматы столбцов по заголовку
+COLUMN_FORMATS = {
+    'Удельная стоимость, %': '0.000000%',
+}
+
+# Заголовок таблицы - как у pandas.DataFrame.to_excel
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+# Запас ширины столбца к длине самого длинного значения
+WIDTH_PADDING = 2
+
+
+def column_widths(df: pd.DataFrame) -> list:
+    """Ширина столбцов по длине текста значений и заголовка (пустые значения - 0)"""
+    widths = []
+    for column in df.columns:
+        values = df[column]
+        lengths = values.astype(str).str.len().where(values.notna(), 0)
+        longest = int(lengths.max()) if not lengths.empty else 0
+        widths.append(max(longest, len(str(column))) + WIDTH_PADDING)
+    return widths
+
+
+def rows_for_excel(df: pd.DataFrame):
+    """Строки DataFrame значениями Python, пустые значения - None (пустая ячейка)"""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def write_info_sheet(workbook, sheet_name: str, rows: list):
+    """Лист из произвольных строк (например, сведения об отчете)"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    for row_idx, row in enumerate(rows):
+        worksheet.write_row(row_idx, 0, row)
+    widths = {}
+    for row in rows:
+        for col_idx, value in enumerate(row):
+            widths[col_idx] = max(widths.get(col_idx, 0), len(str(value)) if value is not None else 0)
+    for col_idx, width in widths.items():
+        worksheet.set_column(col_idx, col_idx, width + WIDTH_PADDING)
+
+
+def write_table_sheet(workbook, sheet_name: str, df: pd.DataFrame, column_formats: dict, header_format=None):
+    """Лист с таблицей DataFrame: заголовок, строки, ширина и формат столбцов"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    # В режиме constant_memory столбцы настраиваются до записи строк
+    for col_idx, (column, width) in enumerate(zip(df.columns, column_widths(df))):
+        worksheet.set_column(col_idx, col_idx, width, column_formats.get(column))
+    worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+    for row_idx, row in enumerate(rows_for_excel(df), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+
+def write_report(filename, sheets: list, info_rows: list = None, info_sheet: str = "Информация"):
+    """
+    Пишет книгу отчета за один проход
+    :param sheets: список (имя листа, DataFrame); пустые таблицы пропускаются
+    :param info_rows: строки первого листа info_sheet со сведениями об отчете (None - без него)
+    """
+    # Текст пишется как есть: наименования, начинающиеся с "=" или похожие на ссылки,
+    # не превращаются в формулы и гиперссылки
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True, 'strings_to_formulas': False,
+                                              'strings_to_urls': False})
+    try:
+        column_formats = {column: workbook.add_format({'num_format': num_format})
+                          for column, num_format in COLUMN_FORMATS.items()}
+        header_format = workbook.add_format(HEADER_FORMAT)
+
+        if info_rows is not None:
+            write_info_sheet(workbook, info_sheet, info_rows)
+        for sheet_name, df in sheets:
+            if not df.empty:
+                write_table_sheet(workbook, sheet_name, df, column_formats, header_format)
+    finally:
+        workbook.close()
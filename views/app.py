@@ -5,6 +5,8 @@ from tkinter import ttk, messagebox, filedialog
 from config import DB_CONFIG
 from models.widgets import DragDropWidget
 from models.processor import SmetaProcessor
+from models.ingest_registry import AlreadyIngestedError
+from models.job_runner import JobRunner
 from tkinterdnd2 import TkinterDnD
 
 # отчеты
@@ -12,6 +14,11 @@ from reports.sorting_1_by_the_number_of_occurrences import generate_report as ge
 from reports.sorting_2_by_the_number_of_estimates import generate_report as generate_estimates_report
 from reports.sorting_3_by_unit_cost import generate_report as generate_cost_report
 from reports.ar_kr_procent import generate_report as generate_ar_kr_report
+from reports.report_bundle import generate_all_reports
+
+# Период опроса фоновых заданий, мс
+JOB_POLL_INTERVAL = 100
+
 
 class SmetaApp(TkinterDnD.Tk):
     def __init__(self):
@@ -20,13 +27,23 @@ class SmetaApp(TkinterDnD.Tk):
         self.geometry("800x600")
         self.current_estimate_id = None
         self.current_object_id = None
+        # Кэш дерева вкладки "Управление": iid узла -> его дочерние узлы
+        self.tree_cache = {}
         self.processor = SmetaProcessor()  # Инициализируем processor до создания UI
+        # Разбор смет и отчеты выполняются в фоне, окно не зависает
+        self.jobs = JobRunner()
 
         # Инициализация интерфейса
         self.create_widgets()
         self.update_object_list()  # Обновляем список объектов при запуске
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(JOB_POLL_INTERVAL, self.poll_jobs)
+
     def create_widgets(self):
+        # Панель фоновых заданий (внизу окна, под вкладками)
+        self.setup_jobs_panel()
+
         # Создаем вкладки
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill=tk.BOTH, expand=True)
@@ -126,6 +143,14 @@ class SmetaApp(TkinterDnD.Tk):
         )
         self.process_object_btn.pack(pady=5)
 
+        # Кнопка загрузки пакета (объектная смета вместе с локальными)
+        self.process_package_btn = ttk.Button(
+            self.object_tab,
+            text="Загрузить пакет объекта (ZIP или папка)",
+            command=self.process_object_package
+        )
+        self.process_package_btn.pack(pady=5)
+
         # Кнопка следующего объекта
         self.next_object_btn = ttk.Button(
             self.object_tab,
@@ -170,6 +195,14 @@ class SmetaApp(TkinterDnD.Tk):
         )
         self.delete_local_btn.pack(side=tk.LEFT, padx=5)
 
+        # Кнопка пакетной загрузки папки со сметами
+        self.batch_local_btn = ttk.Button(
+            button_frame,
+            text="Загрузить папку смет",
+            command=self.process_local_batch
+        )
+        self.batch_local_btn.pack(side=tk.LEFT, padx=5)
+
         # Список необработанных смет (без отображения ID)
         self.local_listbox = tk.Listbox(
             self.local_tab,
@@ -237,7 +270,8 @@ class SmetaApp(TkinterDnD.Tk):
             ("Анализ по вхождениям", self.run_all_entries_report),
             ("Анализ по количеству смет", self.run_estimates_report),
             ("Анализ по стоимости", self.run_cost_report),
-            ("Анализ АР/КР", self.run_ar_kr_report)
+            ("Анализ АР/КР", self.run_ar_kr_report),
+            ("Все отчеты анализа", self.run_all_reports)
         ]
 
         for i, (text, command) in enumerate(analysis_buttons):
@@ -266,7 +300,7 @@ class SmetaApp(TkinterDnD.Tk):
         self.estimates_tree = ttk.Treeview(
             main_frame,
             columns=('type', 'price'),
-            selectmode='browse',
+            selectmode='extended',
             height=20
         )
         self.estimates_tree.heading('#0', text='Название')
@@ -301,10 +335,94 @@ class SmetaApp(TkinterDnD.Tk):
 
         # Привязка событий
         self.estimates_tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.estimates_tree.bind('<<TreeviewOpen>>', self.on_tree_open)
 
         # Заполнение дерева
         self.update_estimates_tree()
 
+    def setup_jobs_panel(self):
+        """Список фоновых заданий с прогрессом и кнопкой отмены"""
+        jobs_frame = ttk.LabelFrame(self, text="Фоновые задания")
+        jobs_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=5)
+
+        self.jobs_tree = ttk.Treeview(
+            jobs_frame,
+            columns=('status', 'progress', 'message'),
+            selectmode='browse',
+            height=3
+        )
+        self.jobs_tree.heading('#0', text='Задание')
+        self.jobs_tree.heading('status', text='Статус')
+        self.jobs_tree.heading('progress', text='%')
+        self.jobs_tree.heading('message', text='Этап')
+        self.jobs_tree.column('#0', width=250)
+        self.jobs_tree.column('status', width=100, anchor='center')
+        self.jobs_tree.column('progress', width=50, anchor='e')
+        self.jobs_tree.column('message', width=250)
+        self.jobs_tree.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(5, 0), pady=5)
+        self.jobs_tree.bind('<<TreeviewSelect>>', lambda event: self.update_job_controls())
+
+        controls = ttk.Frame(jobs_frame)
+        controls.pack(side=tk.RIGHT, fill=tk.Y, padx=5, pady=5)
+
+        self.jobs_progress = ttk.Progressbar(controls, length=150, mode='determinate', maximum=100)
+        self.jobs_progress.pack(pady=5)
+
+        self.cancel_job_btn = ttk.Button(
+            controls,
+            text="Отменить",
+            command=self.cancel_job,
+            state=tk.DISABLED
+        )
+        self.cancel_job_btn.pack(pady=5)
+
+    def current_job(self):
+        """Выбранное в списке задание, иначе - последнее незавершенное"""
+        selected = self.jobs_tree.selection()
+        if selected:
+            job_id = int(selected[0][4:])
+            return next((job for job in self.jobs.jobs if job.id == job_id), None)
+        active = self.jobs.active
+        return active[-1] if active else None
+
+    def poll_jobs(self):
+        """События фоновых заданий: обновление списка, вызов обработчиков завершения"""
+        # Следующий опрос планируется сразу: обработчик может открыть модальное окно
+        self.after(JOB_POLL_INTERVAL, self.poll_jobs)
+        for job in self.jobs.poll():
+            iid = f'job_{job.id}'
+            values = (
+                job.status,
+                f"{job.progress * 100:.0f}" if job.progress is not None else "",
+                str(job.error) if job.error else job.message
+            )
+            if self.jobs_tree.exists(iid):
+                self.jobs_tree.item(iid, values=values)
+            else:
+                self.jobs_tree.insert('', 0, iid=iid, text=job.title, values=values)
+        self.update_job_controls()
+
+    def update_job_controls(self):
+        job = self.current_job()
+        if job is None:
+            self.jobs_progress.config(value=0)
+            self.cancel_job_btn.config(state=tk.DISABLED)
+            return
+        self.jobs_progress.config(value=(job.progress or 0) * 100)
+        self.cancel_job_btn.config(state=tk.DISABLED if job.finished else tk.NORMAL)
+
+    def cancel_job(self):
+        job = self.current_job()
+        if job is not None:
+            job.cancel()
+
+    def on_close(self):
+        if self.jobs.active and not messagebox.askyesno(
+                "Выход", "Есть незавершенные задания. Отменить их и выйти?"):
+            return
+        self.jobs.shutdown()
+        self.destroy()
+
     def log_message(self, widget, message):
         widget.config(state="normal")
         widget.insert("end", message + "\n")
@@ -372,26 +490,103 @@ class SmetaApp(TkinterDnD.Tk):
             self.object_drop.reset_widget()
             return
 
-        try:
-            self.log_message(self.object_log, f"Обработка файла: {os.path.basename(file_path)}")
+        self.log_message(self.object_log, f"Обработка файла: {os.path.basename(file_path)}")
+        self.object_drop.reset_widget()
+        self.submit_object_smeta(file_path, self.current_object_id)
+
+    def submit_object_smeta(self, file_path, object_id, force=False):
+        """Фоновая загрузка объектной сметы"""
+        name = os.path.basename(file_path)
+
+        def work(job):
+            with self.processor as p, job.cancellable(p.conn):
+                return p.process_object_smeta(file_path, object_id, force=force, progress=job.report)
+
+        def done(estimate_id):
+            self.log_message(self.object_log, f"✅ {name}: объектная смета успешно добавлена!")
+            self.invalidate_tree_nodes([f'obj_{object_id}'])
+            self.refresh_all_lists()
+            self.notebook.select(self.local_tab)
+
+        def failed(error):
+            if isinstance(error, AlreadyIngestedError):
+                if messagebox.askyesno("Файл уже загружен", f"{error}\n\nЗагрузить его повторно?"):
+                    self.submit_object_smeta(file_path, object_id, force=True)
+                else:
+                    self.log_message(self.object_log, f"⏭ {error}. Оставлены ранее загруженные данные")
+                return
+            error_msg = f"Ошибка: {str(error)}"
+            self.log_message(self.object_log, f"❌ {name}: {error_msg}")
+            messagebox.showerror("Ошибка", error_msg)
 
-            with self.processor as p:
-                success = p.process_object_smeta(file_path, self.current_object_id)
+        self.jobs.submit(f"Объектная смета: {name}", work, on_done=done, on_error=failed)
 
-            if success:
-                self.log_message(self.object_log, "✅ Объектная смета успешно добавлена!")
-                self.refresh_all_lists()
-                self.notebook.select(self.local_tab)
-            else:
-                self.log_message(self.object_log, "❌ Ошибка обработки объектной сметы")
+    def process_object_package(self):
+        """Загрузка ZIP архива или папки с объектной сметой и XML её локальных смет"""
+        if not self.current_object_id:
+            messagebox.showerror("Ошибка", "Сначала установите объект")
+            return
 
-            self.object_drop.reset_widget()
+        # Перетащенные папка или ZIP используются сразу, иначе - выбор архива
+        package_path = self.object_drop.get_file()
+        if not package_path or not (os.path.isdir(package_path) or package_path.lower().endswith('.zip')):
+            package_path = filedialog.askopenfilename(
+                title="Выберите ZIP архив пакета объекта",
+                filetypes=[("ZIP архивы", "*.zip"), ("Все файлы", "*.*")]
+            )
+        if not package_path:
+            return
 
-        except Exception as e:
-            error_msg = f"Ошибка: {str(e)}"
-            self.log_message(self.object_log, f"❌ {error_msg}")
+        name = os.path.basename(package_path)
+        object_id = self.current_object_id
+        self.log_message(self.object_log, f"Загрузка пакета: {name}")
+        self.object_drop.reset_widget()
+
+        def work(job):
+            with self.processor as p, job.cancellable(p.conn):
+                return p.process_object_package(package_path, object_id, progress=job.report)
+
+        def done(result):
+            if result['object_reused']:
+                self.log_message(self.object_log,
+                                 f"⏭ {result['object_file']}: объектная смета загружена ранее, дополняем её")
+            else:
+                self.log_message(self.object_log, f"✅ {result['object_file']}: объектная смета добавлена")
+
+            reports = result['local_reports']
+            failed = [r for r in reports if r['error']]
+            skipped = [r for r in reports if r['skipped']]
+            for r in reports:
+                if r['skipped']:
+                    self.log_message(self.object_log, f"⏭ {r['file']}: {r['skipped']}")
+                elif r['error']:
+                    self.log_message(self.object_log, f"❌ {r['file']}: {r['error']}")
+                else:
+                    self.log_message(
+                        self.object_log,
+                        f"✅ {r['file']}: {r['parse_time'] + r['write_time']:.2f} с, "
+                        f"стоимость {r['total_cost']:.2f} руб."
+                    )
+            for file_name in result['unmatched']:
+                self.log_message(self.object_log, f"⚠ Не найдена смета для файла: {file_name}")
+            for file_name in result['ignored']:
+                self.log_message(self.object_log, f"⚠ Пропущен файл неизвестного формата: {file_name}")
+
+            self.invalidate_tree_nodes([f'obj_{object_id}', f"oe_{result['object_estimate_id']}"])
+            self.refresh_all_lists()
+            messagebox.showinfo(
+                "Готово",
+                f"Загружено локальных смет: {len(reports) - len(failed) - len(skipped)}, "
+                f"с ошибками: {len(failed)}, уже загружено ранее: {len(skipped)}, "
+                f"не сопоставлено файлов: {len(result['unmatched'])}"
+            )
+
+        def failed(error):
+            error_msg = f"Ошибка: {str(error)}"
+            self.log_message(self.object_log, f"❌ {name}: {error_msg}")
             messagebox.showerror("Ошибка", error_msg)
-            self.object_drop.reset_widget()
+
+        self.jobs.submit(f"Пакет объекта: {name}", work, on_done=done, on_error=failed)
 
     def process_local_smeta(self):
         if not self.current_estimate_id:
@@ -403,28 +598,127 @@ class SmetaApp(TkinterDnD.Tk):
             messagebox.showerror("Ошибка", "Файл не выбран")
             return
 
-        try:
-            self.log_message(self.local_log, f"Обработка файла: {os.path.basename(file_path)}")
-            with self.processor as p:
-                success, total_cost = p.process_xml_estimate(file_path, self.current_estimate_id)
-
+        self.log_message(self.local_log, f"Обработка файла: {os.path.basename(file_path)}")
+        self.local_drop.reset_widget()
+        # Деактивируем кнопки: смета уже обрабатывается
+        self.process_local_btn.config(state=tk.DISABLED)
+        self.delete_local_btn.config(state=tk.DISABLED)
+        self.submit_local_smeta(file_path, self.current_estimate_id)
+
+    def submit_local_smeta(self, file_path, estimate_id, force=False):
+        """Фоновая загрузка локальной сметы"""
+        name = os.path.basename(file_path)
+
+        def work(job):
+            with self.processor as p, job.cancellable(p.conn):
+                success, total_cost = p.process_xml_estimate(file_path, estimate_id, force=force,
+                                                             progress=job.report)
+                if success:
+                    p.update_estimate_price(estimate_id, total_cost)
+                return success, total_cost
+
+        def done(result):
+            success, total_cost = result
             if success:
                 self.log_message(self.local_log,
-                                 f"Локальная смета успешно обработана! Стоимость: {total_cost:.2f} руб.")
+                                 f"{name}: локальная смета успешно обработана! Стоимость: {total_cost:.2f} руб.")
+                self.invalidate_tree_nodes([f'le_{estimate_id}'])
                 self.refresh_all_lists()
-                with self.processor as p:
-                    p.update_estimate_price(self.current_estimate_id, total_cost)
-                self.update_local_estimates_list()
-                self.local_drop.reset_widget()  # Сбрасываем виджет после успешной обработки
-                # Деактивируем кнопки после обработки
-                self.process_local_btn.config(state=tk.DISABLED)
-                self.delete_local_btn.config(state=tk.DISABLED)
             else:
-                self.log_message(self.local_log, "Ошибка обработки локальной сметы")
+                self.log_message(self.local_log, f"{name}: ошибка обработки локальной сметы")
+
+        def failed(error):
+            if isinstance(error, AlreadyIngestedError):
+                if messagebox.askyesno("Файл уже загружен", f"{error}\n\nЗагрузить его повторно?"):
+                    self.submit_local_smeta(file_path, estimate_id, force=True)
+                else:
+                    self.log_message(self.local_log, f"⏭ {error}. Оставлены ранее загруженные данные")
+                return
+            self.log_message(self.local_log, f"{name}: ошибка: {str(error)}")
+            messagebox.showerror("Ошибка", str(error))
 
+        self.jobs.submit(f"Локальная смета: {name}", work, on_done=done, on_error=failed)
+
+    def process_local_batch(self):
+        """Пакетная загрузка всех XML из папки в локальные сметы одной объектной сметы"""
+        folder = filedialog.askdirectory(title="Выберите папку с локальными сметами (XML)")
+        if not folder:
+            return
+
+        file_paths = [
+            os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith('.xml')
+        ]
+        if not file_paths:
+            messagebox.showwarning("Внимание", "В папке нет XML файлов")
+            return
+
+        try:
+            with self.processor as p:
+                estimates = p.get_unprocessed_local_estimates()
         except Exception as e:
             self.log_message(self.local_log, f"Ошибка: {str(e)}")
             messagebox.showerror("Ошибка", str(e))
+            return
+
+        # Шифры смет (02-01-01 ...) повторяются у разных объектов, поэтому
+        # сопоставляем файлы в пределах одной объектной сметы
+        selection = self.local_listbox.curselection()
+        if selection and estimates and selection[0] < len(estimates):
+            object_estimate_id = estimates[selection[0]][4]
+        else:
+            object_estimate_ids = {row[4] for row in estimates}
+            if len(object_estimate_ids) != 1:
+                messagebox.showerror("Ошибка", "Выберите в списке любую смету нужного объекта")
+                return
+            object_estimate_id = object_estimate_ids.pop()
+
+        self.log_message(self.local_log, f"Пакетная загрузка папки: {folder}")
+
+        def work(job):
+            with self.processor as p, job.cancellable(p.conn):
+                job.report(0.0, "Сопоставление файлов со сметами")
+                matched, unmatched = p.match_local_estimate_files(file_paths, object_estimate_id)
+                reports = p.process_xml_estimates_batch(matched, progress=job.report) if matched else []
+                return reports, unmatched
+
+        def done(result):
+            reports, unmatched = result
+            for file_path in unmatched:
+                self.log_message(self.local_log, f"⚠ Не найдена смета для файла: {os.path.basename(file_path)}")
+            if not reports:
+                messagebox.showwarning("Внимание", "Ни один файл не сопоставлен со сметами")
+                return
+
+            failed = [r for r in reports if r['error']]
+            skipped = [r for r in reports if r['skipped']]
+            for r in reports:
+                name = os.path.basename(r['file'])
+                if r['skipped']:
+                    self.log_message(self.local_log, f"⏭ {name}: {r['skipped']}")
+                elif r['error']:
+                    self.log_message(self.local_log, f"❌ {name}: {r['error']}")
+                else:
+                    self.log_message(
+                        self.local_log,
+                        f"✅ {name}: {r['parse_time'] + r['write_time']:.2f} с "
+                        f"(разбор {r['parse_time']:.2f} с, запись {r['write_time']:.2f} с), "
+                        f"стоимость {r['total_cost']:.2f} руб."
+                    )
+
+            self.invalidate_tree_nodes([f'oe_{object_estimate_id}'])
+            self.refresh_all_lists()
+            messagebox.showinfo(
+                "Готово",
+                f"Загружено смет: {len(reports) - len(failed) - len(skipped)}, с ошибками: {len(failed)}, "
+                f"уже загружено ранее: {len(skipped)}, не сопоставлено файлов: {len(unmatched)}"
+            )
+
+        def failed(error):
+            self.log_message(self.local_log, f"Ошибка: {str(error)}")
+            messagebox.showerror("Ошибка", str(error))
+
+        self.jobs.submit(f"Папка смет: {os.path.basename(folder)}", work, on_done=done, on_error=failed)
 
     def update_local_estimates_list(self):
         self.local_listbox.delete(0, tk.END)
@@ -502,14 +796,27 @@ class SmetaApp(TkinterDnD.Tk):
     def clear_object_selection(self):
         self.object_listbox.selection_clear(0, tk.END)
 
+    def submit_report(self, title, done_message, generate, *args, **kwargs):
+        """Фоновая генерация отчета: generate(*args, job=job, **kwargs) возвращает True при успехе"""
+        def work(job):
+            if not generate(*args, job=job, **kwargs):
+                job.check_cancelled()  # прерванный запрос отчет считает обычной ошибкой
+                raise Exception("Отчет не сформирован (подробности - в консоли)")
+
+        self.jobs.submit(
+            title, work,
+            on_done=lambda result: messagebox.showinfo("Готово", done_message),
+            on_error=lambda error: messagebox.showerror("Ошибка", str(error))
+        )
+
     def run_all_entries_report(self):
         ids = self.get_selected_object_ids()
         if ids:
             filename = filedialog.asksaveasfilename(defaultextension=".xlsx",
                                                     initialfile="анализ_вхождения_по_вхождениям.xlsx")
             if filename:
-                generate_all_entries_report(DB_CONFIG, filename, object_ids=ids)
-                messagebox.showinfo("Готово", "Отчет по вхождениям сформирован!")
+                self.submit_report("Отчет по вхождениям", "Отчет по вхождениям сформирован!",
+                                   generate_all_entries_report, DB_CONFIG, filename, object_ids=ids)
 
     def run_estimates_report(self):
         ids = self.get_selected_object_ids()
@@ -517,8 +824,8 @@ class SmetaApp(TkinterDnD.Tk):
             filename = filedialog.asksaveasfilename(defaultextension=".xlsx",
                                                     initialfile="анализ_смет_по_количеству_смет.xlsx")
             if filename:
-                generate_estimates_report(DB_CONFIG, filename, object_ids=ids)
-                messagebox.showinfo("Готово", "Отчет по количеству смет сформирован!")
+                self.submit_report("Отчет по количеству смет", "Отчет по количеству смет сформирован!",
+                                   generate_estimates_report, DB_CONFIG, filename, object_ids=ids)
 
     def run_cost_report(self):
         ids = self.get_selected_object_ids()
@@ -526,14 +833,23 @@ class SmetaApp(TkinterDnD.Tk):
             filename = filedialog.asksaveasfilename(defaultextension=".xlsx",
                                                     initialfile="анализ_смет_по_удельной_стоимости.xlsx")
             if filename:
-                generate_cost_report(DB_CONFIG, object_ids=ids, filename=filename)
-                messagebox.showinfo("Готово", "Отчет по удельной стоимости сформирован!")
+                self.submit_report("Отчет по удельной стоимости", "Отчет по удельной стоимости сформирован!",
+                                   generate_cost_report, DB_CONFIG, object_ids=ids, filename=filename)
+
+    def run_all_reports(self):
+        """Все отчеты по выбранным объектам в одну папку, по одной выборке из БД"""
+        ids = self.get_selected_object_ids()
+        if ids:
+            folder = filedialog.askdirectory(title="Выберите папку для отчетов")
+            if folder:
+                self.submit_report("Все отчеты анализа", f"Отчеты сохранены в папке {folder}",
+                                   generate_all_reports, DB_CONFIG, folder, ids)
 
     def run_ar_kr_report(self):
         filename = filedialog.asksaveasfilename(defaultextension=".xlsx", initialfile="анализ_ар_кр.xlsx")
         if filename:
-            generate_ar_kr_report(DB_CONFIG, filename)
-            messagebox.showinfo("Готово", "Отчет по АР/КР сформирован!")
+            self.submit_report("Отчет по АР/КР", "Отчет по АР/КР сформирован!",
+                               generate_ar_kr_report, DB_CONFIG, filename)
 
     def delete_selected_estimate(self):
         selection = self.local_listbox.curselection()
@@ -544,148 +860,129 @@ class SmetaApp(TkinterDnD.Tk):
         index = selection[0]
 
         try:
-            processor = SmetaProcessor()
-            processor.conn = processor.get_db_connection()
-
-            estimates = processor.get_unprocessed_local_estimates()
-            if not estimates or index >= len(estimates):
-                messagebox.showerror("Ошибка", "Смета не найдена в базе")
-                processor.conn.close()
-                return
-
-            estimate_id, estimate_name, oe_name, obj_name, oe_id = estimates[index]
-
-            confirm = messagebox.askyesno(
-                "Подтверждение",
-                f"Удалить смету '{estimate_name}' (ID: {estimate_id})?"
-            )
-            if not confirm:
-                processor.conn.close()
-                return
+            with self.processor as p:
+                estimates = p.get_unprocessed_local_estimates()
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось подключиться к базе данных: {str(e)}")
+            return
 
-            try:
-                with processor.conn.cursor() as cursor:
-                    # Получаем ID объектной сметы
-                    cursor.execute(
-                        "SELECT object_estimates_id FROM local_estimates WHERE id = %s",
-                        (estimate_id,)
-                    )
-                    oe_id = cursor.fetchone()[0]
+        if not estimates or index >= len(estimates):
+            messagebox.showerror("Ошибка", "Смета не найдена в базе")
+            return
 
-                    # 1. Удаляем связанные материалы, работы и разделы
-                    # (существующий код удаления)
+        estimate_id, estimate_name, oe_name, obj_name, oe_id = estimates[index]
 
-                    # 2. Удаляем саму локальную смету
-                    cursor.execute(
-                        "DELETE FROM local_estimates WHERE id = %s",
-                        (estimate_id,)
-                    )
+        confirm = messagebox.askyesno(
+            "Подтверждение",
+            f"Удалить смету '{estimate_name}' (ID: {estimate_id})?"
+        )
+        if not confirm:
+            return
 
-                    # 3. Проверяем, остались ли другие локальные сметы у объектной сметы
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM local_estimates WHERE object_estimates_id = %s",
-                        (oe_id,)
-                    )
-                    remaining_local = cursor.fetchone()[0]
-
-                    if remaining_local == 0:
-                        # Если нет других локальных смет - удаляем объектную смету
-                        cursor.execute(
-                            "DELETE FROM object_estimates WHERE id = %s RETURNING object_id",
-                            (oe_id,)
-                        )
-                        deleted_oe = cursor.fetchone()
-
-                        if deleted_oe:
-                            object_id = deleted_oe[0]
-
-                            # Проверяем, остались ли другие объектные сметы у объекта
-                            cursor.execute(
-                                "SELECT COUNT(*) FROM object_estimates WHERE object_id = %s",
-                                (object_id,)
-                            )
-                            remaining_object = cursor.fetchone()[0]
-
-                            if remaining_object == 0:
-                                # Если нет других объектных смет - удаляем объект
-                                cursor.execute(
-                                    "DELETE FROM objects WHERE id = %s",
-                                    (object_id,)
-                                )
-                                self.log_message(self.local_log,
-                                                 f"Удален объект ID: {object_id}, так как не осталось смет")
-
-                    processor.conn.commit()
-                    self.log_message(self.local_log, f"Удалена локальная смета: {estimate_name}")
-                    self.refresh_all_lists()
+        try:
+            # Опустевшие объектная смета и объект удаляются вместе со сметой
+            with self.processor as p:
+                deleted = p.delete_tree_nodes(local_estimate_ids=[estimate_id])
+            self.invalidate_tree_nodes([f'le_{estimate_id}'] +
+                                       [f'oe_{oe_id}' for oe_id in deleted['object_estimates']])
 
-            except Exception as e:
-                processor.conn.rollback()
-                messagebox.showerror("Ошибка", f"Не удалось удалить смету: {str(e)}")
-            finally:
-                processor.conn.close()
+            for object_id in deleted['objects']:
+                self.log_message(self.local_log, f"Удален объект ID: {object_id}, так как не осталось смет")
+            self.log_message(self.local_log, f"Удалена локальная смета: {estimate_name}")
+            self.refresh_all_lists()
 
         except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось подключиться к базе данных: {str(e)}")
+            messagebox.showerror("Ошибка", f"Не удалось удалить смету: {str(e)}")
 
     def update_estimates_tree(self):
-        """Обновление дерева смет с нумерацией объектов"""
-        self.estimates_tree.delete(*self.estimates_tree.get_children())
+        """
+        Обновление дерева смет с нумерацией объектов.
+
+        Загружаются только объекты, вложенные узлы - при первом раскрытии
+        (load_tree_children). Раскрытые до обновления узлы раскрываются снова,
+        их дочерние узлы берутся из кэша, если он не сброшен invalidate_tree_nodes.
+        """
+        tree = self.estimates_tree
+        opened = set()
+        pending = list(tree.get_children())
+        while pending:
+            iid = pending.pop()
+            if tree.item(iid, 'open'):
+                opened.add(iid)
+                pending.extend(tree.get_children(iid))
+        selected = tree.selection()
+
+        tree.delete(*tree.get_children())
 
         try:
             with self.processor as p:
-                # Получаем все объекты, сортированные по ID
-                cursor = p.conn.cursor()
-                cursor.execute("SELECT id, object_name FROM objects ORDER BY id")
-                objects = cursor.fetchall()
+                objects = p.get_objects()
 
-                for idx, (obj_id, obj_name) in enumerate(objects, 1):
+                for idx, (obj_id, obj_name, has_children) in enumerate(objects, 1):
                     # Добавляем порядковый номер к названию объекта
-                    obj_node = self.estimates_tree.insert(
-                        '', 'end',
-                        text=f"{idx}. {obj_name}",  # Вот здесь добавляем номер
-                        values=('Объект', ''),
-                        iid=f'obj_{obj_id}',
-                        open=True
-                    )
+                    self.insert_tree_node('', (f'obj_{obj_id}', f"{idx}. {obj_name}", ('Объект', ''), has_children))
 
-                    # Остальной код остаётся без изменений...
-                    cursor.execute(
-                        "SELECT id, name_object_estimate, object_estimates_price "
-                        "FROM object_estimates WHERE object_id = %s ORDER BY name_object_estimate",
-                        (obj_id,)
-                    )
-                    obj_estimates = cursor.fetchall()
-
-                    for oe_id, oe_name, oe_price in obj_estimates:
-                        oe_node = self.estimates_tree.insert(
-                            obj_node, 'end',
-                            text=oe_name,
-                            values=('Объектная смета', f"{oe_price:,.2f} руб."),
-                            iid=f'oe_{oe_id}',
-                            open=True
-                        )
-
-                        cursor.execute(
-                            "SELECT id, name_local_estimate, local_estimates_price "
-                            "FROM local_estimates WHERE object_estimates_id = %s "
-                            "ORDER BY name_local_estimate",
-                            (oe_id,)
-                        )
-                        local_estimates = cursor.fetchall()
-
-                        for le_id, le_name, le_price in local_estimates:
-                            price_str = f"{le_price:,.2f} руб." if le_price else "Не обработана"
-                            self.estimates_tree.insert(
-                                oe_node, 'end',
-                                text=le_name,
-                                values=('Локальная смета', price_str),
-                                iid=f'le_{le_id}'
-                            )
+                # Раскрытые узлы - в порядке уровней: объект раньше своих объектных смет
+                for iid in sorted(opened, key=lambda node: not node.startswith('obj_')):
+                    if tree.exists(iid):
+                        self.load_tree_children(iid)
+                        tree.item(iid, open=True)
+
+            tree.selection_set([iid for iid in selected if tree.exists(iid)])
+
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить данные: {str(e)}")
 
+    def insert_tree_node(self, parent, node):
+        """Вставляет узел (iid, текст, значения, есть ли дочерние); у узла с дочерними - заглушка"""
+        iid, text, values, has_children = node
+        self.estimates_tree.insert(parent, 'end', iid=iid, text=text, values=values)
+        if has_children:
+            self.estimates_tree.insert(iid, 'end', iid=f'stub_{iid}', text="Загрузка...")
+
+    def fetch_tree_children(self, iid):
+        """Дочерние узлы из БД: объектные сметы объекта или локальные сметы объектной сметы"""
+        kind, node_id = iid.split('_', 1)
+        with self.processor as p:
+            if kind == 'obj':
+                return [
+                    (f'oe_{oe_id}', oe_name, ('Объектная смета', f"{oe_price:,.2f} руб."), has_children)
+                    for oe_id, oe_name, oe_price, has_children in p.get_object_estimates(int(node_id))
+                ]
+            return [
+                (f'le_{le_id}', le_name,
+                 ('Локальная смета', f"{le_price:,.2f} руб." if le_price else "Не обработана"), False)
+                for le_id, le_name, le_price in p.get_local_estimates(int(node_id))
+            ]
+
+    def load_tree_children(self, iid):
+        """Заполняет дочерние узлы при первом раскрытии (из кэша или одним запросом к БД)"""
+        stub = f'stub_{iid}'
+        if not self.estimates_tree.exists(stub):
+            return  # уже загружены
+        children = self.tree_cache.get(iid)
+        if children is None:
+            children = self.tree_cache[iid] = self.fetch_tree_children(iid)
+        self.estimates_tree.delete(stub)
+        for node in children:
+            self.insert_tree_node(iid, node)
+
+    def on_tree_open(self, event):
+        try:
+            self.load_tree_children(self.estimates_tree.focus())
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось загрузить данные: {str(e)}")
 
+    def invalidate_tree_nodes(self, iids):
+        """
+        Сбрасывает кэш дерева для измененных узлов: их собственный список дочерних
+        и список родителя, в котором они показаны (стоимость, удаление)
+        """
+        iids = set(iids)
+        for parent in list(self.tree_cache):
+            if parent in iids or any(node[0] in iids for node in self.tree_cache[parent]):
+                del self.tree_cache[parent]
+
     def on_tree_select(self, event):
         """Обработка выбора элемента в дереве"""
         selected = self.estimates_tree.selection()
@@ -695,288 +992,52 @@ class SmetaApp(TkinterDnD.Tk):
             self.delete_btn.config(state=tk.DISABLED)
 
     def delete_selected_estimate_tree(self):
-        """Удаление выбранной сметы с каскадным удалением"""
+        """Удаление выбранных в дереве узлов (можно несколько) с каскадным удалением"""
         selected = self.estimates_tree.selection()
         if not selected:
             return
 
-        item_id = selected[0]
+        # ID узлов по уровням: obj_<id>, oe_<id>, le_<id> (заглушки stub_... пропускаются)
+        ids = {'obj': [], 'oe': [], 'le': []}
+        for item_id in selected:
+            kind, node_id = item_id.split('_', 1)
+            if kind in ids:
+                ids[kind].append(int(node_id))
+        if not any(ids.values()):
+            return
 
-        if item_id.startswith('le_'):
-            # Удаление локальной сметы
-            le_id = int(item_id[3:])
-            confirm = messagebox.askyesno(
-                "Подтверждение",
-                "Удалить локальную смету и все связанные разделы, работы и материалы?"
-            )
-            if confirm:
-                try:
-                    with self.processor as p:
-                        # Удаляем материалы, работы и разделы для этой сметы
-                        cursor = p.conn.cursor()
-
-                        # 1. Находим все разделы для этой сметы
-                        cursor.execute("SELECT id FROM sections WHERE estimate_id = %s", (le_id,))
-                        section_ids = [row[0] for row in cursor.fetchall()]
-
-                        if section_ids:
-                            # 2. Находим все работы для этих разделов
-                            cursor.execute(
-                                "SELECT id FROM work WHERE local_section_id IN %s",
-                                (tuple(section_ids),)
-                            )
-                            work_ids = [row[0] for row in cursor.fetchall()]
-
-                            if work_ids:
-                                # 3. Удаляем все материалы для этих работ
-                                cursor.execute(
-                                    "DELETE FROM materials WHERE work_id IN %s",
-                                    (tuple(work_ids),)
-                                )
-
-                            # 4. Удаляем все работы
-                            cursor.execute(
-                                "DELETE FROM work WHERE local_section_id IN %s",
-                                (tuple(section_ids),)
-                            )
-
-                        # 5. Удаляем все разделы
-                        cursor.execute("DELETE FROM sections WHERE estimate_id = %s", (le_id,))
-
-                        # 6. Получаем ID объектной сметы для проверки после удаления
-                        cursor.execute(
-                            "SELECT object_estimates_id FROM local_estimates WHERE id = %s",
-                            (le_id,)
-                        )
-                        oe_id = cursor.fetchone()[0]
-
-                        # 7. Удаляем локальную смету
-                        cursor.execute("DELETE FROM local_estimates WHERE id = %s", (le_id,))
-
-                        # 8. Проверяем, остались ли другие локальные сметы у объектной сметы
-                        cursor.execute(
-                            "SELECT COUNT(*) FROM local_estimates WHERE object_estimates_id = %s",
-                            (oe_id,)
-                        )
-                        remaining_le = cursor.fetchone()[0]
-
-                        if remaining_le == 0:
-                            # Если нет других локальных смет - удаляем объектную смету
-                            cursor.execute(
-                                "SELECT object_id FROM object_estimates WHERE id = %s",
-                                (oe_id,)
-                            )
-                            obj_id = cursor.fetchone()[0]
-
-                            cursor.execute(
-                                "DELETE FROM object_estimates WHERE id = %s",
-                                (oe_id,)
-                            )
-
-                            # Проверяем, остались ли другие объектные сметы у объекта
-                            cursor.execute(
-                                "SELECT COUNT(*) FROM object_estimates WHERE object_id = %s",
-                                (obj_id,)
-                            )
-                            remaining_oe = cursor.fetchone()[0]
-
-                            if remaining_oe == 0:
-                                # Если нет других объектных смет - удаляем объект
-                                cursor.execute(
-                                    "DELETE FROM objects WHERE id = %s",
-                                    (obj_id,)
-                                )
-
-                        p.conn.commit()
-                        self.refresh_all_lists()
-                        messagebox.showinfo("Успех", "Локальная смета и все связанные данные удалены")
-
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось удалить смету: {str(e)}")
-
-        elif item_id.startswith('oe_'):
-            # Удаление объектной сметы (со всеми локальными)
-            oe_id = int(item_id[3:])
-            confirm = messagebox.askyesno(
-                "Подтверждение",
-                "Удалить объектную смету и все связанные локальные сметы, разделы, работы и материалы?"
-            )
-            if confirm:
-                try:
-                    with self.processor as p:
-                        cursor = p.conn.cursor()
-
-                        # 1. Находим все локальные сметы для этой объектной сметы
-                        cursor.execute(
-                            "SELECT id FROM local_estimates WHERE object_estimates_id = %s",
-                            (oe_id,)
-                        )
-                        le_ids = [row[0] for row in cursor.fetchall()]
-
-                        if le_ids:
-                            # 2. Находим все разделы для этих смет
-                            cursor.execute(
-                                "SELECT id FROM sections WHERE estimate_id IN %s",
-                                (tuple(le_ids),)
-                            )
-                            section_ids = [row[0] for row in cursor.fetchall()]
-
-                            if section_ids:
-                                # 3. Находим все работы для этих разделов
-                                cursor.execute(
-                                    "SELECT id FROM work WHERE local_section_id IN %s",
-                                    (tuple(section_ids),)
-                                )
-                                work_ids = [row[0] for row in cursor.fetchall()]
-
-                                if work_ids:
-                                    # 4. Удаляем все материалы для этих работ
-                                    cursor.execute(
-                                        "DELETE FROM materials WHERE work_id IN %s",
-                                        (tuple(work_ids),)
-                                    )
-
-                                # 5. Удаляем все работы
-                                cursor.execute(
-                                    "DELETE FROM work WHERE local_section_id IN %s",
-                                    (tuple(section_ids),)
-                                )
-
-                            # 6. Удаляем все разделы
-                            cursor.execute(
-                                "DELETE FROM sections WHERE estimate_id IN %s",
-                                (tuple(le_ids),)
-                            )
-
-                        # 7. Удаляем все локальные сметы
-                        cursor.execute(
-                            "DELETE FROM local_estimates WHERE object_estimates_id = %s",
-                            (oe_id,)
-                        )
-
-                        # 8. Получаем ID объекта для проверки после удаления
-                        cursor.execute(
-                            "SELECT object_id FROM object_estimates WHERE id = %s",
-                            (oe_id,)
-                        )
-                        obj_id = cursor.fetchone()[0]
-
-                        # 9. Удаляем объектную смету
-                        cursor.execute(
-                            "DELETE FROM object_estimates WHERE id = %s",
-                            (oe_id,)
-                        )
-
-                        # 10. Проверяем, остались ли другие объектные сметы у объекта
-                        cursor.execute(
-                            "SELECT COUNT(*) FROM object_estimates WHERE object_id = %s",
-                            (obj_id,)
-                        )
-                        remaining_oe = cursor.fetchone()[0]
-
-                        if remaining_oe == 0:
-                            # Если нет других объектных смет - удаляем объект
-                            cursor.execute(
-                                "DELETE FROM objects WHERE id = %s",
-                                (obj_id,)
-                            )
-
-                        p.conn.commit()
-                        self.refresh_all_lists()
-                        messagebox.showinfo("Успех", "Объектная смета и все связанные данные удалены")
-
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось удалить смету: {str(e)}")
-
-        elif item_id.startswith('obj_'):
-            # Удаление объекта (со всеми объектными и локальными сметами)
-            obj_id = int(item_id[4:])
-            confirm = messagebox.askyesno(
-                "Подтверждение",
-                "Удалить объект и все связанные объектные и локальные сметы, разделы, работы и материалы?"
+        parts = []
+        if ids['obj']:
+            parts.append(f"объектов: {len(ids['obj'])}")
+        if ids['oe']:
+            parts.append(f"объектных смет: {len(ids['oe'])}")
+        if ids['le']:
+            parts.append(f"локальных смет: {len(ids['le'])}")
+        confirm = messagebox.askyesno(
+            "Подтверждение",
+            f"Удалить выбранное ({', '.join(parts)}) и все связанные сметы, разделы, работы и материалы?"
+        )
+        if not confirm:
+            return
+
+        try:
+            with self.processor as p:
+                deleted = p.delete_tree_nodes(object_ids=ids['obj'], object_estimate_ids=ids['oe'],
+                                              local_estimate_ids=ids['le'])
+            self.invalidate_tree_nodes(
+                [item_id for item_id in selected if not item_id.startswith('stub_')]
+                + [f'oe_{oe_id}' for oe_id in deleted['object_estimates']]
             )
-            if confirm:
-                try:
-                    with self.processor as p:
-                        cursor = p.conn.cursor()
-
-                        # 1. Находим все объектные сметы для этого объекта
-                        cursor.execute(
-                            "SELECT id FROM object_estimates WHERE object_id = %s",
-                            (obj_id,)
-                        )
-                        oe_ids = [row[0] for row in cursor.fetchall()]
-
-                        if oe_ids:
-                            # 2. Находим все локальные сметы для этих объектных смет
-                            cursor.execute(
-                                "SELECT id FROM local_estimates WHERE object_estimates_id IN %s",
-                                (tuple(oe_ids),)
-                            )
-                            le_ids = [row[0] for row in cursor.fetchall()]
-
-                            if le_ids:
-                                # 3. Находим все разделы для этих смет
-                                cursor.execute(
-                                    "SELECT id FROM sections WHERE estimate_id IN %s",
-                                    (tuple(le_ids),)
-                                )
-                                section_ids = [row[0] for row in cursor.fetchall()]
-
-                                if section_ids:
-                                    # 4. Находим все работы для этих разделов
-                                    cursor.execute(
-                                        "SELECT id FROM work WHERE local_section_id IN %s",
-                                        (tuple(section_ids),)
-                                    )
-                                    work_ids = [row[0] for row in cursor.fetchall()]
-
-                                    if work_ids:
-                                        # 5. Удаляем все материалы для этих работ
-                                        cursor.execute(
-                                            "DELETE FROM materials WHERE work_id IN %s",
-                                            (tuple(work_ids),)
-                                        )
-
-                                    # 6. Удаляем все работы
-                                    cursor.execute(
-                                        "DELETE FROM work WHERE local_section_id IN %s",
-                                        (tuple(section_ids),)
-                                    )
-
-                                # 7. Удаляем все разделы
-                                cursor.execute(
-                                    "DELETE FROM sections WHERE estimate_id IN %s",
-                                    (tuple(le_ids),)
-                                )
-
-                            # 8. Удаляем все локальные сметы
-                            cursor.execute(
-                                "DELETE FROM local_estimates WHERE object_estimates_id IN %s",
-                                (tuple(oe_ids),)
-                            )
-
-                        # 9. Удаляем все объектные сметы
-                        cursor.execute(
-                            "DELETE FROM object_estimates WHERE object_id = %s",
-                            (obj_id,)
-                        )
-
-                        # 10. Удаляем объект
-                        cursor.execute(
-                            "DELETE FROM objects WHERE id = %s",
-                            (obj_id,)
-                        )
-
-                        p.conn.commit()
-                        self.refresh_all_lists()
-                        messagebox.showinfo("Успех", "Объект и все связанные данные удалены")
-
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось удалить объект: {str(e)}")
+            self.refresh_all_lists()
+            messagebox.showinfo("Успех", "Выбранные элементы и все связанные данные удалены")
+
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось удалить: {str(e)}")
 
     def refresh_all_lists(self):
         """Обновляет все списки во всех разделах"""
-        self.update_estimates_tree()  # Обновляем дерево в разделе "Управление сметами"
-        self.update_object_list()  # Обновляем список объектов в разделе "Анализ"
-        self.update_local_estimates_list()  # Обновляем список локальных смет
\ No newline at end of file
+        # Одно соединение на все списки: вложенные with self.processor работают в нем
+        with self.processor:
+            self.update_estimates_tree()  # Обновляем дерево в разделе "Управление сметами"
+            self.update_object_list()  # Обновляем список объектов в разделе "Анализ"
+            self.update_local_estimates_list()  # Обновляем список локальных смет
\ No newline at end of file